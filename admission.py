@@ -0,0 +1,204 @@
+"""Per-model concurrency limits with a bounded FIFO wait queue."""
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from backend_pool import model_name
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+from request_pipeline import RequestError
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+# Concurrent generations per model and worker; 0 admits everything at once
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY") or 0)
+# Per-model overrides, e.g. {"qwen3:32b": 1, "qwen3:8b": 4}
+MODEL_CONCURRENCY_OVERRIDES = json.loads(os.getenv("MODEL_CONCURRENCY_OVERRIDES") or "{}")
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE") or 32)
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT") or 30)
+
+
+class AdmissionRejected(RequestError):
+    """The request was shed; ``retry_after`` is a hint in whole seconds"""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+class Slot:
+    """An admitted request's concurrency slot; release() may be called more than once"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(time.monotonic() - self.admitted_at)
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self, event):
+        self.event = event
+        self.granted = False
+
+
+class _LimiterBase:
+    """Admits up to ``limit`` requests of one model; later ones wait in FIFO order
+
+    A released slot is handed straight to the oldest waiter, so requests
+    that arrive later cannot overtake the queue.
+    """
+
+    def __init__(self, model, limit, queue_size=ADMISSION_QUEUE_SIZE, max_wait=ADMISSION_MAX_WAIT):
+        self.model = model
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        # Moving average of how long a request holds its slot
+        self.hold_time = 1.0
+        self._waiters = deque()
+
+    def retry_after(self):
+        """Seconds until the queue has probably drained, for the Retry-After header"""
+        return max(1, math.ceil(self.hold_time * (len(self._waiters) + 1) / self.limit))
+
+    def _try_admit(self):
+        """Admit immediately, or return a waiter to wait on (raises if the queue is full)"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            ADMISSION_ACTIVE.labels(model=self.model).set(self.active)
+            ADMISSION_WAIT.labels(model=self.model).observe(0)
+            return None
+        if len(self._waiters) >= self.queue_size:
+            ADMISSION_REJECTED.labels(model=self.model, reason='queue_full').inc()
+            raise AdmissionRejected(
+                f"Too many queued requests for model {self.model}", 429, self.retry_after()
+            )
+        waiter = _Waiter(self._new_event())
+        self._waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(model=self.model).set(len(self._waiters))
+        return waiter
+
+    def _finish_wait(self, waiter, waited):
+        if waiter.granted:
+            ADMISSION_WAIT.labels(model=self.model).observe(waited)
+            return
+        self._waiters.remove(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(model=self.model).set(len(self._waiters))
+        ADMISSION_REJECTED.labels(model=self.model, reason='timeout').inc()
+        raise AdmissionRejected(
+            f"Timed out after {waited:.1f}s waiting for model {self.model}", 503, self.retry_after()
+        )
+
+    def _handoff(self, held=None):
+        if held is not None:
+            self.hold_time = 0.8 * self.hold_time + 0.2 * held
+        if self._waiters:
+            # The slot passes to the oldest waiter; active stays the same
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            ADMISSION_QUEUE_DEPTH.labels(model=self.model).set(len(self._waiters))
+            waiter.event.set()
+        else:
+            self.active -= 1
+            ADMISSION_ACTIVE.labels(model=self.model).set(self.active)
+
+
+class ModelLimiter(_LimiterBase):
+    """Limiter for thread-based servers"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def _new_event(self):
+        return threading.Event()
+
+    def acquire(self):
+        """Wait for a slot; raises AdmissionRejected when shedding the request"""
+        start = time.monotonic()
+        with self._lock:
+            waiter = self._try_admit()
+        if waiter is not None:
+            waiter.event.wait(self.max_wait)
+            with self._lock:
+                self._finish_wait(waiter, time.monotonic() - start)
+        return Slot(self)
+
+    def _release(self, held):
+        with self._lock:
+            self._handoff(held)
+
+
+class AsyncModelLimiter(_LimiterBase):
+    """Limiter for the asyncio server; all methods run on the event loop"""
+
+    def _new_event(self):
+        return asyncio.Event()
+
+    async def acquire(self):
+        start = time.monotonic()
+        waiter = self._try_admit()
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.event.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # The client went away while queued
+                if waiter.granted:
+                    self._handoff()
+                else:
+                    self._waiters.remove(waiter)
+                    ADMISSION_QUEUE_DEPTH.labels(model=self.model).set(len(self._waiters))
+                raise
+            self._finish_wait(waiter, time.monotonic() - start)
+        return Slot(self)
+
+    def _release(self, held):
+        self._handoff(held)
+
+
+class AdmissionController:
+    """Creates one limiter per model on first use"""
+
+    def __init__(self, limiter_class=ModelLimiter, default_limit=MODEL_CONCURRENCY,
+                 overrides=MODEL_CONCURRENCY_OVERRIDES, **limiter_kwargs):
+        self.limiter_class = limiter_class
+        self.default_limit = default_limit
+        self.overrides = {model_name(model): limit for model, limit in overrides.items()}
+        self.limiter_kwargs = limiter_kwargs
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, model):
+        return self.overrides.get(model, self.default_limit)
+
+    def limiter(self, model):
+        """The model's limiter, or None when the model is not limited"""
+        model = model_name(model)
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limit = self.limit_for(model)
+            if limit <= 0:
+                return None
+            with self._lock:
+                limiter = self._limiters.setdefault(
+                    model, self.limiter_class(model, limit, **self.limiter_kwargs)
+                )
+        return limiter
+
+
+ADMISSION = AdmissionController(ModelLimiter)
@@ -0,0 +1,616 @@
+"""
+asyncio server mode for the unthink proxy.
+
+Serves the same routes as the Flask app in ``unthink_proxy`` but streams with
+aiohttp, so a single process can hold thousands of concurrent NDJSON streams
+instead of one stream per sync worker.
+
+Run with::
+
+    python async_proxy.py
+    gunicorn async_proxy:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:11434
+"""
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import (
+    ClientError, ClientSession, ClientTimeout, DummyCookieJar, TCPConnector, TraceConfig, web
+)
+
+from admission import AdmissionController, AdmissionRejected, AsyncModelLimiter
+from backend_pool import OLLAMA_SERVERS, BackendPool
+from compaction import COMPACTION_ENABLED, compact_history
+from capture import CAPTURE
+from health_prober import health_status
+from history import HISTORY_STRIP_ENABLED, strip_history
+from log_pipeline import debug_sampled
+from metadata_cache import METADATA_CACHE, METADATA_CACHE_ENABLED, MODEL_MANAGEMENT_PATHS
+from model_capabilities import (
+    CAPABILITIES, CAPABILITY_PROBE_TIMEOUT, THINKING_SUPPRESSION_ENABLED, suppress_thinking
+)
+from metrics import (
+    ACTIVE_REQUESTS, OLLAMA_REQUEST_ERRORS, REQUEST_COUNT, REQUEST_LATENCY,
+    THINKING_CONTENT_REMOVED, UPSTREAM_POOL_CONNECTIONS, UPSTREAM_POOL_WAIT,
+    endpoint_label, get_metrics
+)
+from ndjson_stream import UPSTREAM_READ_SIZE, ChatStreamProcessor, NDJSONFramer
+from unthink_proxy import (
+    CLOSE_THINK_TAG, MAX_RETRIES, OLLAMA_SERVER, OPEN_THINK_TAG,
+    PROXY_PORT, REQUEST_TIMEOUT, RETRY_DELAY, log_level, logger, stream_headers
+)
+from request_pipeline import RequestError, normalize_request
+from resilience import CircuitOpenError, RetryPolicy, error_status
+from response_cache import (
+    RESPONSE_CACHE, RESPONSE_CACHE_ENABLED, CacheRecorder, is_cacheable, request_key
+)
+from singleflight import SINGLE_FLIGHT_ENABLED, AsyncFlight, SingleFlightGroup, flight_key
+from stream_abort import OUTPUT_LENGTHS, DisconnectWatch, record_abort
+from stream_metrics import StreamMetrics
+from tag_profiles import TAG_PROFILES
+from thinking_budget import BudgetTracker, ThinkingBudgetExceeded, budget_for
+from timeouts import PhaseTimeoutError, StreamClock, record_timeout, request_phase, timeouts_for
+from upstream import UPSTREAM_IDLE_TIMEOUT, UPSTREAM_KEEPALIVE
+
+UPSTREAM = web.AppKey("upstream", ClientSession)
+POOL = web.AppKey("pool", BackendPool)
+LIMITS = web.AppKey("limits", AdmissionController)
+RETRY_POLICY = web.AppKey("retry_policy", RetryPolicy)
+
+ASYNC_FLIGHTS = SingleFlightGroup(AsyncFlight)
+# Keeps references to fire-and-forget tasks until they finish
+BACKGROUND_TASKS = set()
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': '*',
+}
+
+EXCLUDED_HEADERS = {
+    'content-encoding',
+    'content-length',
+    'transfer-encoding',
+    'connection'
+}
+
+
+def json_response(data, status):
+    return web.Response(text=json.dumps(data), status=status, content_type='application/json')
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Same metrics as metrics.MetricsMiddleware, for the aiohttp app"""
+    path = request.path
+    if path == '/metrics':
+        return await handler(request)
+    path = endpoint_label(path)
+
+    ACTIVE_REQUESTS.inc()
+    start_time = time.time()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        REQUEST_COUNT.labels(method=request.method, endpoint=path, status=status).inc()
+        REQUEST_LATENCY.labels(method=request.method, endpoint=path).observe(time.time() - start_time)
+        ACTIVE_REQUESTS.dec()
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Equivalent of the flask_cors configuration of the Flask app"""
+    if request.method == 'OPTIONS':
+        response = web.Response(status=204)
+    else:
+        response = await handler(request)
+    response.headers.update(CORS_HEADERS)
+    return response
+
+
+async def health_check(request):
+    """Health check endpoint for monitoring"""
+    pool = request.app[POOL]
+    if any(backend.prober.state is None for backend in pool.backends):
+        # The first snapshot may wait for a probe; keep it off the event loop
+        state = await asyncio.get_running_loop().run_in_executor(None, pool.health)
+    else:
+        state = pool.health()
+    return json_response(state, health_status(state))
+
+
+async def metrics(request):
+    """Prometheus metrics endpoint"""
+    return web.Response(body=get_metrics(), content_type='text/plain')
+
+
+async def show_model(app, model):
+    """/api/show of a model, for the capability registry"""
+    async with app[UPSTREAM].post(
+        f"{app[POOL].choose().url}/api/show",
+        json={"model": model},
+        timeout=ClientTimeout(total=CAPABILITY_PROBE_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def proxy_api(request):
+    """Proxy API requests to Ollama server"""
+    path = request.match_info['path']
+    start_time = time.time()
+    started = time.monotonic()
+    request_id = f"{int(start_time)}-{os.getpid()}"
+    debug = debug_sampled()
+
+    if path in MODEL_MANAGEMENT_PATHS:
+        # 模型管理请求原样转发，并使元数据缓存失效
+        return await forward(request, f"api/{path}")
+
+    if path not in ['generate', 'chat', 'show']:
+        logger.warning(f"[{request_id}] Invalid path requested: {path}")
+        return web.Response(text='Not Found', status=404)
+
+    is_litellm = 'litellm' in request.headers.get('User-Agent', '').lower()
+    try:
+        upstream_request = normalize_request(path, await request.read(), is_litellm, request_id)
+    except RequestError as e:
+        return json_response({"error": str(e)}, e.status)
+    path = upstream_request.path
+    try:
+        budget = budget_for(upstream_request.model, request.headers)
+    except ValueError as e:
+        return json_response({"error": f"Invalid thinking budget: {str(e)}"}, 400)
+
+    # Tags of the model's profile, or OPEN_THINK_TAG/CLOSE_THINK_TAG without one
+    tag_profile = TAG_PROFILES.profile_for(upstream_request.model)
+
+    # Thinking in earlier turns would only be evaluated again as prompt
+    if HISTORY_STRIP_ENABLED:
+        strip_history(upstream_request, OPEN_THINK_TAG, CLOSE_THINK_TAG, request_id, profile=tag_profile)
+
+    # Drop the oldest turns of an overlong history instead of letting Ollama truncate it
+    compaction = None
+    if COMPACTION_ENABLED:
+        compaction = compact_history(upstream_request, request_id)
+
+    # Turn thinking off upstream where the model allows it; the stripper
+    # still handles everything else
+    if THINKING_SUPPRESSION_ENABLED and path in ('chat', 'generate'):
+        switch = await CAPABILITIES.async_switch_for(
+            upstream_request.model, lambda model: show_model(request.app, model)
+        )
+        suppress_thinking(upstream_request, switch)
+
+    if debug:
+        logger.debug(f"[{request_id}] Parsed request data: {upstream_request.data}")
+
+    # Deterministic requests can be answered from the cache
+    cache_recorder = None
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED and is_cacheable(upstream_request):
+        cache_key = request_key(upstream_request)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info(f"[{request_id}] Serving cached response")
+            return web.Response(
+                body=b''.join(cached.replay(upstream_request.stream)),
+                headers=stream_headers(request_id, cache='HIT', compaction=compaction)
+            )
+        cache_recorder = CacheRecorder(RESPONSE_CACHE, cache_key, path)
+
+    # Identical requests share one upstream generation
+    flight = None
+    if SINGLE_FLIGHT_ENABLED and path in ('chat', 'generate'):
+        flight, leader = ASYNC_FLIGHTS.join(flight_key(upstream_request, budget, tag_profile))
+        if not leader:
+            logger.info(f"[{request_id}] Joining in-flight generation")
+            return await stream_to_client(
+                request, flight.subscribe(), stream_headers(request_id, compaction=compaction)
+            )
+
+    # Per-model concurrency limit: wait in a bounded queue or get shed
+    slot = None
+    limiter = request.app[LIMITS].limiter(upstream_request.model) if path in ('chat', 'generate') else None
+    if limiter is not None:
+        try:
+            slot = await limiter.acquire()
+        except AdmissionRejected as e:
+            logger.warning(f"[{request_id}] Request rejected: {str(e)}")
+            if flight is not None:
+                flight.publish(json.dumps({"error": str(e)}).encode('utf-8') + b'\n')
+                flight.finish()
+            response = json_response({"error": str(e)}, e.status)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+
+    session = request.app[UPSTREAM]
+    pool = request.app[POOL]
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+
+    body = upstream_request.body()
+
+    def fail(message, status, retry_after=None):
+        if slot is not None:
+            slot.release()
+        if flight is not None:
+            flight.publish(json.dumps({"error": message}).encode('utf-8') + b'\n')
+            flight.finish()
+        response = json_response({"error": message}, status)
+        if retry_after:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    # Only connection-level failures are retried, with jittered exponential
+    # backoff and a global retry budget; another backend is tried right away
+    retry_policy = request.app[RETRY_POLICY]
+    retry_policy.start()
+    phase_timeouts = timeouts_for(upstream_request.model)
+    clock = StreamClock(phase_timeouts, time.monotonic())
+    # The read timeout of the session would also apply to the body, so the
+    # wait for the response headers gets its own deadline
+    request_timeout = ClientTimeout(total=None, sock_connect=phase_timeouts.connect, sock_read=None)
+    tried = []
+    attempt = 0
+    while True:
+        attempt += 1
+        upstream = None
+        try:
+            lease = pool.acquire(upstream_request.model, exclude=tried)
+        except CircuitOpenError as e:
+            logger.error(f"[{request_id}] {str(e)}")
+            return fail(str(e), 503, e.retry_after)
+        try:
+            sent_at = time.time()
+            async with asyncio.timeout(phase_timeouts.first_byte):
+                upstream = await session.post(
+                    f"{lease.url}/api/{path}",
+                    data=body,
+                    headers=headers,
+                    timeout=request_timeout
+                )
+            upstream.raise_for_status()
+            lease.record_response(time.time() - sent_at)
+            break
+        except (ClientError, asyncio.TimeoutError) as e:
+            phase = request_phase(e)
+            if phase is not None:
+                record_timeout(phase)
+            if upstream is not None:
+                upstream.release()
+            lease.release()
+            lease.record_failure(e)
+            tried.append(lease.backend)
+            error_type = type(e).__name__
+            OLLAMA_REQUEST_ERRORS.labels(error_type=error_type).inc()
+            logger.error(f"[{request_id}] Request attempt {attempt} failed: {str(e)}")
+            delay = retry_policy.next_delay(e, attempt)
+            if delay is None:
+                logger.error(f"[{request_id}] Giving up after {attempt} attempt(s)")
+                return fail(str(e), error_status(e))
+            if len(set(tried)) >= len(pool.backends):
+                # Every backend has failed already: back off before the next round
+                await asyncio.sleep(delay)
+
+    async def reissue(data):
+        # Same backend, so Ollama can reuse the KV cache of the prompt
+        async with asyncio.timeout(phase_timeouts.first_byte):
+            retried = await session.post(
+                f"{lease.url}/api/{path}",
+                data=data,
+                headers=headers,
+                timeout=request_timeout
+            )
+        try:
+            retried.raise_for_status()
+        except ClientError:
+            retried.release()
+            raise
+        return retried
+
+    tracker = None
+    if budget.active and path == 'chat' and upstream_request.stream:
+        tracker = BudgetTracker(budget, upstream_request.model)
+
+    # Nothing is written to the client while thinking is removed, so the
+    # connection has to be checked explicitly to notice a hang-up
+    watch = None
+    if flight is None:
+        watch = DisconnectWatch(lambda: request.transport is None or request.transport.is_closing())
+    outputs = generate(upstream, upstream_request, request_id, start_time, cache_recorder, (lease, slot), watch,
+                       clock, StreamMetrics(upstream_request.model, started),
+                       CAPTURE.start(upstream_request, start_time, sent_at), debug, tracker, reissue, tag_profile)
+    if flight is not None:
+        # A background task drives the upstream stream; this request and
+        # later identical ones are all subscribers
+        task = asyncio.ensure_future(flight.run(outputs))
+        BACKGROUND_TASKS.add(task)
+        task.add_done_callback(BACKGROUND_TASKS.discard)
+        outputs = flight.subscribe()
+
+    try:
+        return await stream_to_client(
+            request, outputs,
+            stream_headers(request_id, cache='MISS' if cache_recorder is not None else None, compaction=compaction)
+        )
+    finally:
+        if flight is None:
+            # generate() never runs its cleanup if the client left before it started
+            upstream.release()
+            lease.release()
+            if slot is not None:
+                slot.release()
+
+
+async def stream_to_client(request, outputs, headers):
+    """Write an async iterable of NDJSON lines as a streaming response"""
+    response = web.StreamResponse(headers=headers)
+    await response.prepare(request)
+    try:
+        async for line in outputs:
+            await response.write(line)
+    finally:
+        # Runs the generator's cleanup even when the client went away
+        await outputs.aclose()
+    await response.write_eof()
+    return response
+
+
+async def upstream_lines(upstream, chunk_gap=None):
+    """NDJSON lines of an upstream response, as NDJSONFramer yields them
+
+    Raises PhaseTimeoutError when no data arrives for ``chunk_gap`` seconds.
+    """
+    framer = NDJSONFramer()
+    while True:
+        try:
+            async with asyncio.timeout(chunk_gap):
+                data = await upstream.content.read(UPSTREAM_READ_SIZE)
+        except TimeoutError:
+            raise PhaseTimeoutError('chunk_gap', chunk_gap) from None
+        if not data:
+            break
+        for line in framer.feed(data):
+            yield line
+    tail = framer.close()
+    if tail is not None:
+        yield tail
+
+
+async def generate(upstream, upstream_request, request_id, start_time, cache_recorder=None, claims=(), watch=None,
+                   clock=None, stats=None, capture=None, debug=False, tracker=None, reissue=None, profile=None):
+    """Async counterpart of the generate() closure in unthink_proxy.proxy_api"""
+    processor = ChatStreamProcessor(OPEN_THINK_TAG, CLOSE_THINK_TAG, request_id, debug, profile=profile)
+    if stats is None:
+        stats = StreamMetrics(upstream_request.model, time.monotonic())
+    streaming_since = time.time()
+    aborted = None
+    completed = False
+    last_output = None
+    chunk_gap = clock.timeouts.chunk_gap if clock is not None else None
+    lines = upstream_lines(upstream, chunk_gap)
+    try:
+        while True:
+            async for line in lines:
+                output = processor.process_line(line)
+                stats.line(output, processor.stripper)
+                if capture is not None:
+                    capture.frame(line, output)
+                if output:
+                    last_output = output
+                    if cache_recorder is not None:
+                        cache_recorder.observe(output)
+                    yield output
+                elif watch is not None and watch.client_gone():
+                    logger.info(f"[{request_id}] Client disconnected, aborting generation")
+                    aborted = 'client_disconnect'
+                    break
+                if tracker is not None and tracker.exceeded(line, processor.stripper):
+                    break
+                if clock is not None and clock.active:
+                    # 首个回答token和总时长的截止时间
+                    clock.check(last_output is not None)
+            else:
+                completed = True
+                if cache_recorder is not None:
+                    cache_recorder.finish()
+                if last_output and b'"done":true' in last_output:
+                    OUTPUT_LENGTHS.observe(upstream_request.model, last_output)
+                break
+            if aborted:
+                break
+            # The thinking ran past its budget: stop this generation and ask
+            # again with the thinking closed, so the model answers right away
+            data = tracker.cut_off(upstream_request, processor.stripper)
+            stats.reissued()
+            logger.info(f"[{request_id}] Thinking budget exceeded after {tracker.tokens} tokens, re-issuing")
+            await lines.aclose()
+            upstream.close()
+            upstream = await reissue(data)
+            lines = upstream_lines(upstream, chunk_gap)
+    except GeneratorExit:
+        # The client (or every subscriber of the flight) went away
+        aborted = aborted or 'client_disconnect'
+        raise
+    except PhaseTimeoutError as e:
+        logger.warning(f"[{request_id}] {str(e)}, aborting generation")
+        record_timeout(e.phase)
+        aborted = 'timeout'
+        yield e.frame()
+    except ThinkingBudgetExceeded as e:
+        logger.info(f"[{request_id}] {str(e)}, aborting generation")
+        aborted = 'thinking_budget'
+        yield e.frame()
+    except (ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"[{request_id}] Error in generate function: {str(e)}")
+        yield json.dumps({"error": str(e)}).encode('utf-8') + b'\n'
+    except Exception as e:
+        # Anything else (a malformed frame, a bug) still ends the stream with
+        # an error frame the client can understand, as the Flask server does
+        logger.error(f"[{request_id}] Error in generate function: {str(e)}")
+        yield json.dumps({"error": str(e)}).encode('utf-8') + b'\n'
+    finally:
+        await lines.aclose()
+        if aborted:
+            # Closing the connection before the end makes Ollama stop generating
+            upstream.close()
+            record_abort(aborted, upstream_request.model, processor.chunk_count,
+                         time.time() - streaming_since, upstream_request.num_predict)
+        else:
+            upstream.release()
+        stats.finish(last_output if completed else None, processor.stripper.chars_removed)
+        if capture is not None:
+            capture.finish(aborted or ('completed' if completed else 'error'))
+        for claim in claims:
+            if claim is not None:
+                claim.release()
+        THINKING_CONTENT_REMOVED.inc(processor.blocks_removed)
+        duration = time.time() - start_time
+        logger.info(f"[{request_id}] Request completed in {duration:.2f}s, processed {processor.chunk_count} chunks")
+
+
+async def catch_all(request):
+    """Catch-all route to proxy all other requests to Ollama server"""
+    return await forward(request, request.match_info['path'])
+
+
+async def forward(request, path):
+    """Forward a request as-is, serving metadata endpoints from the cache"""
+    request_id = f"{int(time.time())}-{os.getpid()}"
+    session = request.app[UPSTREAM]
+
+    # 元数据接口（如/api/tags）在TTL内直接从缓存返回
+    cache_ttl = None
+    if METADATA_CACHE_ENABLED and request.method == 'GET':
+        cache_ttl = METADATA_CACHE.ttl_for(path)
+    if cache_ttl:
+        entry = METADATA_CACHE.get(path)
+        if entry is not None:
+            status, headers, body = entry.respond(request.headers.get('If-None-Match'))
+            return web.Response(body=body, status=status, headers=headers)
+
+    # 拉取、删除模型等操作会改变模型列表
+    changes_models = path.strip('/') in [f"api/{name}" for name in MODEL_MANAGEMENT_PATHS]
+    if changes_models:
+        METADATA_CACHE.invalidate()
+        CAPABILITIES.invalidate()
+
+    try:
+        async with session.request(
+            request.method,
+            f"{request.app[POOL].choose().url}/{path}",
+            data=await request.read(),
+            allow_redirects=False,
+            headers={
+                key: value for key, value in request.headers.items() if key != 'Host'
+            }
+        ) as resp:
+            headers = [
+                (name, value) for name, value in resp.headers.items()
+                if name.lower() not in EXCLUDED_HEADERS
+            ]
+            if cache_ttl and resp.status == 200:
+                entry = METADATA_CACHE.put(path, await resp.read(), headers)
+                status, headers, body = entry.respond(request.headers.get('If-None-Match'))
+                return web.Response(body=body, status=status, headers=headers)
+
+            response = web.StreamResponse(status=resp.status, headers=headers)
+            await response.prepare(request)
+            try:
+                async for data in resp.content.iter_chunked(UPSTREAM_READ_SIZE):
+                    await response.write(data)
+            finally:
+                if changes_models:
+                    METADATA_CACHE.invalidate()
+                    CAPABILITIES.invalidate()
+            await response.write_eof()
+            return response
+    except (ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"[{request_id}] Error in catch_all route: {str(e)}")
+        return json_response({"error": str(e)}, 503)
+
+
+def pool_trace_config():
+    """Feeds the upstream pool metrics from aiohttp connection events"""
+    trace_config = TraceConfig()
+
+    async def on_queued_start(session, context, params):
+        context.queued_at = time.monotonic()
+
+    async def on_queued_end(session, context, params):
+        UPSTREAM_POOL_WAIT.observe(time.monotonic() - context.queued_at)
+
+    async def on_reuse(session, context, params):
+        UPSTREAM_POOL_CONNECTIONS.labels(result='hit').inc()
+
+    async def on_create(session, context, params):
+        UPSTREAM_POOL_CONNECTIONS.labels(result='miss').inc()
+
+    trace_config.on_connection_queued_start.append(on_queued_start)
+    trace_config.on_connection_queued_end.append(on_queued_end)
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    trace_config.on_connection_create_end.append(on_create)
+    return trace_config
+
+
+async def upstream_session(app):
+    """Owns the upstream client session for the lifetime of the app"""
+    timeout = ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+    # No connection limit: every concurrent stream needs its own connection
+    connector = TCPConnector(
+        limit=0,
+        keepalive_timeout=UPSTREAM_IDLE_TIMEOUT,
+        force_close=not UPSTREAM_KEEPALIVE
+    )
+    async with ClientSession(
+        connector=connector,
+        timeout=timeout,
+        cookie_jar=DummyCookieJar(),
+        trace_configs=[pool_trace_config()]
+    ) as session:
+        app[UPSTREAM] = session
+        yield
+
+
+async def backend_pool(app):
+    """Owns the upstream server pool and its health probers"""
+    pool = BackendPool(OLLAMA_SERVERS or [OLLAMA_SERVER])
+    pool.start()
+    app[POOL] = pool
+    yield
+    pool.stop()
+
+
+def create_app():
+    """Build the aiohttp application"""
+    app = web.Application(middlewares=[cors_middleware, metrics_middleware])
+    app[LIMITS] = AdmissionController(AsyncModelLimiter)
+    app[RETRY_POLICY] = RetryPolicy(MAX_RETRIES, RETRY_DELAY)
+    app.cleanup_ctx.append(upstream_session)
+    app.cleanup_ctx.append(backend_pool)
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_post('/api/{path:.*}', proxy_api)
+    app.router.add_route('GET', '/{path:.*}', catch_all)
+    app.router.add_route('DELETE', '/{path:.*}', catch_all)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    logger.info(f"Starting async proxy server on port {PROXY_PORT}")
+    logger.info(f"Forwarding requests to {', '.join(OLLAMA_SERVERS or [OLLAMA_SERVER])}")
+    logger.info(f"Log level set to {log_level}")
+    web.run_app(app, host="0.0.0.0", port=PROXY_PORT, print=None)
@@ -0,0 +1,176 @@
+"""Balancing of generation requests across several Ollama servers."""
+import logging
+import os
+import threading
+
+from health_prober import HealthProber
+from metrics import BACKEND_IN_FLIGHT, BACKEND_LATENCY, BACKEND_REQUESTS, CIRCUIT_SHORT_CIRCUITED
+from resilience import CircuitBreaker, CircuitOpenError, is_backend_failure
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+OLLAMA_SERVERS = [
+    url.strip().rstrip('/') for url in os.getenv("OLLAMA_SERVERS", "").split(",") if url.strip()
+]
+# Route a model to a server that already has it loaded when possible
+BACKEND_PREFER_LOADED = os.getenv("BACKEND_PREFER_LOADED", "true").lower() == "true"
+# ...unless that server has this many more outstanding requests than the least busy one
+BACKEND_LOADED_SLACK = int(os.getenv("BACKEND_LOADED_SLACK") or 4)
+
+
+def model_name(name):
+    """Ollama treats a model name without a tag as ``:latest``"""
+    if name and ':' not in name.rsplit('/', 1)[-1]:
+        return f"{name}:latest"
+    return name
+
+
+class Backend:
+    """One Ollama server, its health prober, circuit breaker and outstanding request count"""
+
+    def __init__(self, url, prober):
+        self.url = url
+        self.prober = prober
+        self.breaker = CircuitBreaker(url)
+        self.outstanding = 0
+        # Models this worker sent here since the last probe; they are
+        # loaded now even if the probe result does not show them yet
+        self._served = set()
+        self._served_since = None
+
+    @property
+    def state(self):
+        return self.prober.state or {}
+
+    def is_available(self):
+        # A server that was never probed yet is given the benefit of the doubt
+        return self.state.get("status", "unknown") in ("healthy", "unknown")
+
+    def has_loaded(self, model):
+        state = self.state
+        if state.get("checked_at") != self._served_since:
+            self._served.clear()
+            self._served_since = state.get("checked_at")
+        loaded = {model_name(name) for name in state.get("loaded_models") or ()}
+        return model in loaded or model in self._served
+
+
+class Lease:
+    """One request's claim on a backend; release() may be called more than once"""
+
+    def __init__(self, pool, backend, model):
+        self.pool = pool
+        self.backend = backend
+        self.model = model
+        self.released = False
+
+    @property
+    def url(self):
+        return self.backend.url
+
+    def record_response(self, latency):
+        """The backend answered: note its latency and that the model is loaded there"""
+        BACKEND_LATENCY.labels(backend=self.backend.url).set(latency)
+        self.backend.breaker.success()
+        if self.model:
+            self.backend._served.add(self.model)
+
+    def record_failure(self, exc):
+        """The attempt failed; only server-side failures count against the circuit"""
+        if is_backend_failure(exc):
+            self.backend.breaker.failure()
+        else:
+            self.backend.breaker.success()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.pool._release(self.backend)
+
+
+class BackendPool:
+    """Picks the server with the fewest outstanding requests, preferring warm ones
+
+    Outstanding counts are per process, so with several gunicorn workers each
+    one balances its own requests.
+    """
+
+    def __init__(self, urls, prober_factory=HealthProber):
+        self.backends = [Backend(url, prober_factory(url)) for url in urls]
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    def start(self):
+        """Start the health probers of all backends (a no-op once they run in this process)"""
+        for backend in self.backends:
+            backend.prober.ensure_running()
+
+    def stop(self):
+        for backend in self.backends:
+            backend.prober.stop()
+
+    def acquire(self, model=None, exclude=()):
+        """Choose a backend for a request and count it as outstanding until released
+
+        Raises CircuitOpenError when every backend's circuit is open.
+        """
+        # Workers that only serve generations still need fresh health data
+        self.start()
+        model = model_name(model)
+        with self._lock:
+            allowed = [b for b in self.backends if b.breaker.available()]
+            if not allowed:
+                CIRCUIT_SHORT_CIRCUITED.inc()
+                raise CircuitOpenError(min(b.breaker.retry_after() for b in self.backends))
+            backend, reason = self._choose(model, exclude, allowed)
+            backend.breaker.attempt()
+            backend.outstanding += 1
+            BACKEND_IN_FLIGHT.labels(backend=backend.url).set(backend.outstanding)
+        BACKEND_REQUESTS.labels(backend=backend.url, reason=reason).inc()
+        return Lease(self, backend, model)
+
+    def choose(self, exclude=()):
+        """A backend for a request that is not tracked (metadata, model management)"""
+        self.start()
+        with self._lock:
+            return self._choose(None, exclude, self.backends)[0]
+
+    def health(self):
+        """Health snapshot of the pool; a single server keeps the flat format"""
+        self.start()
+        snapshots = []
+        for backend in self.backends:
+            snapshot = backend.prober.snapshot()
+            snapshot["in_flight"] = backend.outstanding
+            snapshots.append(snapshot)
+        if len(snapshots) == 1:
+            return snapshots[0]
+        statuses = {snapshot["status"] for snapshot in snapshots}
+        for status in ("healthy", "degraded", "unhealthy"):
+            if status in statuses:
+                break
+        else:
+            status = "unknown"
+        return {"status": status, "backends": snapshots}
+
+    def _choose(self, model, exclude, allowed):
+        candidates = [b for b in allowed if b.is_available()] or allowed
+        candidates = [b for b in candidates if b not in exclude] or candidates
+        least = min(b.outstanding for b in candidates)
+        reason = 'least_outstanding'
+        if BACKEND_PREFER_LOADED and model:
+            warm = [b for b in candidates if b.has_loaded(model)]
+            if warm and min(b.outstanding for b in warm) <= least + BACKEND_LOADED_SLACK:
+                candidates = warm
+                least = min(b.outstanding for b in warm)
+                reason = 'loaded'
+        tied = [b for b in candidates if b.outstanding == least]
+        # Rotate between equally busy backends
+        self._turn += 1
+        return tied[self._turn % len(tied)], reason
+
+    def _release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+            BACKEND_IN_FLIGHT.labels(backend=backend.url).set(backend.outstanding)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Framing benchmark: response.iter_lines() versus NDJSONFramer on long streams.
+
+Replays a synthetic Ollama /api/chat stream through both read paths and the
+shared ChatStreamProcessor, and reports CPU time and transient allocation per
+chunk.  No network or Ollama server is needed.
+
+    python benchmarks/bench_framer.py --frames 20000 --pattern frame
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ndjson_stream import UPSTREAM_READ_SIZE, ChatStreamProcessor, iter_frames
+
+
+def build_stream(frames, think_frames):
+    """Ollama-style NDJSON: a think block followed by the answer"""
+    lines = []
+    for i in range(frames):
+        if i == 0:
+            content = "<think>"
+        elif i < think_frames:
+            content = f" step{i}"
+        elif i == think_frames:
+            content = "</think>\n\n"
+        else:
+            content = f" word{i}"
+        frame = {
+            "model": "bench", "created_at": "2025-01-01T00:00:00.000000Z",
+            "message": {"role": "assistant", "content": content}, "done": False
+        }
+        line = json.dumps(frame, separators=(',', ':')).replace('<', '\\u003c').replace('>', '\\u003e')
+        lines.append(line.encode('utf-8') + b'\n')
+    lines.append(b'{"model":"bench","message":{"role":"assistant","content":""},"done":true,"eval_count":1}\n')
+    return lines
+
+
+def network_reads(lines, pattern):
+    """What the socket hands back: one frame per read, or 64KB blocks"""
+    if pattern == "frame":
+        return lines
+    payload = b''.join(lines)
+    return [payload[i:i + UPSTREAM_READ_SIZE] for i in range(0, len(payload), UPSTREAM_READ_SIZE)]
+
+
+class ReplayedResponse(requests.Response):
+    """requests.Response whose body comes from a list of reads"""
+
+    def __init__(self, reads):
+        super().__init__()
+        self._reads = reads
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for data in self._reads:
+            for i in range(0, len(data), chunk_size):
+                yield data[i:i + chunk_size]
+
+
+def before(reads):
+    """Previous path: iter_lines() with its 512-byte reads"""
+    processor = ChatStreamProcessor("<think>", "</think>")
+    for chunk in ReplayedResponse(reads).iter_lines():
+        yield bytes(processor.process_line(chunk))
+
+
+def after(reads):
+    """Large reads split by NDJSONFramer into memoryviews"""
+    processor = ChatStreamProcessor("<think>", "</think>")
+    for line in iter_frames(ReplayedResponse(reads).iter_content(chunk_size=UPSTREAM_READ_SIZE)):
+        yield bytes(processor.process_line(line))
+
+
+def cpu_per_chunk(path, reads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        chunks = sum(1 for _ in path(reads))
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / chunks * 1e6
+
+
+def allocation_per_chunk(path, reads):
+    """Mean of the transient allocation peak while each line is processed"""
+    tracemalloc.start()
+    outputs = path(reads)
+    total = 0
+    chunks = 0
+    while True:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            next(outputs)
+        except StopIteration:
+            break
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - current
+        chunks += 1
+    tracemalloc.stop()
+    return total / chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--think-frames", type=int, default=5000)
+    parser.add_argument("--pattern", choices=["frame", "block"], default="frame")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    reads = network_reads(build_stream(args.frames, args.think_frames), args.pattern)
+    print(f"{args.frames} frames, {len(reads)} reads ({args.pattern} pattern)")
+    print(f"{'path':<10}{'cpu us/chunk':>14}{'alloc B/chunk':>16}")
+    for name, path in (("before", before), ("after", after)):
+        cpu = cpu_per_chunk(path, reads, args.repeat)
+        alloc = allocation_per_chunk(path, reads)
+        print(f"{name:<10}{cpu:>14.2f}{alloc:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark: the proxy versus talking to Ollama directly.
+
+Starts benchmarks/fake_ollama.py and the proxy as subprocesses, then runs
+waves of concurrent streams against the fake server directly and through the
+proxy.  For each concurrency level it reports:
+
+- TTFT p50/p99: time to the first answer token (after the think block), and
+  how much the proxy adds to it
+- per-chunk overhead: how much longer a frame takes to reach the client
+  through the proxy (the fake server stamps every frame with its send time)
+- CPU time of the proxy process(es) per 1000 upstream chunks (Linux only)
+
+and the highest level the proxy sustained without errors and within the
+added-TTFT budget.  Only the proxy needs the repository; the fake server and
+the client share the host, so run it on an otherwise idle machine.
+
+    python benchmarks/bench_proxy.py --levels 10,100,500 --token-delay 0.01
+    python benchmarks/bench_proxy.py --server flask --workers 4 --threads 8 --split inline
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from benchmarks.fake_ollama import SPLITS
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def process_cpu(pid):
+    """User+system CPU seconds of a process and its descendants, or None off Linux"""
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f'/proc/{current}/stat') as f:
+                # The command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / clock_ticks
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (OSError, IndexError, ValueError):
+        return None
+    return total
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def one_stream(session, url, path, model, index):
+    """Run one streaming request; returns its timings"""
+    if path == 'chat':
+        body = {"model": model, "messages": [{"role": "user", "content": f"benchmark {index}"}]}
+    else:
+        body = {"model": model, "prompt": f"benchmark {index}"}
+    result = {"ttfb": None, "ttft": None, "delays": [], "upstream_chunks": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        async with session.post(f"{url}/api/{path}", json=body) as response:
+            if response.status != 200:
+                result["error"] = f"HTTP {response.status}"
+                return result
+            async for line in response.content:
+                received_ns = time.time_ns()
+                elapsed = time.perf_counter() - start
+                if not line.strip():
+                    continue
+                frame = json.loads(line)
+                if "error" in frame:
+                    result["error"] = frame["error"]
+                    return result
+                if result["ttfb"] is None:
+                    result["ttfb"] = elapsed
+                if "sent_ns" in frame:
+                    result["delays"].append(received_ns - frame["sent_ns"])
+                content = frame.get("message", {}).get("content") if path == 'chat' else frame.get("response")
+                # The fake server's answer tokens are " word<n>"
+                if result["ttft"] is None and content and "word" in content:
+                    result["ttft"] = elapsed
+                if frame.get("done"):
+                    result["upstream_chunks"] = frame.get("eval_count", 0) + 1
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def run_level(url, path, model, concurrency, streams):
+    """``streams`` requests with ``concurrency`` of them in flight at any time"""
+    limit = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def limited(index):
+            async with limit:
+                return await one_stream(session, url, path, model, index)
+        return await asyncio.gather(*(limited(i) for i in range(streams)))
+
+
+def summarize(results):
+    ok = [r for r in results if r["error"] is None and r["ttft"] is not None]
+    delays = [d for r in ok for d in r["delays"]]
+    return {
+        "streams": len(results),
+        "errors": len(results) - len(ok),
+        "ttft_p50": percentile([r["ttft"] for r in ok], 50) * 1000,
+        "ttft_p99": percentile([r["ttft"] for r in ok], 99) * 1000,
+        "ttfb_p50": percentile([r["ttfb"] for r in ok], 50) * 1000,
+        "delay_mean": (sum(delays) / len(delays) / 1e6) if delays else float('nan'),
+        "upstream_chunks": sum(r["upstream_chunks"] for r in ok),
+        "first_error": next((r["error"] for r in results if r["error"]), None),
+    }
+
+
+def start_fake(args, port):
+    cmd = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_ollama.py'), '--port', str(port),
+        '--models', args.model, '--think-tokens', str(args.think_tokens),
+        '--answer-tokens', str(args.answer_tokens), '--token-delay', str(args.token_delay),
+        '--split', args.split, '--timestamps',
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+
+def start_proxy(args, port, upstream_url, workdir):
+    env = dict(os.environ, OLLAMA_SERVER=upstream_url, PROXY_PORT=str(port), LOG_LEVEL='WARNING',
+               LOG_DIR=workdir, HEALTH_STATE_DIR=workdir)
+    for name in ('OLLAMA_SERVERS', 'PROMETHEUS_MULTIPROC_DIR', 'RESPONSE_CACHE_ENABLED', 'SINGLE_FLIGHT_ENABLED',
+                 'THINKING_SUPPRESSION_ENABLED'):
+        env.pop(name, None)
+    if args.server == 'async':
+        cmd = [sys.executable, 'async_proxy.py']
+    else:
+        cmd = [
+            sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+            '--threads', str(args.threads), '--timeout', '300', 'unthink_proxy:app',
+        ]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["async", "flask"], default="async",
+                        help="proxy mode: async_proxy.py, or unthink_proxy under gunicorn")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers (flask)")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker (flask)")
+    parser.add_argument("--levels", default="1,10,50,100", help="comma-separated concurrency levels")
+    parser.add_argument("--streams", type=int, default=0, help="streams per level (default: 2 x level)")
+    parser.add_argument("--path", choices=["chat", "generate"], default="chat")
+    parser.add_argument("--model", default="qwen3:8b")
+    parser.add_argument("--think-tokens", type=int, default=64)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--token-delay", type=float, default=0.005, help="seconds between tokens")
+    parser.add_argument("--split", choices=SPLITS, default="whole", help="where think tags fall in the frames")
+    parser.add_argument("--ttft-budget", type=float, default=50.0,
+                        help="p99 TTFT the proxy may add at a sustained level (ms)")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(',')]
+
+    fake_port, proxy_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    proxy_url = f"http://127.0.0.1:{proxy_port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_fake(args, fake_port)
+        proxy = start_proxy(args, proxy_port, fake_url, workdir)
+        try:
+            wait_ready(f"{fake_url}/api/version")
+            wait_ready(f"{proxy_url}/api/version")
+            # Warm-up: connection pools, model "load"
+            asyncio.run(run_level(proxy_url, args.path, args.model, 4, 8))
+
+            print(f"{args.server} proxy, /api/{args.path}, {args.think_tokens}+{args.answer_tokens} tokens, "
+                  f"{args.token_delay * 1000:g}ms/token, {args.split} tags")
+            header = (f"{'conc':>6}{'mode':>8}{'errors':>8}{'ttfb p50':>10}{'ttft p50':>10}{'ttft p99':>10}"
+                      f"{'+ttft p50':>11}{'+ttft p99':>11}{'chunk ms':>10}{'+chunk ms':>11}{'cpu ms/1k':>11}")
+            print(header)
+            sustained = 0
+            for level in levels:
+                streams = args.streams or 2 * level
+                direct = summarize(asyncio.run(run_level(fake_url, args.path, args.model, level, streams)))
+                cpu_before = process_cpu(proxy.pid)
+                proxied = summarize(asyncio.run(run_level(proxy_url, args.path, args.model, level, streams)))
+                cpu_after = process_cpu(proxy.pid)
+
+                cpu = float('nan')
+                if cpu_before is not None and cpu_after is not None and proxied["upstream_chunks"]:
+                    cpu = (cpu_after - cpu_before) / proxied["upstream_chunks"] * 1e6
+                added_p50 = proxied["ttft_p50"] - direct["ttft_p50"]
+                added_p99 = proxied["ttft_p99"] - direct["ttft_p99"]
+                for mode, stats in (("direct", direct), ("proxy", proxied)):
+                    if mode == "proxy":
+                        extra = (f"{added_p50:>11.1f}{added_p99:>11.1f}{stats['delay_mean']:>10.2f}"
+                                 f"{stats['delay_mean'] - direct['delay_mean']:>11.2f}{cpu:>11.1f}")
+                    else:
+                        extra = f"{'':>11}{'':>11}{stats['delay_mean']:>10.2f}{'':>11}{'':>11}"
+                    print(f"{level:>6}{mode:>8}{stats['errors']:>8}{stats['ttfb_p50']:>10.1f}"
+                          f"{stats['ttft_p50']:>10.1f}{stats['ttft_p99']:>10.1f}{extra}")
+                for mode, stats in (("direct", direct), ("proxy", proxied)):
+                    if stats["first_error"]:
+                        print(f"       {mode} error: {stats['first_error']}")
+                if proxied["errors"] == 0 and added_p99 <= args.ttft_budget:
+                    sustained = level
+            print(f"max sustained concurrency: {sustained} streams "
+                  f"(no errors, p99 TTFT within +{args.ttft_budget:g}ms of direct)")
+        finally:
+            for process in (proxy, fake):
+                process.terminate()
+            for process in (proxy, fake):
+                process.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
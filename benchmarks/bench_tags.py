@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tag scanning benchmark: cost per KB of ThinkStripper as tag profiles grow.
+
+Streams a synthetic response (a thinking block, then an answer with the odd
+"<" of code and markup in it) through a stripper whose profile holds 1 to N
+tag pairs, in chunks the size of streamed tokens.  For comparison the same
+text is searched with one str.find pass per open tag, which is what a list
+of tags without an automaton costs.  No network or Ollama server is needed.
+
+    python benchmarks/bench_tags.py --max-pairs 64 --chunk 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from think_stripper import TagProfile, ThinkStripper
+
+KNOWN_PAIRS = [
+    ("<think>", "</think>"),
+    ("<reasoning>", "</reasoning>"),
+    ("<|begin_of_thought|>", "<|end_of_thought|>"),
+    ("<thought>", "</thought>"),
+    ("[THINK]", "[/THINK]"),
+]
+
+
+def tag_pairs(count):
+    """The known tag pairs, padded with made-up ones"""
+    pairs = KNOWN_PAIRS[:count]
+    pairs += [(f"<tag{i}>", f"</tag{i}>") for i in range(count - len(pairs))]
+    return pairs
+
+
+def build_text(size_kb):
+    thinking = "Let me check whether a < b holds for every i in the list. " * 40
+    answer = "Use <b>bold</b> for emphasis; if x < 10 then return x << 2, else <|skip|>. "
+    text = "<think>" + thinking + "</think>\n\n"
+    while len(text) < size_kb * 1024:
+        text += answer
+    return text
+
+
+def strip(profile, chunks):
+    stripper = ThinkStripper(profile=profile)
+    for chunk in chunks:
+        stripper.feed(chunk)
+    stripper.flush()
+
+
+def find_each(open_tags, chunks):
+    """One str.find pass per tag over each chunk, the list-of-tags baseline"""
+    for chunk in chunks:
+        for tag in open_tags:
+            chunk.find(tag)
+
+
+def us_per_kb(func, args, size, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        func(*args)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (size / 1024) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--chunk", type=int, default=8, help="characters per streamed chunk")
+    parser.add_argument("--max-pairs", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = build_text(args.size_kb)
+    chunks = [text[i:i + args.chunk] for i in range(0, len(text), args.chunk)]
+    print(f"{len(text) // 1024} KB in {len(chunks)} chunks of {args.chunk} characters")
+    print(f"{'pairs':>6}{'scanner us/KB':>16}{'find-each us/KB':>18}")
+    count = 1
+    while count <= args.max_pairs:
+        pairs = tag_pairs(count)
+        profile = TagProfile(pairs, f"bench{count}")
+        scanner = us_per_kb(strip, (profile, chunks), len(text), args.repeat)
+        baseline = us_per_kb(find_each, ([open_tag for open_tag, _ in pairs], chunks), len(text), args.repeat)
+        print(f"{count:>6}{scanner:>16.1f}{baseline:>18.1f}")
+        count *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Fake Ollama server for tests and benchmarks.
+
+Streams /api/chat and /api/generate responses shaped like a reasoning model
+(a think block followed by the answer) and answers /api/tags, /api/ps and
+/api/version.  --split chooses how the think tags fall on frame boundaries:
+alone in their frame, cut in two across frames, or sharing a frame with
+text.  A chat request ending in an assistant message continues it, so only
+the answer is streamed, and so it is for "think": false when --capabilities
+include thinking.  A model that is not loaded yet takes --load-delay
+seconds before its first token, like a cold model load.  Several instances can run on
+consecutive ports to stand in for a pool of GPU servers.  Output is
+deterministic for the same options.
+
+    python benchmarks/fake_ollama.py --port 11500 --instances 3 --token-delay 0.01
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+STATE = web.AppKey("state", dict)
+
+
+SPLITS = ("whole", "split", "inline")
+
+
+def create_app(name="fake", models=("qwen3:8b",), loaded=(), think_tokens=16, answer_tokens=16,
+               token_delay=0.0, load_delay=0.0, split="whole", timestamps=False, capabilities=("completion",),
+               family="qwen3"):
+    """Build one fake Ollama instance; its counters are in app[STATE]
+
+    With ``timestamps`` every frame carries ``sent_ns``, the time.time_ns()
+    at which it was written, so a client on the same host can measure how
+    long each frame took to reach it.
+    """
+    app = web.Application()
+    app[STATE] = {
+        "name": name,
+        "models": list(models),
+        "loaded": set(loaded),
+        "think_tokens": think_tokens,
+        "answer_tokens": answer_tokens,
+        "token_delay": token_delay,
+        "load_delay": load_delay,
+        "split": split,
+        "timestamps": timestamps,
+        "capabilities": list(capabilities),
+        "family": family,
+        "requests": 0,
+        "active": 0,
+        "max_active": 0,
+        "cancelled": 0,
+        "shows": 0,
+    }
+    app.router.add_post('/api/chat', generate)
+    app.router.add_post('/api/generate', generate)
+    app.router.add_post('/api/show', show)
+    app.router.add_get('/api/tags', tags)
+    app.router.add_get('/api/ps', ps)
+    app.router.add_get('/api/version', version)
+    return app
+
+
+def tokens(state, continued=False):
+    think = [f" step{i}" for i in range(state["think_tokens"])]
+    answer = [f" word{i}" for i in range(state["answer_tokens"])]
+    if continued:
+        # The assistant message was started by the caller: no thinking
+        yield from answer
+    elif state["split"] == "split":
+        # Each tag is cut in two across frames
+        yield from ["<thi", "nk>", *think, "</th", "ink>\n\n", *answer]
+    elif state["split"] == "inline":
+        # Tags share their frame with thinking and answer text
+        think = think or [""]
+        yield "<think>" + think[0]
+        yield from think[1:-1]
+        yield (think[-1] if len(think) > 1 else "") + "</think>\n\n" + (answer[0] if answer else "")
+        yield from answer[1:]
+    else:
+        yield "<think>"
+        yield from think
+        yield "</think>\n\n"
+        yield from answer
+
+
+def frame(path, model, content, done, **extra):
+    data = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    if path == 'generate':
+        data["response"] = content
+    else:
+        data["message"] = {"role": "assistant", "content": content}
+    data["done"] = done
+    data.update(extra)
+    # Ollama escapes < and > like Go's encoding/json
+    line = json.dumps(data, separators=(',', ':'))
+    return line.replace('<', '\\u003c').replace('>', '\\u003e').encode('utf-8') + b'\n'
+
+
+async def generate(request):
+    state = request.app[STATE]
+    body = await request.json()
+    path = request.path.rsplit('/', 1)[-1]
+    model = body.get("model", "")
+    state["requests"] += 1
+    state["active"] += 1
+    state["max_active"] = max(state["max_active"], state["active"])
+    try:
+        start = time.monotonic()
+        if model not in state["loaded"]:
+            await asyncio.sleep(state["load_delay"])
+            state["loaded"].add(model)
+        messages = body.get("messages") or [{}]
+        continued = path == 'chat' and messages[-1].get("role") == 'assistant'
+        no_think = body.get("think") is False and "thinking" in state["capabilities"]
+        pieces = list(tokens(state, continued or no_think))
+        final = dict(done_reason="stop", eval_count=len(pieces),
+                     total_duration=0, eval_duration=0)
+
+        if body.get("stream", True) is False:
+            await asyncio.sleep(state["token_delay"] * len(pieces))
+            final["total_duration"] = int((time.monotonic() - start) * 1e9)
+            return web.Response(body=frame(path, model, "".join(pieces), True, **final),
+                                content_type='application/json')
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for piece in pieces:
+            if state["token_delay"]:
+                await asyncio.sleep(state["token_delay"])
+            if state["timestamps"]:
+                await response.write(frame(path, model, piece, False, sent_ns=time.time_ns()))
+            else:
+                await response.write(frame(path, model, piece, False))
+        final["total_duration"] = final["eval_duration"] = int((time.monotonic() - start) * 1e9)
+        await response.write(frame(path, model, "", True, **final))
+        await response.write_eof()
+        return response
+    except (ConnectionError, asyncio.CancelledError):
+        # The client (the proxy) closed the connection mid-generation
+        state["cancelled"] += 1
+        raise
+    finally:
+        state["active"] -= 1
+
+
+async def show(request):
+    state = request.app[STATE]
+    body = await request.json()
+    if body.get("model") not in state["models"]:
+        return web.json_response({"error": "model not found"}, status=404)
+    state["shows"] += 1
+    return web.json_response({
+        "details": {"family": state["family"], "families": [state["family"]]},
+        "capabilities": state["capabilities"],
+    })
+
+
+async def tags(request):
+    state = request.app[STATE]
+    return web.json_response({"models": [{"name": m, "model": m} for m in state["models"]]})
+
+
+async def ps(request):
+    state = request.app[STATE]
+    return web.json_response({"models": [{"name": m, "model": m} for m in sorted(state["loaded"])]})
+
+
+async def version(request):
+    return web.json_response({"version": "0.0.0-fake"})
+
+
+async def serve(args):
+    runners = []
+    for i in range(args.instances):
+        app = create_app(
+            name=f"fake-{i}", models=args.models, think_tokens=args.think_tokens,
+            answer_tokens=args.answer_tokens, token_delay=args.token_delay, load_delay=args.load_delay,
+            split=args.split, timestamps=args.timestamps, capabilities=args.capabilities
+        )
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, args.host, args.port + i).start()
+        runners.append(runner)
+        print(f"fake Ollama {i} listening on http://{args.host}:{args.port + i}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--instances", type=int, default=1)
+    parser.add_argument("--models", nargs="+", default=["qwen3:8b"])
+    parser.add_argument("--think-tokens", type=int, default=16)
+    parser.add_argument("--answer-tokens", type=int, default=16)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between tokens")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="seconds to load a cold model")
+    parser.add_argument("--split", choices=SPLITS, default="whole", help="where think tags fall in the frames")
+    parser.add_argument("--timestamps", action="store_true", help="add the send time (sent_ns) to every frame")
+    parser.add_argument("--capabilities", nargs="+", default=["completion"],
+                        help="capabilities reported by /api/show; with 'thinking', \"think\": false is honoured")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Replay traffic recorded with CAPTURE_ENABLED=true through the proxy.
+
+Serves the captured upstream frames from a local fake Ollama, with their
+original timing divided by --speed, starts the proxy in front of it and
+sends the captured requests on their original schedule (also divided by
+--speed).  It then reports requests whose answer differs from what the
+client got when the traffic was captured (a stripping regression) and
+compares time to first token and duration with the capture, scaled back to
+real time.
+
+    python benchmarks/replay_capture.py logs/capture.jsonl --speed 10
+    python benchmarks/replay_capture.py logs/capture.jsonl --server flask --workers 4 --threads 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from benchmarks.bench_proxy import free_port, percentile, start_proxy, wait_ready
+from benchmarks.fake_ollama import frame
+
+
+def request_key(path, data):
+    return path, json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def load(paths, limit=None):
+    records = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+class ReplayUpstream:
+    """Fake Ollama that answers each request with the frames captured for it
+
+    A request is matched on its exact body first, then on path and model in
+    capture order, so proxy stages that rewrite the body do not break replay.
+    """
+
+    def __init__(self, records, speed):
+        self.speed = speed
+        self.by_body = defaultdict(deque)
+        self.by_model = defaultdict(deque)
+        for record in records:
+            self.by_body[request_key(record["path"], record["request"])].append(record)
+            self.by_model[record["path"], record["request"].get("model")].append(record)
+        self.unmatched = 0
+
+    def _take(self, path, data):
+        for queue in (self.by_body.get(request_key(path, data)), self.by_model.get((path, data.get("model")))):
+            while queue:
+                record = queue.popleft()
+                if not record.get("_served"):
+                    record["_served"] = True
+                    return record
+        return None
+
+    async def handle(self, request):
+        path = request.path.rsplit('/', 1)[-1]
+        data = await request.json()
+        record = self._take(path, data)
+        if record is None:
+            self.unmatched += 1
+            return web.json_response({"error": "no captured response for this request"}, status=404)
+        model = data.get("model", "")
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        start = time.monotonic()
+        for offset_ms, item in record["frames"]:
+            delay = start + offset_ms / 1000 / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if isinstance(item, str):
+                line = frame(path, model, item, False)
+            elif "raw" in item and len(item) == 1:
+                line = item["raw"].encode('utf-8') + b'\n'
+            else:
+                line = json.dumps(item, separators=(',', ':')).encode('utf-8') + b'\n'
+            await response.write(line)
+        await response.write_eof()
+        return response
+
+    async def metadata(self, request):
+        if request.path == '/api/version':
+            return web.json_response({"version": "0.0.0-replay"})
+        return web.json_response({"models": []})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/api/chat', self.handle)
+        app.router.add_post('/api/generate', self.handle)
+        for path in ('/api/version', '/api/tags', '/api/ps'):
+            app.router.add_get(path, self.metadata)
+        return app
+
+
+async def replay_one(session, proxy_url, record, delay):
+    await asyncio.sleep(delay)
+    path = record["path"]
+    result = {"record": record, "ttft": None, "duration": None, "output": [], "error": None}
+    start = time.perf_counter()
+    try:
+        async with session.post(f"{proxy_url}/api/{path}", json=record["request"]) as response:
+            if response.status != 200:
+                result["error"] = f"HTTP {response.status}"
+                return result
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    result["error"] = data["error"]
+                    return result
+                text = data.get("message", {}).get("content") if path == 'chat' else data.get("response")
+                if text:
+                    if result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - start
+                    result["output"].append(text)
+        result["duration"] = time.perf_counter() - start
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def replay(records, args):
+    upstream = ReplayUpstream(records, args.speed)
+    runner = web.AppRunner(upstream.app())
+    await runner.setup()
+    upstream_port, proxy_port = free_port(), free_port()
+    await web.TCPSite(runner, '127.0.0.1', upstream_port).start()
+    proxy_url = f"http://127.0.0.1:{proxy_port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        proxy = start_proxy(args, proxy_port, f"http://127.0.0.1:{upstream_port}", workdir)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, wait_ready, f"{proxy_url}/api/version")
+            first = records[0]["ts"]
+            connector = aiohttp.TCPConnector(limit=0)
+            async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)) as session:
+                results = await asyncio.gather(*(
+                    replay_one(session, proxy_url, record, (record["ts"] - first) / args.speed) for record in records
+                ))
+        finally:
+            proxy.terminate()
+            proxy.wait(timeout=10)
+            await runner.cleanup()
+    return results, upstream.unmatched
+
+
+def report(results, unmatched, speed):
+    errors = [r for r in results if r["error"]]
+    compared = [r for r in results if not r["error"] and r["record"].get("outcome") == "completed"]
+    mismatches = [r for r in compared if "".join(r["output"]) != r["record"].get("output", "")]
+    print(f"replayed {len(results)} requests at {speed:g}x: {len(errors)} errors, "
+          f"{len(mismatches)} of {len(compared)} completed answers differ, {unmatched} unmatched upstream requests")
+    for r in mismatches[:5]:
+        captured, replayed = r["record"].get("output", ""), "".join(r["output"])
+        print(f"  ts {r['record']['ts']}: captured {captured[:60]!r}, replayed {replayed[:60]!r}")
+    for r in errors[:5]:
+        print(f"  ts {r['record']['ts']}: {r['error']}")
+
+    # Replayed times are scaled back to real time; the capture measured from
+    # the upstream request, the replay from the client request
+    rows = (
+        ("ttft ms", [r["record"]["ttft_ms"] for r in compared if r["record"].get("ttft_ms") is not None],
+         [r["ttft"] * 1000 * speed for r in compared if r["ttft"] is not None]),
+        ("duration ms", [r["record"]["duration_ms"] for r in compared],
+         [r["duration"] * 1000 * speed for r in compared if r["duration"] is not None]),
+    )
+    print(f"{'':<14}{'captured p50':>14}{'p99':>10}{'replayed p50':>14}{'p99':>10}")
+    for name, captured, replayed in rows:
+        print(f"{name:<14}{percentile(captured, 50):>14.1f}{percentile(captured, 99):>10.1f}"
+              f"{percentile(replayed, 50):>14.1f}{percentile(replayed, 99):>10.1f}")
+    return 1 if mismatches or errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="+", help="capture JSONL file(s)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than captured")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--server", choices=["async", "flask"], default="async",
+                        help="proxy mode: async_proxy.py, or unthink_proxy under gunicorn")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers (flask)")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker (flask)")
+    args = parser.parse_args()
+
+    records = load(args.capture, args.limit)
+    if not records:
+        sys.exit("no captured requests")
+    results, unmatched = asyncio.run(replay(records, args))
+    sys.exit(report(results, unmatched, args.speed))
+
+
+if __name__ == '__main__':
+    main()
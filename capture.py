@@ -0,0 +1,137 @@
+"""Opt-in capture of sampled generation traffic, for replay with benchmarks/replay_capture.py."""
+import logging
+import os
+import random
+import threading
+import time
+
+import json_backend
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+# Fraction of /api/chat and /api/generate requests to record
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE") or 0.01)
+CAPTURE_FILE = os.getenv("CAPTURE_FILE") or os.path.join(os.getenv("LOG_DIR", "logs"), "capture.jsonl")
+# Capturing stops once the file reaches this size; move the file away to resume
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES") or 100 * 1024 * 1024)
+
+# Frames with only these fields are stored as their text alone
+_PLAIN_FRAME_KEYS = {"model", "created_at", "message", "response", "done"}
+
+
+def frame_text(frame, path):
+    """The generated text of a decoded frame"""
+    if path == 'chat':
+        message = frame.get("message")
+        return message.get("content") if isinstance(message, dict) else None
+    return frame.get("response")
+
+
+def compact_frame(line, path):
+    """A frame as stored in the capture: its text, or the whole frame if it carries more"""
+    # NDJSONFramer hands out memoryviews, which only orjson decodes
+    line = bytes(line)
+    try:
+        frame = json_backend.loads(line)
+    except (json_backend.JSONDecodeError, UnicodeDecodeError):
+        return {"raw": line.decode('utf-8', 'replace')}
+    if not isinstance(frame, dict) or frame.get("done") is not False or not frame.keys() <= _PLAIN_FRAME_KEYS:
+        return frame
+    message = frame.get("message")
+    if path == 'chat' and not (isinstance(message, dict) and message.keys() <= {"role", "content"}):
+        return frame
+    text = frame_text(frame, path)
+    return text if isinstance(text, str) else frame
+
+
+class CaptureRecorder:
+    """Records one sampled request: its body, every upstream frame and what the client got
+
+    Frame offsets are milliseconds since the request was sent upstream.
+    """
+
+    def __init__(self, capture, upstream_request, start_time, sent_at):
+        self.capture = capture
+        self.path = upstream_request.path
+        self.sent_at = sent_at
+        self.record = {
+            "ts": round(start_time, 3),
+            "path": self.path,
+            "request": upstream_request.data,
+            "queued_ms": round((sent_at - start_time) * 1000, 1),
+        }
+        self.frames = []
+        self.output = []
+        self.ttft_ms = None
+
+    def frame(self, line, output):
+        offset = round((time.time() - self.sent_at) * 1000, 1)
+        self.frames.append([offset, compact_frame(line, self.path)])
+        if not output:
+            return
+        try:
+            text = frame_text(json_backend.loads(output), self.path)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError, AttributeError):
+            return
+        if text:
+            if self.ttft_ms is None:
+                self.ttft_ms = offset
+            self.output.append(text)
+
+    def finish(self, outcome):
+        self.record.update(
+            outcome=outcome,
+            ttft_ms=self.ttft_ms,
+            duration_ms=round((time.time() - self.sent_at) * 1000, 1),
+            frames=self.frames,
+            output="".join(self.output),
+        )
+        self.capture.write(self.record)
+
+
+class TrafficCapture:
+    """Appends sampled requests to a JSONL file of bounded size"""
+
+    def __init__(self, path=CAPTURE_FILE, sample_rate=CAPTURE_SAMPLE_RATE, max_bytes=CAPTURE_MAX_BYTES,
+                 enabled=CAPTURE_ENABLED):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._full = False
+        self._lock = threading.Lock()
+
+    def start(self, upstream_request, start_time, sent_at):
+        """A recorder for this request, or None when it is not sampled"""
+        if not self.enabled or upstream_request.path not in ('chat', 'generate'):
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        return CaptureRecorder(self, upstream_request, start_time, sent_at)
+
+    def write(self, record):
+        line = json_backend.dumps(record) + b'\n'
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size + len(line) > self.max_bytes:
+                if not self._full:
+                    logger.warning(f"Capture file {self.path} reached {self.max_bytes} bytes, capture paused")
+                    self._full = True
+                return False
+            self._full = False
+            try:
+                # 每条记录单独打开文件，文件被移走后会自动重新创建
+                with open(self.path, 'ab') as f:
+                    f.write(line)
+            except OSError as e:
+                logger.error(f"Failed to write capture record: {str(e)}")
+                return False
+        return True
+
+
+CAPTURE = TrafficCapture()
@@ -0,0 +1,156 @@
+"""Fitting the history of chat requests into a context budget before forwarding."""
+import json
+import logging
+import math
+import os
+
+from backend_pool import model_name
+from metrics import CONTEXT_COMPACTIONS, CONTEXT_TOKENS_DROPPED
+from token_estimate import TOKEN_COUNTER
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "false").lower() == "true"
+# Prompt tokens a chat request may have (0 = only requests that set options.num_ctx are compacted)
+CONTEXT_BUDGET = int(os.getenv("CONTEXT_BUDGET") or 0)
+# Per-model budgets, e.g. {"qwen3:8b": 8192}
+MODEL_CONTEXT_BUDGETS = json.loads(os.getenv("MODEL_CONTEXT_BUDGETS") or "{}")
+# Room left for the answer when the budget is derived from options.num_ctx without num_predict
+CONTEXT_RESERVE = int(os.getenv("CONTEXT_RESERVE") or 1024)
+# The most recent messages are never dropped, only shortened as a last resort
+COMPACTION_KEEP_RECENT = int(os.getenv("COMPACTION_KEEP_RECENT") or 4)
+
+# Template tokens around each message (role markers and separators)
+MESSAGE_OVERHEAD = 4
+TRIM_MARKER = "[...]\n"
+
+_MODEL_BUDGETS = {model_name(model): int(budget) for model, budget in MODEL_CONTEXT_BUDGETS.items()}
+
+
+class Compaction:
+    """What compact_history() did to one request"""
+
+    def __init__(self, budget, tokens, dropped_messages=0, dropped_tokens=0, trimmed_messages=0):
+        self.budget = budget
+        self.tokens = tokens
+        self.dropped_messages = dropped_messages
+        self.dropped_tokens = dropped_tokens
+        self.trimmed_messages = trimmed_messages
+
+    @property
+    def changed(self):
+        return bool(self.dropped_messages or self.trimmed_messages)
+
+    def headers(self):
+        """Response headers telling the client what was left out"""
+        return {
+            'X-Context-Tokens': f"{self.tokens}/{self.budget}",
+            'X-Context-Dropped-Messages': str(self.dropped_messages),
+            'X-Context-Dropped-Tokens': str(self.dropped_tokens),
+            'X-Context-Trimmed-Messages': str(self.trimmed_messages),
+        }
+
+
+def context_budget(upstream_request):
+    """Prompt tokens allowed for a request, or None when it has no budget"""
+    budget = _MODEL_BUDGETS.get(model_name(upstream_request.model), CONTEXT_BUDGET) or None
+    options = upstream_request.data.get('options')
+    num_ctx = options.get('num_ctx') if isinstance(options, dict) else None
+    if isinstance(num_ctx, int) and num_ctx > 0:
+        # Ollama cuts the prompt at num_ctx minus what it keeps for the answer
+        num_predict = upstream_request.num_predict
+        reserve = num_predict if num_predict and num_predict > 0 else CONTEXT_RESERVE
+        derived = max(num_ctx - reserve, 1)
+        budget = min(budget, derived) if budget else derived
+    return budget
+
+
+def message_tokens(model, message, counter=TOKEN_COUNTER):
+    if not isinstance(message, dict):
+        return MESSAGE_OVERHEAD
+    tokens = MESSAGE_OVERHEAD + counter.count(model, message.get('content') or '')
+    if message.get('tool_calls'):
+        tokens += counter.count(model, json.dumps(message['tool_calls']))
+    return tokens
+
+
+def _role(message):
+    return message.get('role') if isinstance(message, dict) else None
+
+
+def compact_history(upstream_request, request_id="", counter=TOKEN_COUNTER, keep_recent=None):
+    """Drop, then trim, the oldest turns of a chat request until it fits its budget
+
+    System messages and the last ``keep_recent`` messages (extended back to
+    the user message that starts their turn) are kept.  A turn, i.e. a user
+    message with the replies and tool results that follow it, is dropped as
+    a whole.  If the kept messages alone are still too long, the oldest of
+    them lose the start of their text.  Returns a Compaction, or None when
+    the request has no budget.
+    """
+    messages = upstream_request.data.get('messages')
+    if upstream_request.path != 'chat' or not isinstance(messages, list):
+        return None
+    budget = context_budget(upstream_request)
+    if budget is None:
+        return None
+    model = model_name(upstream_request.model)
+    counts = [message_tokens(model, message, counter) for message in messages]
+    total = sum(counts)
+    if total <= budget:
+        CONTEXT_COMPACTIONS.labels(model=model, result='fits').inc()
+        return Compaction(budget, total)
+
+    if keep_recent is None:
+        keep_recent = COMPACTION_KEEP_RECENT
+    keep_from = max(len(messages) - max(keep_recent, 1), 0)
+    while keep_from > 0 and _role(messages[keep_from]) not in ('user', 'system'):
+        keep_from -= 1
+    turns = []
+    for i in range(keep_from):
+        role = _role(messages[i])
+        if role == 'system':
+            continue
+        if not turns or role == 'user':
+            turns.append([])
+        turns[-1].append(i)
+
+    dropped = set()
+    for turn in turns:
+        if total <= budget:
+            break
+        dropped.update(turn)
+        total -= sum(counts[i] for i in turn)
+    dropped_tokens = sum(counts[i] for i in dropped)
+
+    kept = [(i, message) for i, message in enumerate(messages) if i not in dropped]
+    trimmed = 0
+    for position, (i, message) in enumerate(kept):
+        if total <= budget:
+            break
+        content = message.get('content') if isinstance(message, dict) else None
+        if _role(message) == 'system' or not isinstance(content, str) or not content:
+            continue
+        excess = total - budget
+        # Keep the end of the text, which is what the conversation continues from
+        text_tokens = counter.count(model, content)
+        keep_chars = max(len(content) - math.ceil(len(content) * (excess + 8) / max(text_tokens, 1)), 0)
+        shortened = TRIM_MARKER + content[len(content) - keep_chars:] if keep_chars else TRIM_MARKER
+        new_count = message_tokens(model, dict(message, content=shortened), counter)
+        if new_count >= counts[i]:
+            continue
+        total -= counts[i] - new_count
+        dropped_tokens += counts[i] - new_count
+        kept[position] = (i, dict(message, content=shortened))
+        trimmed += 1
+
+    upstream_request.data['messages'] = [message for _, message in kept]
+    upstream_request.modified = True
+    CONTEXT_COMPACTIONS.labels(model=model, result='trimmed' if trimmed else 'dropped').inc()
+    CONTEXT_TOKENS_DROPPED.labels(model=model).inc(dropped_tokens)
+    logger.info(
+        f"[{request_id}] Compacted history to ~{total}/{budget} tokens: dropped {len(dropped)} messages, "
+        f"trimmed {trimmed}, ~{dropped_tokens} tokens left out"
+    )
+    return Compaction(budget, total, len(dropped), dropped_tokens, trimmed)
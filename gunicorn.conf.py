@@ -0,0 +1,23 @@
+"""gunicorn settings for the Docker image
+
+Only the Prometheus multiprocess hooks live here; bind address, worker count
+and timeout are given on the command line in the Dockerfile.
+"""
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):
+    """Start from an empty metrics directory; files of a previous run would be counted again"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited; its counters are kept"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,192 @@
+"""Background liveness probing of the Ollama server, shared by all workers."""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from metrics import UPSTREAM_PROBE_LATENCY, UPSTREAM_UP
+from upstream import get_session
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL") or 10)
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT") or 5)
+HEALTH_STATE_DIR = os.getenv("HEALTH_STATE_DIR") or tempfile.gettempdir()
+
+
+def probe(server, timeout=HEALTH_PROBE_TIMEOUT):
+    """Check the server once; returns the fields of a health snapshot"""
+    start = time.monotonic()
+    try:
+        response = get_session().get(f"{server}/api/tags", timeout=timeout)
+        latency = time.monotonic() - start
+        response.close()
+        if response.status_code != 200:
+            return {
+                "status": "degraded",
+                "latency_ms": round(latency * 1000, 1),
+                "message": f"Ollama server returned status {response.status_code}",
+            }
+        # 查询当前已加载到显存的模型
+        response = get_session().get(f"{server}/api/ps", timeout=timeout)
+        loaded = response.json().get("models", []) if response.status_code == 200 else []
+        return {
+            "status": "healthy",
+            "latency_ms": round(latency * 1000, 1),
+            "loaded_models": [model.get("name") or model.get("model") for model in loaded],
+        }
+    except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+        return {
+            "status": "unhealthy",
+            "latency_ms": None,
+            "message": str(e),
+        }
+
+
+class HealthProber:
+    """Probes one upstream server on an interval from a daemon thread
+
+    Every worker runs a prober thread, but only the one holding the lock
+    file probes; the others read the snapshot it writes next to the lock.
+    If the probing worker dies its lock is released and another takes over.
+    """
+
+    def __init__(self, server, interval=HEALTH_PROBE_INTERVAL, timeout=HEALTH_PROBE_TIMEOUT,
+                 state_dir=HEALTH_STATE_DIR):
+        self.server = server
+        self.interval = interval
+        self.timeout = timeout
+        name = hashlib.sha1(server.encode('utf-8')).hexdigest()[:12]
+        self.state_file = os.path.join(state_dir, f"unthink-proxy-health-{name}.json")
+        self.lock_file = self.state_file + ".lock"
+        self.state = None
+        self._lock_fd = None
+        self._thread = None
+        self._pid = None
+        self._first_tick = threading.Event()
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def ensure_running(self):
+        """Start the prober thread in this process if it is not running yet"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker does not inherit the parent's thread or lock
+            self._lock_fd = None
+            self._first_tick = threading.Event()
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def snapshot(self):
+        """The latest health state, marked stale if nobody probed recently"""
+        self.ensure_running()
+        if self.state is None:
+            # Only the first request of a worker waits for a probe
+            self._first_tick.wait(self.timeout)
+        state = dict(self.state or {"status": "unknown", "message": "No probe result yet"})
+        state["upstream"] = self.server
+        checked_at = state.get("checked_at")
+        if checked_at is not None:
+            state["age_seconds"] = round(max(time.time() - checked_at, 0), 1)
+            if state["age_seconds"] > 3 * self.interval + self.timeout:
+                state["status"] = "unknown"
+                state["message"] = "Health state is stale"
+        return state
+
+    def tick(self):
+        """Probe if this process is the elected prober, otherwise read the shared state"""
+        if self._is_prober():
+            previous = self.state or self._read_state() or {}
+            state = probe(self.server, self.timeout)
+            if state["status"] == "healthy":
+                state["consecutive_failures"] = 0
+            else:
+                state["consecutive_failures"] = previous.get("consecutive_failures", 0) + 1
+                logger.warning(f"Health probe failed: {state.get('message')}")
+            state["checked_at"] = time.time()
+            state["prober_pid"] = os.getpid()
+            self._write_state(state)
+        else:
+            state = self._read_state() or self.state
+
+        self.state = state
+        if state is not None:
+            UPSTREAM_UP.labels(backend=self.server).set(1 if state["status"] == "healthy" else 0)
+            if state.get("latency_ms") is not None:
+                UPSTREAM_PROBE_LATENCY.labels(backend=self.server).set(state["latency_ms"] / 1000)
+        self._first_tick.set()
+
+    def stop(self):
+        """Stop the prober thread and give up the prober role"""
+        self._stopped.set()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self._pid = None
+
+    def _run(self):
+        stopped = self._stopped
+        while not stopped.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Health prober error: {str(e)}")
+                self._first_tick.set()
+            stopped.wait(self.interval)
+
+    def _is_prober(self):
+        if fcntl is None:
+            return True
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # Kept open (and locked) for the lifetime of the process
+        self._lock_fd = fd
+        return True
+
+    def _read_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, state):
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.state_file), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logger.error(f"Could not write health state: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def health_status(state):
+    """HTTP status for a snapshot: only a healthy upstream answers 200"""
+    return 200 if state["status"] == "healthy" else 503
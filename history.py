@@ -0,0 +1,47 @@
+"""Request-side removal of thinking blocks from earlier assistant turns."""
+import logging
+import os
+
+from backend_pool import model_name
+from metrics import HISTORY_THINKING_BYTES_REMOVED, HISTORY_THINKING_TOKENS_REMOVED
+from think_stripper import ThinkStripper
+from token_estimate import TOKEN_COUNTER
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+HISTORY_STRIP_ENABLED = os.getenv("HISTORY_STRIP_ENABLED", "false").lower() == "true"
+
+
+def strip_history(upstream_request, open_tag=None, close_tag=None, request_id="", counter=TOKEN_COUNTER, profile=None):
+    """Remove thinking blocks from the assistant messages of a chat request
+
+    A trailing assistant message is left alone: it is the start of the answer
+    the model is asked to continue.  Returns (bytes, estimated tokens) removed.
+    """
+    messages = upstream_request.data.get('messages')
+    if upstream_request.path != 'chat' or not isinstance(messages, list):
+        return 0, 0
+    removed_bytes = 0
+    removed_tokens = 0
+    model = model_name(upstream_request.model)
+    last = len(messages) - 1
+    for i, message in enumerate(messages):
+        if i == last or not isinstance(message, dict) or message.get('role') != 'assistant':
+            continue
+        content = message.get('content')
+        if not isinstance(content, str) or not content:
+            continue
+        stripper = ThinkStripper(open_tag, close_tag, profile=profile)
+        cleaned = stripper.feed(content) + stripper.flush()
+        if not stripper.blocks_removed and not stripper.thinking_started:
+            continue
+        removed_bytes += len(content.encode('utf-8')) - len(cleaned.encode('utf-8'))
+        removed_tokens += counter.count(model, content) - counter.count(model, cleaned)
+        messages[i] = dict(message, content=cleaned)
+    if removed_bytes:
+        upstream_request.modified = True
+        HISTORY_THINKING_BYTES_REMOVED.labels(model=model).inc(removed_bytes)
+        HISTORY_THINKING_TOKENS_REMOVED.labels(model=model).inc(removed_tokens)
+        logger.info(f"[{request_id}] Removed thinking from history: {removed_bytes} bytes, ~{removed_tokens} tokens")
+    return removed_bytes, removed_tokens
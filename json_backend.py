@@ -0,0 +1,35 @@
+"""JSON encode/decode helpers that use orjson when it is installed."""
+import json
+import os
+
+JSON_BACKEND = (os.getenv("JSON_BACKEND") or "auto").lower()
+
+try:
+    if JSON_BACKEND == "json":
+        raise ImportError("stdlib json backend requested")
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data):
+        """Decode JSON from bytes or str"""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Encode ``obj`` as compact UTF-8 JSON bytes"""
+        return orjson.dumps(obj)
+else:
+    BACKEND = "json"
+
+    def loads(data):
+        """Decode JSON from bytes or str"""
+        return json.loads(data)
+
+    def dumps(obj):
+        """Encode ``obj`` as compact UTF-8 JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
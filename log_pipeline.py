@@ -0,0 +1,184 @@
+"""Queue-based logging: request threads only enqueue, a listener thread writes the handlers."""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import LOG_RECORDS_DROPPED
+
+# Configuration
+# text: the classic "time - name - level - message" lines; json: one JSON object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Records waiting for the listener; further records are dropped instead of blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE") or 10000)
+# Records per second allowed from each call site (0 disables the limit)
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT") or 50)
+DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
+# Fraction of requests whose headers, bodies and raw chunks are logged in DEBUG_MODE
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE") or 0.1)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Messages of the proxies start with "[<request id>] "
+_REQUEST_ID = re.compile(r'\[([^\]\s]+)\] ')
+
+
+def debug_sampled():
+    """Whether this request's debug payloads are logged"""
+    return DEBUG_MODE and random.random() < DEBUG_SAMPLE_RATE
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object"""
+
+    def format(self, record):
+        message = record.getMessage()
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+        }
+        match = _REQUEST_ID.match(message)
+        if match:
+            entry["request_id"] = match.group(1)
+            message = message[match.end():]
+        entry["message"] = message
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The original line format, noting how many records the rate limit dropped before this one"""
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            line += f" ({suppressed} similar messages suppressed)"
+        return line
+
+
+def create_formatter(log_format=LOG_FORMAT):
+    if log_format == 'json':
+        return JSONFormatter()
+    return TextFormatter(TEXT_FORMAT)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site, so one noisy log statement cannot flood the queue
+
+    The first record let through after some were dropped carries their
+    count in its ``suppressed`` attribute.
+    """
+
+    def __init__(self, rate=LOG_RATE_LIMIT):
+        super().__init__()
+        self.rate = rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # [tokens, last refill, records dropped since the last one let through]
+                bucket = self._buckets[key] = [self.rate, now, 0]
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                allowed = False
+            else:
+                bucket[0] -= 1
+                record.suppressed, bucket[2] = bucket[2], 0
+                allowed = True
+        if not allowed:
+            LOG_RECORDS_DROPPED.labels(reason='rate_limited').inc()
+        return allowed
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of raising"""
+
+    def prepare(self, record):
+        # The message is rendered here, while its arguments are still valid;
+        # unlike the base class the traceback stays apart for the JSON formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason='queue_full').inc()
+
+
+class LogPipeline:
+    """Routes a logger through a bounded queue to handlers run by a listener thread"""
+
+    def __init__(self, handlers, queue_size=LOG_QUEUE_SIZE, rate_limit=LOG_RATE_LIMIT):
+        self.handlers = handlers
+        self.queue = queue.Queue(queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(RateLimitFilter(rate_limit))
+        self.listener = None
+
+    def install(self, logger):
+        logger.addHandler(self.handler)
+        self.start()
+        return self
+
+    def start(self):
+        if self.listener is None:
+            self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        """Write out the queued records and stop the listener"""
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+    def after_fork(self):
+        # The listener thread does not survive a fork and the queue's lock may
+        # have been held by it: start over in the child
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.listener = None
+        self.start()
+
+
+def setup_logging(logger, handlers):
+    """Send ``logger``'s records to ``handlers`` through the queue; returns the pipeline"""
+    for handler in handlers:
+        handler.setFormatter(create_formatter())
+    pipeline = LogPipeline(handlers).install(logger)
+    atexit.register(pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=pipeline.after_fork)
+    return pipeline
@@ -0,0 +1,104 @@
+"""TTL cache with ETag support for Ollama metadata endpoints (/api/tags etc.)."""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from metrics import METADATA_CACHE_REQUESTS
+
+# Configuration
+# Off by default: every worker keeps its own cache, so a model pulled or
+# deleted through one worker leaves the others serving their cached lists
+# until the TTL runs out
+METADATA_CACHE_ENABLED = os.getenv("METADATA_CACHE_ENABLED", "false").lower() == "true"
+DEFAULT_METADATA_TTLS = {
+    "api/tags": 30,
+    "api/version": 300,
+}
+METADATA_CACHE_TTLS = {
+    **DEFAULT_METADATA_TTLS,
+    **json.loads(os.getenv("METADATA_CACHE_TTLS") or "{}")
+}
+
+# Never cached: the loaded models change with every request that loads or
+# unloads one, not only with model management
+UNCACHED_PATHS = ("api/ps",)
+
+# Requests that change the set of installed models
+MODEL_MANAGEMENT_PATHS = ('pull', 'delete', 'create', 'copy', 'push')
+INVALIDATED_PATHS = ("api/tags",)
+
+
+class MetadataEntry:
+    """A cached upstream response body with its ETag"""
+
+    def __init__(self, body, headers, ttl):
+        self.body = body
+        self.headers = headers
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.expires = time.monotonic() + ttl
+
+    def respond(self, if_none_match=None):
+        """Return (status, headers, body) for a client request"""
+        max_age = max(int(self.expires - time.monotonic()), 0)
+        headers = [('ETag', self.etag), ('Cache-Control', f'max-age={max_age}')]
+        if if_none_match and _etag_matches(if_none_match, self.etag):
+            return 304, headers, b''
+        return 200, self.headers + headers, self.body
+
+
+class MetadataCache:
+    """Per-path TTL cache for GET responses of metadata endpoints
+
+    The cache lives in one worker process, and so does ``invalidate()``.
+    """
+
+    def __init__(self, ttls):
+        self.ttls = ttls
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, path):
+        """TTL in seconds for a path, or None when it is not cached"""
+        path = path.strip('/')
+        if path in UNCACHED_PATHS:
+            return None
+        ttl = self.ttls.get(path)
+        return ttl if ttl and ttl > 0 else None
+
+    def get(self, path):
+        path = path.strip('/')
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.expires <= time.monotonic():
+                del self._entries[path]
+                entry = None
+        METADATA_CACHE_REQUESTS.labels(path=path, result='hit' if entry else 'miss').inc()
+        return entry
+
+    def put(self, path, body, headers):
+        path = path.strip('/')
+        entry = MetadataEntry(body, headers, self.ttl_for(path) or 0)
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    def invalidate(self, paths=INVALIDATED_PATHS):
+        with self._lock:
+            for path in paths:
+                self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+METADATA_CACHE = MetadataCache(METADATA_CACHE_TTLS)
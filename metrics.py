@@ -1,6 +1,21 @@
-from prometheus_client import Counter, Histogram, Gauge, generate_latest
+from prometheus_client import CollectorRegistry, Counter, Histogram, Gauge, generate_latest, multiprocess
+import os
 import time
 
+# With several gunicorn workers every process writes its values to this
+# directory and /metrics aggregates them (see gunicorn.conf.py).  It has to be
+# set in the environment before prometheus_client is imported.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Endpoints reported under their own label; any other path is reported as the
+# route template that served it, so arbitrary URLs cannot create new series
+KNOWN_ENDPOINTS = frozenset((
+    '/', '/health',
+    '/api/chat', '/api/generate', '/api/show', '/api/tags', '/api/ps', '/api/version',
+    '/api/embed', '/api/embeddings', '/api/pull', '/api/push', '/api/create', '/api/copy',
+    '/api/delete', '/v1/chat/completions', '/v1/completions', '/v1/models', '/v1/embeddings',
+))
+
 # Define metrics
 REQUEST_COUNT = Counter(
     'unthink_proxy_requests_total',
@@ -16,7 +31,8 @@ REQUEST_LATENCY = Histogram(
 
 ACTIVE_REQUESTS = Gauge(
     'unthink_proxy_active_requests',
-    'Number of active requests'
+    'Number of active requests',
+    multiprocess_mode='livesum'
 )
 
 THINKING_CONTENT_REMOVED = Counter(
@@ -30,6 +46,289 @@ OLLAMA_REQUEST_ERRORS = Counter(
     ['error_type']
 )
 
+UPSTREAM_POOL_CONNECTIONS = Counter(
+    'unthink_proxy_upstream_pool_connections_total',
+    'Upstream connection checkouts, by whether a pooled connection was reused',
+    ['result']
+)
+
+UPSTREAM_POOL_WAIT = Histogram(
+    'unthink_proxy_upstream_pool_wait_seconds',
+    'Time spent waiting for an upstream connection from the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+UPSTREAM_POOL_EVICTIONS = Counter(
+    'unthink_proxy_upstream_pool_evictions_total',
+    'Pooled upstream connections closed after sitting idle too long'
+)
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    'unthink_proxy_response_cache_requests_total',
+    'Response cache lookups for cacheable requests',
+    ['result']
+)
+
+RESPONSE_CACHE_EVICTIONS = Counter(
+    'unthink_proxy_response_cache_evictions_total',
+    'Response cache entries evicted',
+    ['reason']
+)
+
+RESPONSE_CACHE_BYTES = Gauge(
+    'unthink_proxy_response_cache_bytes',
+    'Approximate size of the cached responses in bytes',
+    multiprocess_mode='livesum'
+)
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    'unthink_proxy_single_flight_requests_total',
+    'Coalescable requests, by whether they started an upstream generation or joined one',
+    ['role']
+)
+
+SINGLE_FLIGHT_ABANDONED = Counter(
+    'unthink_proxy_single_flight_abandoned_total',
+    'Shared upstream generations stopped because every subscriber disconnected'
+)
+
+METADATA_CACHE_REQUESTS = Counter(
+    'unthink_proxy_metadata_cache_requests_total',
+    'Metadata endpoint cache lookups',
+    ['path', 'result']
+)
+
+UPSTREAM_UP = Gauge(
+    'unthink_proxy_upstream_up',
+    'Whether the last background health probe of an Ollama server succeeded',
+    ['backend'],
+    multiprocess_mode='livemostrecent'
+)
+
+UPSTREAM_PROBE_LATENCY = Gauge(
+    'unthink_proxy_upstream_probe_latency_seconds',
+    'Response time of the last background health probe',
+    ['backend'],
+    multiprocess_mode='livemostrecent'
+)
+
+BACKEND_IN_FLIGHT = Gauge(
+    'unthink_proxy_backend_in_flight',
+    'Generation requests currently outstanding per Ollama server',
+    ['backend'],
+    multiprocess_mode='livesum'
+)
+
+BACKEND_LATENCY = Gauge(
+    'unthink_proxy_backend_latency_seconds',
+    'Time until the response headers of the last request per Ollama server',
+    ['backend'],
+    multiprocess_mode='livemostrecent'
+)
+
+BACKEND_REQUESTS = Counter(
+    'unthink_proxy_backend_requests_total',
+    'Requests routed to each Ollama server, by routing reason',
+    ['backend', 'reason']
+)
+
+ADMISSION_ACTIVE = Gauge(
+    'unthink_proxy_admission_active',
+    'Generation requests admitted and running, per model',
+    ['model'],
+    multiprocess_mode='livesum'
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'unthink_proxy_admission_queue_depth',
+    'Requests waiting for a concurrency slot, per model',
+    ['model'],
+    multiprocess_mode='livesum'
+)
+
+ADMISSION_WAIT = Histogram(
+    'unthink_proxy_admission_wait_seconds',
+    'Time requests waited for a concurrency slot before being admitted',
+    ['model'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+ADMISSION_REJECTED = Counter(
+    'unthink_proxy_admission_rejected_total',
+    'Requests shed because the wait queue was full or the wait took too long',
+    ['model', 'reason']
+)
+
+UPSTREAM_RETRIES = Counter(
+    'unthink_proxy_upstream_retries_total',
+    'Decisions taken after a failed upstream attempt',
+    ['outcome']
+)
+
+RETRY_BUDGET_TOKENS = Gauge(
+    'unthink_proxy_retry_budget_tokens',
+    'Retries currently available in the retry budget',
+    multiprocess_mode='livesum'
+)
+
+CIRCUIT_STATE = Gauge(
+    'unthink_proxy_circuit_state',
+    'Circuit breaker state per Ollama server (0 closed, 1 half-open, 2 open)',
+    ['backend'],
+    multiprocess_mode='livemax'
+)
+
+CIRCUIT_TRANSITIONS = Counter(
+    'unthink_proxy_circuit_transitions_total',
+    'Circuit breaker state changes per Ollama server',
+    ['backend', 'state']
+)
+
+CIRCUIT_SHORT_CIRCUITED = Counter(
+    'unthink_proxy_circuit_short_circuited_total',
+    'Requests failed fast because every Ollama server circuit was open'
+)
+
+STREAMS_ABORTED = Counter(
+    'unthink_proxy_streams_aborted_total',
+    'Streams whose upstream generation was cancelled before it finished',
+    ['reason']
+)
+
+TOKENS_NOT_GENERATED = Counter(
+    'unthink_proxy_tokens_not_generated_total',
+    'Estimated tokens Ollama did not have to generate because a stream was aborted'
+)
+
+GPU_SECONDS_SAVED = Counter(
+    'unthink_proxy_gpu_seconds_saved_total',
+    'Estimated generation time saved by aborting abandoned streams'
+)
+
+STREAM_TIMEOUTS = Counter(
+    'unthink_proxy_stream_timeouts_total',
+    'Upstream requests ended because a phase ran past its deadline',
+    ['phase']
+)
+
+# Streamed generations, by model; the durations run from the arrival of the request
+STREAM_DURATION = Histogram(
+    'unthink_proxy_stream_duration_seconds',
+    'Time until the last frame of a generation was sent',
+    ['model'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+)
+
+TIME_TO_FIRST_CHUNK = Histogram(
+    'unthink_proxy_time_to_first_chunk_seconds',
+    'Time until the first frame arrived from Ollama, thinking included',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+TIME_TO_FIRST_TOKEN = Histogram(
+    'unthink_proxy_time_to_first_token_seconds',
+    'Time until the first frame visible to the client, i.e. after the thinking block',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+
+CHUNK_GAP = Histogram(
+    'unthink_proxy_chunk_gap_seconds',
+    'Time between two consecutive frames from Ollama',
+    ['model'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    'unthink_proxy_generation_tokens_per_second',
+    'Generation speed reported by Ollama (eval_count / eval_duration)',
+    ['model'],
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+)
+
+ANSWER_TOKENS = Counter(
+    'unthink_proxy_answer_tokens_total',
+    'Tokens generated by Ollama that reached the client (eval_count minus thinking)',
+    ['model']
+)
+
+THINKING_TOKENS_REMOVED = Counter(
+    'unthink_proxy_thinking_tokens_removed_total',
+    'Frames (about one token each) dropped because they only carried thinking',
+    ['model']
+)
+
+THINKING_CHARS_REMOVED = Counter(
+    'unthink_proxy_thinking_chars_removed_total',
+    'Characters of thinking content removed, tags included',
+    ['model']
+)
+
+THINKING_BUDGET_HITS = Counter(
+    'unthink_proxy_thinking_budget_hits_total',
+    'Generations cut off because their thinking block exceeded the budget',
+    ['model', 'action']
+)
+THINKING_BUDGET_TOKENS_SAVED = Counter(
+    'unthink_proxy_thinking_budget_tokens_saved_total',
+    'Estimated thinking tokens not generated because of a budget cutoff',
+    ['model']
+)
+
+THINKING_SUPPRESSION = Counter(
+    'unthink_proxy_thinking_suppression_total',
+    'Generation requests by how thinking was turned off upstream (none: left to the stripper)',
+    ['model', 'method']
+)
+
+HISTORY_THINKING_BYTES_REMOVED = Counter(
+    'unthink_proxy_history_thinking_bytes_removed_total',
+    'Bytes of thinking blocks removed from earlier assistant turns of chat requests',
+    ['model']
+)
+HISTORY_THINKING_TOKENS_REMOVED = Counter(
+    'unthink_proxy_history_thinking_tokens_removed_total',
+    'Estimated prompt tokens Ollama did not have to evaluate because thinking was removed from the history',
+    ['model']
+)
+
+CONTEXT_COMPACTIONS = Counter(
+    'unthink_proxy_context_compactions_total',
+    'Chat requests checked against their context budget, by whether history had to be dropped or trimmed',
+    ['model', 'result']
+)
+CONTEXT_TOKENS_DROPPED = Counter(
+    'unthink_proxy_context_tokens_dropped_total',
+    'Estimated prompt tokens left out of chat requests to fit their context budget',
+    ['model']
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'unthink_proxy_log_records_dropped_total',
+    'Log records discarded by the rate limit or because the log queue was full',
+    ['reason']
+)
+
+class _ClosingBody:
+    """Response iterable that reports when the server is done sending it"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
 class MetricsMiddleware:
     def __init__(self, app):
         self.app = app
@@ -41,22 +340,41 @@ class MetricsMiddleware:
         # Skip metrics for the metrics endpoint itself
         if path == '/metrics':
             return self.app(environ, start_response)
+        path = endpoint_label(path)
         
         # Track request
         ACTIVE_REQUESTS.inc()
         start_time = time.time()
+        status = [500]
         
-        def custom_start_response(status, headers, exc_info=None):
-            # Record metrics after request is processed
-            status_code = int(status.split(' ')[0])
-            REQUEST_COUNT.labels(method=method, endpoint=path, status=status_code).inc()
+        def custom_start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(' ')[0])
+            return start_response(status_line, headers, exc_info)
+
+        def finished():
+            # 流式响应要等整个body发送完（或客户端断开）才算结束
+            REQUEST_COUNT.labels(method=method, endpoint=path, status=status[0]).inc()
             REQUEST_LATENCY.labels(method=method, endpoint=path).observe(time.time() - start_time)
             ACTIVE_REQUESTS.dec()
-            
-            return start_response(status, headers, exc_info)
-        
-        return self.app(environ, custom_start_response)
+
+        try:
+            body = self.app(environ, custom_start_response)
+        except BaseException:
+            finished()
+            raise
+        return _ClosingBody(body, finished)
+
+def endpoint_label(path):
+    """The ``endpoint`` label for a request path"""
+    if path in KNOWN_ENDPOINTS:
+        return path
+    return '/api/<path>' if path.startswith('/api/') else '/<path>'
 
 def get_metrics():
     """Return all metrics in Prometheus format"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        # 汇总所有worker进程的指标
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
     return generate_latest()
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""Per-model registry of how thinking can be turned off upstream, learned from /api/show."""
+import json
+import logging
+import os
+import threading
+import time
+
+from backend_pool import model_name
+from metrics import THINKING_SUPPRESSION
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+# Rewrite generation requests so that models that can skip thinking do
+THINKING_SUPPRESSION_ENABLED = os.getenv("THINKING_SUPPRESSION_ENABLED", "false").lower() == "true"
+# Appended to the system prompt of models that only have a prompt switch
+NO_THINK_PROMPT = os.getenv("NO_THINK_PROMPT") or "/no_think"
+# Model families (details.family of /api/show) that understand NO_THINK_PROMPT
+NO_THINK_PROMPT_FAMILIES = [
+    family.strip() for family in (os.getenv("NO_THINK_PROMPT_FAMILIES") or "qwen3").split(",") if family.strip()
+]
+# Manual entries that take precedence over detection, e.g. {"deepseek-r1:8b": "none"}
+MODEL_THINKING_SWITCHES = json.loads(os.getenv("MODEL_THINKING_SWITCHES") or "{}")
+# How long a detected entry is trusted, and how long to wait before asking again after a failure
+CAPABILITY_CACHE_TTL = float(os.getenv("CAPABILITY_CACHE_TTL") or 3600)
+CAPABILITY_RETRY_AFTER = float(os.getenv("CAPABILITY_RETRY_AFTER") or 60)
+# Timeout of the /api/show request that detects an entry
+CAPABILITY_PROBE_TIMEOUT = float(os.getenv("CAPABILITY_PROBE_TIMEOUT") or 5)
+
+# think_param: the "think": false request option; system_prompt: NO_THINK_PROMPT;
+# none: the model thinks and the stream is stripped as before
+SWITCHES = ('think_param', 'system_prompt', 'none')
+
+
+def detect_switch(show):
+    """The thinking switch of a model, from its /api/show response"""
+    if not isinstance(show, dict):
+        return 'none'
+    if 'thinking' in (show.get('capabilities') or ()):
+        # Ollama lists the capability from the version on that accepts "think"
+        return 'think_param'
+    details = show.get('details') or {}
+    families = [details.get('family')] + list(details.get('families') or ())
+    if any(family in NO_THINK_PROMPT_FAMILIES for family in families if family):
+        return 'system_prompt'
+    return 'none'
+
+
+class CapabilityRegistry:
+    """Cached thinking switch per model
+
+    ``fetch`` callables take a model name and return its /api/show response;
+    any exception they raise leaves the model with the stripper for
+    ``retry_after`` seconds.
+    """
+
+    def __init__(self, ttl=CAPABILITY_CACHE_TTL, retry_after=CAPABILITY_RETRY_AFTER,
+                 overrides=MODEL_THINKING_SWITCHES):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.overrides = {model_name(model): switch for model, switch in overrides.items()}
+        self._entries = {}
+        # Models whose /api/show answered, i.e. that exist upstream
+        self._detected = set()
+        self._lock = threading.Lock()
+
+    def listed(self, model):
+        """Whether a model has a manual entry or was detected from /api/show"""
+        model = model_name(model)
+        if model in self.overrides:
+            return True
+        with self._lock:
+            return model in self._detected
+
+    def cached(self, model):
+        """The known switch of a model, or None when it has to be detected"""
+        model = model_name(model)
+        if model in self.overrides:
+            return self.overrides[model]
+        with self._lock:
+            entry = self._entries.get(model)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def switch_for(self, model, fetch):
+        switch = self.cached(model)
+        if switch is not None:
+            return switch
+        try:
+            return self._learn(model, fetch(model))
+        except Exception as e:
+            return self._failed(model, e)
+
+    async def async_switch_for(self, model, fetch):
+        switch = self.cached(model)
+        if switch is not None:
+            return switch
+        try:
+            return self._learn(model, await fetch(model))
+        except Exception as e:
+            return self._failed(model, e)
+
+    def invalidate(self):
+        """Forget detected entries, e.g. after a model was pulled or created"""
+        with self._lock:
+            self._entries.clear()
+
+    def _learn(self, model, show):
+        switch = detect_switch(show)
+        with self._lock:
+            self._entries[model_name(model)] = (switch, time.monotonic() + self.ttl)
+            self._detected.add(model_name(model))
+        logger.info(f"Thinking switch of {model}: {switch}")
+        return switch
+
+    def _failed(self, model, error):
+        logger.warning(f"Could not detect the capabilities of {model}: {str(error)}")
+        with self._lock:
+            self._entries[model_name(model)] = ('none', time.monotonic() + self.retry_after)
+        return 'none'
+
+
+CAPABILITIES = CapabilityRegistry()
+
+
+def suppress_thinking(upstream_request, switch, prompt=NO_THINK_PROMPT):
+    """Rewrite a generation request to turn thinking off; returns the method used
+
+    A request that sets "think" itself is left as the client asked.
+    """
+    data = upstream_request.data
+    if 'think' in data:
+        switch = 'none'
+    elif switch == 'think_param':
+        data['think'] = False
+        upstream_request.modified = True
+    elif switch == 'system_prompt':
+        if upstream_request.path == 'chat':
+            messages = list(data.get('messages') or [])
+            if messages and isinstance(messages[0], dict) and messages[0].get('role') == 'system':
+                messages[0] = dict(messages[0], content=_with_prompt(messages[0].get('content'), prompt))
+            else:
+                messages.insert(0, {"role": "system", "content": prompt})
+            data['messages'] = messages
+        else:
+            data['system'] = _with_prompt(data.get('system'), prompt)
+        upstream_request.modified = True
+    else:
+        switch = 'none'
+    THINKING_SUPPRESSION.labels(model=model_name(upstream_request.model), method=switch).inc()
+    return switch
+
+
+def _with_prompt(text, prompt):
+    if not text:
+        return prompt
+    if prompt in text:
+        return text
+    return f"{text}\n{prompt}"
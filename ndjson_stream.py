@@ -0,0 +1,235 @@
+"""Line-level processing of Ollama NDJSON responses, shared by both server modes."""
+import logging
+import os
+
+import json_backend
+from think_stripper import ThinkStripper
+
+logger = logging.getLogger("unthink-proxy")
+
+# Forward lines untouched / patch only the content field whenever possible
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+# Size of each read from the upstream response
+UPSTREAM_READ_SIZE = int(os.getenv("UPSTREAM_READ_SIZE") or 65536)
+
+CONTENT_KEY = b'"content":'
+NOT_DONE = b'"done":false'
+
+
+class ChatStreamProcessor:
+    """Removes thinking blocks from an Ollama response stream, one line at a time
+
+    Most lines are handled without decoding them: once the stripper is outside
+    a thinking block and nothing is held back, a line that cannot contain the
+    first character of an open tag is forwarded as-is, and other mid-stream
+    lines get only their ``content`` string replaced.  Anything unusual falls
+    back to a full decode.
+    """
+
+    def __init__(self, open_tag=None, close_tag=None, request_id="", debug=False, fast_path=None, profile=None):
+        self.stripper = ThinkStripper(open_tag, close_tag, profile=profile)
+        self.request_id = request_id
+        self.debug = debug
+        self.fast_path = FAST_PATH_ENABLED if fast_path is None else fast_path
+        self.chunk_count = 0
+        self.passthrough_count = 0
+        self.patched_count = 0
+        # The first characters of the open tags (and, until the first block,
+        # of the close tags), raw or as the prefix of a JSON \u escape
+        profile = self.stripper.profile
+        self._tag_markers = _first_char_markers(profile.open_tags)
+        self._leading_markers = _first_char_markers(profile.leading.tags)
+
+    def process_line(self, chunk):
+        """Return the bytes to forward for one upstream line (empty to drop it)
+
+        ``chunk`` may be bytes or a memoryview from NDJSONFramer, with or
+        without its trailing newline.  A terminated bytes line that needs no
+        change is returned as the same object; a view is copied exactly once.
+        """
+        self.chunk_count += 1
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        size = len(chunk)
+        terminated = size and chunk[-1] == 0x0a
+        if terminated:
+            size -= 1
+            if size and chunk[size - 1] == 0x0d:
+                size -= 1
+                terminated = False
+        if not size:
+            return b''
+
+        if self.fast_path and self._can_pass_through(chunk):
+            self.passthrough_count += 1
+            return chunk if terminated else chunk[:size] + b'\n'
+
+        chunk = chunk[:size]
+        if self.fast_path:
+            patched = self._patch_content(chunk)
+            if patched is not None:
+                self.patched_count += 1
+                return patched
+
+        return self._process_decoded(chunk)
+
+    @property
+    def blocks_removed(self):
+        return self.stripper.blocks_removed
+
+    def _can_pass_through(self, chunk):
+        stripper = self.stripper
+        if stripper.thinking_started or stripper.pending:
+            return False
+        if stripper.thinking_finished and stripper.strip_leading_whitespace and not stripper.answer_started:
+            # Leading whitespace of the answer still has to be removed
+            return False
+        markers = self._tag_markers if stripper.thinking_finished else self._leading_markers
+        for marker in markers:
+            if chunk.find(marker) != -1:
+                return False
+        return True
+
+    def _patch_content(self, chunk):
+        """Replace the ``message.content`` string in place, or None to decode"""
+        if NOT_DONE not in chunk or chunk.count(CONTENT_KEY) != 1:
+            return None
+        key = chunk.find(CONTENT_KEY)
+        start = key + len(CONTENT_KEY)
+        if chunk[start:start + 1] != b'"' or b'"message":' not in chunk[:key]:
+            return None
+        end = _string_end(chunk, start + 1)
+        if end == -1:
+            return None
+
+        raw = chunk[start:end + 1]
+        try:
+            content = json_backend.loads(raw)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError):
+            return None
+        if content == '':
+            # Tool calls and similar frames carry no text to strip
+            return bytes(chunk) + b'\n'
+        if self.debug:
+            logger.debug(f"[{self.request_id}] Raw content: {content}")
+
+        cleaned_content = self.stripper.feed(content)
+        if cleaned_content == '':
+            return b''
+        return b''.join((chunk[:start], json_backend.dumps(cleaned_content), chunk[end + 1:], b'\n'))
+
+    def _process_decoded(self, chunk):
+        try:
+            # Parse the JSON response
+            data = json_backend.loads(chunk)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError) as e:
+            logger.error(f"[{self.request_id}] JSON decode error: {str(e)}")
+            return bytes(chunk) + b'\n'
+
+        message = data.get('message') if isinstance(data, dict) else None
+        content = message.get('content') if isinstance(message, dict) else None
+        done = isinstance(data, dict) and data.get('done')
+
+        # Check if this is a message with content, or the final frame that
+        # has to carry any held-back text
+        if not content and not (content is not None and done and self.stripper.pending):
+            # Forward non-content messages (like 'done' messages)
+            return bytes(chunk) + b'\n'
+
+        # Raw response from LLM
+        if self.debug:
+            logger.debug(f"[{self.request_id}] Raw content: {content}")
+
+        cleaned_content = self.stripper.feed(content)
+        if done:
+            cleaned_content += self.stripper.flush()
+        if cleaned_content == '' and not done:
+            return b''
+
+        # Update the content in the data
+        message['content'] = cleaned_content
+        return json_backend.dumps(data) + b'\n'
+
+
+def _first_char_markers(tags):
+    """Bytes that show a line may contain one of ``tags``
+
+    The \\u escape prefix may match a few other characters too.
+    """
+    firsts = sorted({tag[0] for tag in tags})
+    return tuple(
+        marker for first in firsts
+        for marker in (first.encode('utf-8'), f'\\u{ord(first):04x}'[:-1].encode('ascii'))
+    )
+
+
+def _string_end(data, pos):
+    """Index of the quote closing the JSON string whose body starts at ``pos``"""
+    while True:
+        pos = data.find(b'"', pos)
+        if pos == -1:
+            return -1
+        backslashes = 0
+        while data[pos - 1 - backslashes] == 0x5c:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return pos
+        pos += 1
+
+
+class NDJSONFramer:
+    """Splits a byte stream into NDJSON lines without copying complete lines
+
+    Feed it large reads from the upstream response; it yields every complete
+    line, newline included, as a memoryview into the read (or the read
+    itself when it holds exactly one line).  A view is only valid until the
+    next line is requested.  Only a line that spans two reads is copied.
+    """
+
+    def __init__(self):
+        self._partial = None
+
+    def feed(self, data):
+        """Yield every line completed by ``data``"""
+        if not data:
+            return
+        start = 0
+        if self._partial is not None:
+            idx = data.find(b'\n')
+            if idx == -1:
+                self._partial += data
+                return
+            self._partial += data[:idx + 1]
+            line = self._partial
+            self._partial = None
+            yield memoryview(line)
+            start = idx + 1
+
+        idx = data.find(b'\n', start)
+        if start == 0 and idx == len(data) - 1:
+            # The usual case while streaming: one read, one line
+            yield data
+            return
+        view = memoryview(data)
+        while idx != -1:
+            yield view[start:idx + 1]
+            start = idx + 1
+            idx = data.find(b'\n', start)
+        if start < len(data):
+            self._partial = bytearray(view[start:])
+
+    def close(self):
+        """Return the unterminated last line, if any"""
+        partial = self._partial
+        self._partial = None
+        return memoryview(partial) if partial else None
+
+
+def iter_frames(reads):
+    """Yield the NDJSON lines contained in an iterable of reads"""
+    framer = NDJSONFramer()
+    for data in reads:
+        yield from framer.feed(data)
+    tail = framer.close()
+    if tail is not None:
+        yield tail
@@ -0,0 +1,119 @@
+"""Single-pass decoding and normalization of proxied API requests."""
+import logging
+
+import json_backend
+
+logger = logging.getLogger("unthink-proxy")
+
+
+class RequestError(Exception):
+    """A request that cannot be forwarded; carries the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class NormalizedRequest:
+    """A decoded API request together with the body to send upstream
+
+    Stages that change ``data`` must set ``modified``; otherwise the original
+    request bytes are forwarded as they arrived.
+    """
+
+    def __init__(self, path, data, raw, modified=False):
+        self.path = path
+        self.data = data
+        self.raw = raw
+        self.modified = modified
+
+    @property
+    def model(self):
+        return self.data.get("model", "")
+
+    @property
+    def stream(self):
+        # Ollama streams unless told otherwise
+        return self.data.get("stream", True) is not False
+
+    @property
+    def num_predict(self):
+        """Requested maximum number of tokens to generate, if any"""
+        options = self.data.get("options")
+        if isinstance(options, dict) and isinstance(options.get("num_predict"), int):
+            return options["num_predict"]
+        return None
+
+    def body(self):
+        """Bytes to send upstream, re-encoded only if a stage changed the data"""
+        if self.modified:
+            return json_backend.dumps(self.data)
+        return self.raw
+
+
+def parse_json_body(data):
+    """解析请求体JSON，失败时尝试将单引号替换为双引号后再解析
+
+    Returns the decoded object and whether the quote repair was needed.
+    """
+    try:
+        return json_backend.loads(data), False
+    except (json_backend.JSONDecodeError, UnicodeDecodeError) as e:
+        error = e
+    try:
+        fixed_data = data.decode('utf-8').replace("'", "\"")
+        return json_backend.loads(fixed_data), True
+    except (json_backend.JSONDecodeError, UnicodeDecodeError):
+        raise error
+
+
+def convert_litellm_generate(request_data):
+    """将LiteLLM的generate格式请求转换为chat格式"""
+    chat_data = {
+        "model": request_data.get("model", ""),
+        "messages": [
+            {"role": "user", "content": request_data.get("prompt", "")}
+        ],
+        "stream": request_data.get("stream", False)
+    }
+
+    # 如果有options，转换相关参数
+    if "options" in request_data:
+        options = request_data["options"]
+        if "temperature" in options:
+            chat_data["temperature"] = options["temperature"]
+        if "num_predict" in options:
+            chat_data["max_tokens"] = options["num_predict"]
+
+    return chat_data
+
+
+def normalize_request(path, raw, is_litellm=False, request_id=""):
+    """Decode a request body once and apply the request-side transformations
+
+    Raises RequestError when the body is empty or not valid JSON.
+    """
+    if not raw:
+        logger.error(f"[{request_id}] Empty request body")
+        raise RequestError("Empty request body")
+
+    try:
+        data, repaired = parse_json_body(raw)
+    except (json_backend.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.error(f"[{request_id}] Invalid JSON format: {str(e)}")
+        raise RequestError(f"Invalid JSON format: {str(e)}")
+    if repaired:
+        logger.info(f"[{request_id}] Successfully fixed and parsed JSON")
+    if not isinstance(data, dict):
+        raise RequestError("Invalid JSON format: request body must be an object")
+
+    request = NormalizedRequest(path, data, raw, modified=repaired)
+
+    # 如果是LiteLLM请求，检查是否需要转换格式
+    if is_litellm and path == 'generate' and 'prompt' in data:
+        logger.info(f"[{request_id}] 转换LiteLLM generate请求格式为chat格式")
+        request.data = convert_litellm_generate(data)
+        request.path = "chat"  # 改为使用chat API
+        request.modified = True
+
+    return request
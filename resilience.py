@@ -0,0 +1,214 @@
+"""Retry policy, retry budget and per-backend circuit breakers for upstream calls."""
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+import requests
+
+from metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS, RETRY_BUDGET_TOKENS, UPSTREAM_RETRIES
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the async server
+    aiohttp = None
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX") or 10)
+# Retries allowed per request on average, plus a floor per second
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO") or 0.1)
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("RETRY_BUDGET_MIN_PER_SEC") or 1)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD") or 5)
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT") or 30)
+
+# Upstream statuses that mean "try again later" rather than "this request is wrong"
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+def _status(exc):
+    """HTTP status of an upstream error response, or None for transport errors"""
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status
+    return None
+
+
+def is_retryable(exc):
+    """Whether an upstream error is worth another attempt
+
+    Only failures that happen before the request reached a model are
+    retried.  A read timeout means the generation may still be running on
+    the GPU, so retrying it would only add load.
+    """
+    status = _status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.Timeout):
+        return False
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return True
+    if aiohttp is not None:
+        if isinstance(exc, aiohttp.ConnectionTimeoutError):
+            return True
+        if isinstance(exc, asyncio.TimeoutError):
+            return False
+        if isinstance(exc, aiohttp.ClientConnectionError):
+            return True
+    return False
+
+
+def is_backend_failure(exc):
+    """Whether an error counts against the backend's circuit breaker"""
+    status = _status(exc)
+    return status is None or status >= 500
+
+
+def error_status(exc):
+    """Status to answer the client with: the upstream's for client errors, else 503"""
+    status = _status(exc)
+    return status if status is not None and 400 <= status < 500 else 503
+
+
+class RetryBudget:
+    """Token bucket that caps retries at a fraction of the request rate"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SEC, capacity=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity or max(10.0, 10 * min_per_second)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Called once per request"""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Take a token for one retry; False when the budget is used up"""
+        with self._lock:
+            self._refill(0)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            RETRY_BUDGET_TOKENS.set(self.tokens)
+            return True
+
+    def _refill(self, amount):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self.tokens = min(self.capacity, self.tokens + amount)
+        RETRY_BUDGET_TOKENS.set(self.tokens)
+
+
+class RetryPolicy:
+    """Decides whether and when to retry a failed upstream attempt"""
+
+    def __init__(self, max_attempts, base_delay, max_delay=RETRY_BACKOFF_MAX, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def start(self):
+        self.budget.deposit()
+
+    def next_delay(self, exc, attempt):
+        """Backoff before attempt ``attempt + 1``, or None to give up"""
+        if attempt >= self.max_attempts:
+            outcome = 'attempts_exhausted'
+        elif not is_retryable(exc):
+            outcome = 'not_retryable'
+        elif not self.budget.withdraw():
+            outcome = 'budget_exhausted'
+        else:
+            outcome = 'retried'
+        UPSTREAM_RETRIES.labels(outcome=outcome).inc()
+        if outcome != 'retried':
+            return None
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitOpenError(Exception):
+    """Every backend's circuit is open; ``retry_after`` is a hint in whole seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__("Upstream circuit open, not sending requests")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed
+
+    While open, requests are not sent to the backend at all.  After the
+    reset timeout one trial request is let through; its outcome closes the
+    circuit again or re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(backend=name).set(0)
+
+    def available(self):
+        """Whether a request may be sent now (does not claim the half-open trial)"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            return self.state == self.CLOSED or not self._trial_in_flight and self.state == self.HALF_OPEN
+
+    def retry_after(self):
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, math.ceil(remaining))
+
+    def attempt(self):
+        """A request is being sent; in half-open state it is the trial"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Circuit for {self.name} is now {state}")
+        self.state = state
+        CIRCUIT_STATE.labels(backend=self.name).set(self._GAUGE[state])
+        CIRCUIT_TRANSITIONS.labels(backend=self.name, state=state).inc()
+
@@ -0,0 +1,188 @@
+"""Cache of stripped responses for deterministic generation requests."""
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import json_backend
+from metrics import RESPONSE_CACHE_BYTES, RESPONSE_CACHE_EVICTIONS, RESPONSE_CACHE_REQUESTS
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES") or 64 * 1024 * 1024)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL") or 3600)
+
+CACHEABLE_PATHS = ('chat', 'generate')
+# Request fields that do not change what the model generates
+IGNORED_FIELDS = ('stream', 'keep_alive')
+# Fields of a mid-stream frame that a replay reproduces; anything else (tool
+# calls, images, separate thinking) makes the response uncacheable
+PLAIN_FRAME_FIELDS = {'model', 'created_at', 'message', 'response', 'done'}
+PLAIN_MESSAGE_FIELDS = {'role', 'content'}
+
+
+def is_deterministic(data):
+    """Whether the request pins sampling, so the same request gives the same answer"""
+    options = data.get('options') or {}
+    if not isinstance(options, dict):
+        return False
+    if options.get('seed') is not None:
+        return True
+    # Ollama ignores a top-level temperature; only options change sampling
+    temperature = options.get('temperature')
+    try:
+        return temperature is not None and float(temperature) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+def request_key(request):
+    """Canonical hash of a NormalizedRequest's path, model, input and options"""
+    canonical = {
+        key: value for key, value in request.data.items() if key not in IGNORED_FIELDS
+    }
+    canonical['__path__'] = request.path
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(request):
+    return request.path in CACHEABLE_PATHS and is_deterministic(request.data)
+
+
+class CachedResponse:
+    """A stripped answer and its final frame, replayable as stream or single object"""
+
+    def __init__(self, path, content, final):
+        self.path = path
+        self.content = content
+        self.final = self._with_content(final, '')
+        self.size = len(content.encode('utf-8')) + len(json_backend.dumps(self.final))
+
+    def _with_content(self, frame, content):
+        frame = copy.deepcopy(frame)
+        if self.path == 'generate':
+            frame['response'] = content
+        else:
+            frame.setdefault('message', {'role': 'assistant'})['content'] = content
+        return frame
+
+    def replay(self, stream):
+        """NDJSON lines equivalent to what the proxy sent for the original request"""
+        if not stream:
+            return [json_backend.dumps(self._with_content(self.final, self.content)) + b'\n']
+        first = {key: self.final[key] for key in ('model', 'created_at') if key in self.final}
+        first['done'] = False
+        return [
+            json_backend.dumps(self._with_content(first, self.content)) + b'\n',
+            json_backend.dumps(self.final) + b'\n',
+        ]
+
+
+class ResponseCache:
+    """Byte-budgeted LRU cache with a TTL per entry"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] <= time.monotonic():
+                self._remove(key, 'ttl')
+                item = None
+            if item is None:
+                RESPONSE_CACHE_REQUESTS.labels(result='miss').inc()
+                return None
+            self._entries.move_to_end(key)
+            RESPONSE_CACHE_REQUESTS.labels(result='hit').inc()
+            return item[0]
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, 'replaced')
+            self._entries[key] = (entry, time.monotonic() + self.ttl)
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)), 'size')
+            RESPONSE_CACHE_BYTES.set(self.size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            RESPONSE_CACHE_BYTES.set(0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key, reason):
+        entry, _ = self._entries.pop(key)
+        self.size -= entry.size
+        RESPONSE_CACHE_EVICTIONS.labels(reason=reason).inc()
+        RESPONSE_CACHE_BYTES.set(self.size)
+
+
+class CacheRecorder:
+    """Collects the stripped frames of a response and stores them once complete"""
+
+    def __init__(self, cache, key, path):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self._content = []
+        self._final = None
+        self._failed = False
+
+    def observe(self, output):
+        """Record one NDJSON line sent to the client"""
+        if self._failed or not output:
+            return
+        try:
+            data = json_backend.loads(output)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError):
+            self._failed = True
+            return
+        if not isinstance(data, dict) or 'error' in data:
+            self._failed = True
+            return
+        message = data.get('message')
+        if (
+            (message is not None and not (isinstance(message, dict) and message.keys() <= PLAIN_MESSAGE_FIELDS)) or
+            (not data.get('done') and not data.keys() <= PLAIN_FRAME_FIELDS)
+        ):
+            # Only the text and the final frame are stored
+            self._failed = True
+            return
+        if self.path == 'generate':
+            content = data.get('response')
+        else:
+            content = (message or {}).get('content')
+        if content:
+            self._content.append(content)
+        if data.get('done'):
+            self._final = data
+
+    def finish(self):
+        """Store the response if the stream completed normally"""
+        if self._failed or self._final is None:
+            return
+        entry = CachedResponse(self.path, ''.join(self._content), self._final)
+        self.cache.put(self.key, entry)
+        logger.debug(f"Cached response {self.key[:12]} ({entry.size} bytes)")
+
+
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
@@ -0,0 +1,228 @@
+"""Coalescing of identical in-flight upstream generations (single-flight)."""
+import asyncio
+import logging
+import os
+import threading
+
+from metrics import SINGLE_FLIGHT_ABANDONED, SINGLE_FLIGHT_REQUESTS
+from response_cache import request_key
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "false").lower() == "true"
+
+
+def flight_key(request, budget=None, profile=None):
+    """Key of the final upstream request and of how its output is handled
+
+    ``request`` is the NormalizedRequest as forwarded, i.e. after history
+    stripping, compaction and thinking suppression.  Requests only share a
+    flight if they also agree on streaming, the thinking budget and the tag
+    profile, since those change the frames the clients receive.
+    """
+    parts = [request_key(request), str(int(request.stream))]
+    if budget is not None and budget.active:
+        parts.append(f"budget={budget.tokens},{budget.seconds},{budget.action}")
+    if profile is not None:
+        parts.append(f"tags={profile.name}")
+    return ":".join(parts)
+
+
+class _FlightBase:
+    """One upstream generation whose output frames are shared by subscribers
+
+    Every frame is kept until the flight ends so that late subscribers can
+    catch up from the first frame.  When the last subscriber leaves before
+    the generation is done, the flight is abandoned and the producer stops.
+    """
+
+    def __init__(self, group, key):
+        self.group = group
+        self.key = key
+        self.frames = []
+        self.done = False
+        self.abandoned = False
+        self.subscribers = 0
+
+    def _attach(self):
+        self.subscribers += 1
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self.abandoned = True
+            SINGLE_FLIGHT_ABANDONED.inc()
+            self.group.discard(self)
+
+    def _end(self):
+        self.done = True
+        self.group.discard(self)
+
+
+class Flight(_FlightBase):
+    """Flight for thread-based servers"""
+
+    def __init__(self, group, key):
+        super().__init__(group, key)
+        self._cond = threading.Condition()
+
+    def publish(self, frame):
+        """Add a frame; returns False once nobody is listening any more"""
+        with self._cond:
+            if self.abandoned:
+                return False
+            self.frames.append(frame)
+            self._cond.notify_all()
+            return True
+
+    def finish(self):
+        with self._cond:
+            self._end()
+            self._cond.notify_all()
+
+    def run(self, outputs):
+        """Drive a generator of output frames to completion (producer thread)"""
+        try:
+            for frame in outputs:
+                if not self.publish(frame):
+                    logger.info(f"All subscribers left, stopping flight {self.key[:12]}")
+                    break
+        finally:
+            outputs.close()
+            self.finish()
+
+    def subscribe(self):
+        """Attach a subscriber now and return a Subscription to its frames"""
+        return Subscription(self)
+
+    def _frames(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.frames) and not self.done:
+                    self._cond.wait()
+                frames = self.frames[index:]
+                done = self.done
+            for frame in frames:
+                yield frame
+            index += len(frames)
+            if done and index >= len(self.frames):
+                return
+
+
+class Subscription:
+    """Every frame of a thread-based flight, starting from the first one
+
+    The subscriber counts from creation on, not from the first iteration, so
+    a WSGI response that is closed before its body was iterated still
+    detaches, and the flight is abandoned if nobody else is listening.
+    """
+
+    def __init__(self, flight):
+        self.flight = flight
+        self._closed = False
+        with flight._cond:
+            flight._attach()
+        self._frames = flight._frames()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._frames)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        with self.flight._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self.flight._detach()
+        self._frames.close()
+
+
+class AsyncFlight(_FlightBase):
+    """Flight for the asyncio server; all methods run on the event loop"""
+
+    def __init__(self, group, key):
+        super().__init__(group, key)
+        self._changed = asyncio.Event()
+
+    def publish(self, frame):
+        if self.abandoned:
+            return False
+        self.frames.append(frame)
+        self._wake()
+        return True
+
+    def finish(self):
+        self._end()
+        self._wake()
+
+    async def run(self, outputs):
+        try:
+            async for frame in outputs:
+                if not self.publish(frame):
+                    logger.info(f"All subscribers left, stopping flight {self.key[:12]}")
+                    break
+        finally:
+            await outputs.aclose()
+            self.finish()
+
+    async def subscribe(self):
+        self._attach()
+        index = 0
+        try:
+            while True:
+                while index < len(self.frames):
+                    frame = self.frames[index]
+                    index += 1
+                    yield frame
+                if self.done:
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            self._detach()
+
+    def _wake(self):
+        # Swap in a fresh event so waiters registered later block again
+        changed = self._changed
+        self._changed = asyncio.Event()
+        changed.set()
+
+
+class SingleFlightGroup:
+    """Registry of the flights currently in progress, by request key"""
+
+    def __init__(self, flight_class=Flight):
+        self.flight_class = flight_class
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Return (flight, is_leader); the leader must start the producer"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.done and not flight.abandoned:
+                SINGLE_FLIGHT_REQUESTS.labels(role='follower').inc()
+                return flight, False
+            flight = self.flight_class(self, key)
+            self._flights[key] = flight
+            SINGLE_FLIGHT_REQUESTS.labels(role='leader').inc()
+            return flight, True
+
+    def discard(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def __len__(self):
+        return len(self._flights)
+
+
+FLIGHTS = SingleFlightGroup(Flight)
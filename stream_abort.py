@@ -0,0 +1,107 @@
+"""Detection of abandoned streams and accounting of the generation they saved."""
+import logging
+import os
+import socket
+import threading
+import time
+
+import json_backend
+from metrics import GPU_SECONDS_SAVED, STREAMS_ABORTED, TOKENS_NOT_GENERATED
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+# How often to look at the client connection while nothing is written to it
+DISCONNECT_CHECK_INTERVAL = float(os.getenv("DISCONNECT_CHECK_INTERVAL") or 1)
+
+
+def client_socket(environ):
+    """The client connection of a WSGI request, if the server exposes it"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+
+def socket_closed(sock):
+    """Whether the peer has closed the connection, without consuming any data"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class DisconnectWatch:
+    """Rate-limited check of whether the client went away
+
+    Needed while thinking blocks are being removed: nothing is written to
+    the client then, so the server cannot notice a hang-up by itself.
+    """
+
+    def __init__(self, is_closed, interval=DISCONNECT_CHECK_INTERVAL):
+        self.is_closed = is_closed
+        self.interval = interval
+        self._next_check = time.monotonic() + interval
+
+    @classmethod
+    def for_socket(cls, sock, interval=DISCONNECT_CHECK_INTERVAL):
+        if sock is None:
+            return cls(lambda: False, interval)
+        return cls(lambda: socket_closed(sock), interval)
+
+    def client_gone(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        return self.is_closed()
+
+
+class OutputLengths:
+    """Per-model moving averages of answer length and time per token"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, final_line):
+        """Learn from the final frame of a completed stream"""
+        try:
+            final = json_backend.loads(final_line)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError):
+            return
+        eval_count = final.get('eval_count') if isinstance(final, dict) else None
+        if not eval_count:
+            return
+        per_token = (final.get('eval_duration') or 0) / 1e9 / eval_count
+        with self._lock:
+            tokens, seconds = self._stats.get(model, (eval_count, per_token))
+            self._stats[model] = (0.8 * tokens + 0.2 * eval_count, 0.8 * seconds + 0.2 * per_token)
+
+    def estimate(self, model):
+        """(expected tokens, seconds per token), or None before the first completion"""
+        return self._stats.get(model)
+
+
+OUTPUT_LENGTHS = OutputLengths()
+
+
+def record_abort(reason, model, generated, elapsed, num_predict=None, lengths=OUTPUT_LENGTHS):
+    """Count an aborted stream and the GPU time it is estimated to have saved
+
+    ``generated`` is the number of frames (about one token each) received
+    before the abort, over ``elapsed`` seconds.
+    """
+    STREAMS_ABORTED.labels(reason=reason).inc()
+    estimate = lengths.estimate(model)
+    expected = num_predict if num_predict and num_predict > 0 else (estimate and estimate[0])
+    if not expected:
+        return 0.0
+    per_token = estimate[1] if estimate else 0.0
+    if generated > 1:
+        per_token = elapsed / generated
+    remaining = max(expected - generated, 0)
+    saved = remaining * per_token
+    TOKENS_NOT_GENERATED.inc(remaining)
+    GPU_SECONDS_SAVED.inc(saved)
+    logger.info(f"Aborted stream ({reason}) for {model}: ~{remaining:.0f} tokens, ~{saved:.1f}s of generation saved")
+    return saved
@@ -0,0 +1,131 @@
+"""Per-model latency and token accounting of streamed generations."""
+import os
+import threading
+import time
+
+import json_backend
+from backend_pool import model_name
+from metrics import (
+    ANSWER_TOKENS, CHUNK_GAP, GENERATION_TOKENS_PER_SECOND, STREAM_DURATION,
+    THINKING_CHARS_REMOVED, THINKING_TOKENS_REMOVED, TIME_TO_FIRST_CHUNK, TIME_TO_FIRST_TOKEN
+)
+from model_capabilities import CAPABILITIES
+
+# Configuration
+# Models that always get their own label, e.g. "qwen3:32b,deepseek-r1:8b"
+METRIC_MODELS = [model.strip() for model in (os.getenv("METRIC_MODELS") or "").split(",") if model.strip()]
+# Other models a worker labels by name before it counts the rest as "other"
+METRIC_MODEL_LIMIT = int(os.getenv("METRIC_MODEL_LIMIT") or 32)
+
+DONE = b'"done":true'
+OTHER_MODEL = 'other'
+
+
+class ModelLabels:
+    """Bounded set of model label values
+
+    Model names come from clients, so any name could otherwise create new
+    series.  Configured models and models the capability registry knows to
+    exist keep their name; the first ``limit`` others seen by the worker do
+    too, and everything after that is reported as "other".
+    """
+
+    def __init__(self, models=METRIC_MODELS, limit=METRIC_MODEL_LIMIT, capabilities=CAPABILITIES):
+        self.known = frozenset(model_name(model) for model in models)
+        self.limit = limit
+        self.capabilities = capabilities
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def label(self, model):
+        model = model_name(model) if model else ""
+        if model in self.known or self.capabilities.listed(model):
+            return model
+        with self._lock:
+            if model in self._seen:
+                return model
+            if len(self._seen) < self.limit:
+                self._seen.add(model)
+                return model
+        return OTHER_MODEL
+
+
+MODEL_LABELS = ModelLabels()
+
+
+class StreamMetrics:
+    """Timings of one generation stream
+
+    Call line() for every upstream frame with what was forwarded for it,
+    then finish() once, whether the stream completed or not.  ``started``
+    is the time.monotonic() at which the request arrived, so the
+    first-chunk and first-token times include queueing and retries.
+    """
+
+    def __init__(self, model, started, labels=None):
+        self.model = (labels or MODEL_LABELS).label(model)
+        self.started = started
+        self.last_chunk_at = None
+        self.first_token_at = None
+        self.thinking_frames = 0
+        # Stripper state after the previous frame
+        self._in_block = False
+        self._blocks = 0
+        # Thinking frames of generations replaced by a reissue
+        self._earlier_thinking_frames = 0
+        self._gap = CHUNK_GAP.labels(model=self.model)
+
+    def line(self, output, stripper=None):
+        """Account for one frame; ``stripper`` is the ThinkStripper of the stream
+
+        A dropped frame only counts as a thinking token if it was inside a
+        thinking block, so blank frames and the whitespace dropped after a
+        block are not counted.  Without a stripper every dropped frame is.
+        """
+        now = time.monotonic()
+        if self.last_chunk_at is None:
+            TIME_TO_FIRST_CHUNK.labels(model=self.model).observe(now - self.started)
+        else:
+            self._gap.observe(now - self.last_chunk_at)
+        self.last_chunk_at = now
+        thinking = stripper is None or self._inside_block(stripper)
+        if not output:
+            if thinking:
+                # 整个frame都是思考内容，被丢弃
+                self.thinking_frames += 1
+        elif self.first_token_at is None and DONE not in output:
+            self.first_token_at = now
+            TIME_TO_FIRST_TOKEN.labels(model=self.model).observe(now - self.started)
+
+    def _inside_block(self, stripper):
+        # In a block before or after the frame, or a block ended within it
+        inside = self._in_block or stripper.thinking_started or stripper.blocks_removed != self._blocks
+        self._in_block = stripper.thinking_started
+        self._blocks = stripper.blocks_removed
+        return inside
+
+    def reissued(self):
+        """The stream goes on with a new generation, whose final frame only counts its own tokens"""
+        self._earlier_thinking_frames = self.thinking_frames
+
+    def finish(self, final_line=None, thinking_chars=0):
+        """Record the stream's duration and, from Ollama's final frame, its token counts"""
+        STREAM_DURATION.labels(model=self.model).observe(time.monotonic() - self.started)
+        if thinking_chars:
+            THINKING_CHARS_REMOVED.labels(model=self.model).inc(thinking_chars)
+        if self.thinking_frames:
+            THINKING_TOKENS_REMOVED.labels(model=self.model).inc(self.thinking_frames)
+        if not final_line or DONE not in final_line:
+            return
+        try:
+            final = json_backend.loads(final_line)
+        except (json_backend.JSONDecodeError, UnicodeDecodeError):
+            return
+        eval_count = final.get('eval_count') if isinstance(final, dict) else None
+        if not eval_count:
+            return
+        thinking_frames = self.thinking_frames - self._earlier_thinking_frames
+        ANSWER_TOKENS.labels(model=self.model).inc(max(eval_count - thinking_frames, 0))
+        eval_duration = final.get('eval_duration')
+        if eval_duration:
+            GENERATION_TOKENS_PER_SECOND.labels(model=self.model).observe(eval_count / (eval_duration / 1e9))
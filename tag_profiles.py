@@ -0,0 +1,68 @@
+"""Per-model sets of thinking tags, selected by the model of a request."""
+import fnmatch
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from backend_pool import model_name
+from think_stripper import TagProfile
+
+# Configuration
+# Named lists of [open, close] tag pairs, e.g.
+# {"r1": [["<think>", "</think>"], ["<|begin_of_thought|>", "<|end_of_thought|>"]]}
+THINK_TAG_PROFILES = json.loads(os.getenv("THINK_TAG_PROFILES") or "{}")
+# Profile per model; keys may use shell wildcards, e.g. {"deepseek-r1*": "r1", "qwen3:32b": "qwen"}
+MODEL_TAG_PROFILES = json.loads(os.getenv("MODEL_TAG_PROFILES") or "{}")
+
+# Models remembered per worker; names come from clients, so the map is bounded
+PROFILE_CACHE_SIZE = 1024
+
+
+def load_profiles(profiles, models):
+    """Compile the configured profiles; unknown profile names are an error"""
+    compiled = {name: TagProfile(pairs, name) for name, pairs in profiles.items()}
+    exact = {}
+    patterns = []
+    for model, name in models.items():
+        if name not in compiled:
+            raise ValueError(f"Unknown think tag profile for {model}: {name}")
+        if any(char in model for char in '*?['):
+            patterns.append((model, compiled[name]))
+        else:
+            exact[model_name(model)] = compiled[name]
+    return exact, patterns
+
+
+class TagProfiles:
+    """Resolves the tag profile of a model: exact names first, then wildcards in order"""
+
+    def __init__(self, profiles=THINK_TAG_PROFILES, models=MODEL_TAG_PROFILES, cache_size=PROFILE_CACHE_SIZE):
+        self._exact, self._patterns = load_profiles(profiles, models)
+        self.cache_size = cache_size
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    def profile_for(self, model):
+        """The profile of ``model``, or None to use OPEN_THINK_TAG and CLOSE_THINK_TAG"""
+        if not self._exact and not self._patterns:
+            return None
+        model = model_name(model) if model else ""
+        with self._lock:
+            if model in self._resolved:
+                self._resolved.move_to_end(model)
+                return self._resolved[model]
+        profile = self._exact.get(model)
+        if profile is None:
+            for pattern, candidate in self._patterns:
+                if fnmatch.fnmatchcase(model, pattern) or fnmatch.fnmatchcase(model, model_name(pattern)):
+                    profile = candidate
+                    break
+        with self._lock:
+            self._resolved[model] = profile
+            if len(self._resolved) > self.cache_size:
+                self._resolved.popitem(last=False)
+        return profile
+
+
+TAG_PROFILES = TagProfiles()
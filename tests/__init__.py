@@ -1 +1,7 @@
-# Initialize tests package
\ No newline at end of file
+# Initialize tests package
+import os
+import tempfile
+
+# Importing unthink_proxy attaches a file handler under LOG_DIR; keep test
+# runs out of the repository's logs/ directory
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="unthink-proxy-tests-"))
@@ -0,0 +1,41 @@
+"""Fixtures shared by several test modules."""
+import json
+
+from request_pipeline import NormalizedRequest
+
+
+class StaticProber:
+    """Prober with a fixed state, for routing tests"""
+
+    def __init__(self, url):
+        self.url = url
+        self.state = {"status": "healthy", "loaded_models": [], "checked_at": 1}
+
+    def ensure_running(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def snapshot(self):
+        return dict(self.state)
+
+
+def chat(messages, **options):
+    """A normalized /api/chat request, with ``options`` when given"""
+    data = {"model": "m", "messages": messages}
+    if options:
+        data["options"] = options
+    return NormalizedRequest('chat', data, b'')
+
+
+def chat_line(content, done=False, **extra):
+    """One /api/chat response line as Ollama writes it"""
+    frame = {"model": "m", "created_at": "2025-01-01T00:00:00Z",
+             "message": {"role": "assistant", "content": content}, "done": done, **extra}
+    return json.dumps(frame, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def ndjson_lines(*frames):
+    """Upstream response lines, one JSON frame each"""
+    return [json.dumps(frame).encode('utf-8') + b'\n' for frame in frames]
@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import json
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import (
+    AdmissionController, AdmissionRejected, AsyncModelLimiter, ModelLimiter
+)
+import unthink_proxy
+
+
+class TestModelLimiter(unittest.TestCase):
+    def test_waiters_are_admitted_in_order(self):
+        limiter = ModelLimiter("m", 1, queue_size=4, max_wait=5)
+        first = limiter.acquire()
+        admitted = []
+
+        def wait(name):
+            slot = limiter.acquire()
+            admitted.append(name)
+            slot.release()
+
+        threads = []
+        for name in ("a", "b", "c"):
+            thread = threading.Thread(target=wait, args=(name,))
+            thread.start()
+            threads.append(thread)
+            # Make sure each thread is queued before starting the next one
+            while len(limiter._waiters) < len(threads):
+                time.sleep(0.001)
+        first.release()
+        first.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, ["a", "b", "c"])
+        self.assertEqual(limiter.active, 0)
+
+    def test_full_queue_is_rejected(self):
+        limiter = ModelLimiter("m", 1, queue_size=0, max_wait=5)
+        limiter.acquire()
+        with self.assertRaises(AdmissionRejected) as ctx:
+            limiter.acquire()
+        self.assertEqual(ctx.exception.status, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+    def test_wait_times_out(self):
+        limiter = ModelLimiter("m", 1, queue_size=1, max_wait=0.01)
+        limiter.acquire()
+        with self.assertRaises(AdmissionRejected) as ctx:
+            limiter.acquire()
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(len(limiter._waiters), 0)
+
+
+class TestAsyncModelLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_release_hands_slot_to_waiter(self):
+        limiter = AsyncModelLimiter("m", 1, queue_size=1, max_wait=5)
+        first = await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(AdmissionRejected):
+            await limiter.acquire()
+        first.release()
+        (await waiting).release()
+        self.assertEqual(limiter.active, 0)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        limiter = AsyncModelLimiter("m", 1, queue_size=1, max_wait=5)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(len(limiter._waiters), 0)
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_limits(self):
+        controller = AdmissionController(ModelLimiter, default_limit=0, overrides={"qwen3": 2})
+        self.assertIsNone(controller.limiter("llama3"))
+        self.assertEqual(controller.limiter("qwen3:latest").limit, 2)
+        self.assertIs(controller.limiter("qwen3"), controller.limiter("qwen3:latest"))
+
+    def test_proxy_sheds_with_retry_after(self):
+        controller = AdmissionController(ModelLimiter, default_limit=1, queue_size=0)
+        held = controller.limiter("m").acquire()
+        client = unthink_proxy.app.test_client()
+        with patch.object(unthink_proxy, 'ADMISSION', controller):
+            response = client.post('/api/chat', json={"model": "m", "messages": []})
+        held.release()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertIn("error", json.loads(response.data))
+
+
+if __name__ == "__main__":
+    unittest.main()
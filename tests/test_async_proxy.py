@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import SPLITS, create_app
+import async_proxy
+from metadata_cache import METADATA_CACHE
+
+
+CHUNKS = ["<th", "ink>plan", "</thi", "nk>\n\nHello", " world"]
+
+
+async def fake_chat(request):
+    body = await request.json()
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    for content in CHUNKS:
+        frame = {"model": body["model"], "message": {"role": "assistant", "content": content}, "done": False}
+        await response.write(json.dumps(frame).encode('utf-8') + b'\n')
+    await response.write(json.dumps({"model": body["model"], "message": {"role": "assistant", "content": ""}, "done": True}).encode('utf-8') + b'\n')
+    await response.write_eof()
+    return response
+
+
+async def fake_tags(request):
+    return web.json_response({"models": [{"name": "m"}]})
+
+
+class TestAsyncProxy(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        METADATA_CACHE.clear()
+        upstream = web.Application()
+        upstream.router.add_post('/api/chat', fake_chat)
+        upstream.router.add_get('/api/tags', fake_tags)
+        self.upstream = TestServer(upstream)
+        await self.upstream.start_server()
+        self.patcher = patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/'))
+        self.patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        self.patcher.stop()
+
+    async def test_chat_stream_is_stripped(self):
+        response = await self.client.post('/api/chat', json={"model": "m", "messages": []})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['X-Accel-Buffering'], 'no')
+        self.assertIn('X-Request-ID', response.headers)
+        frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertEqual("".join(f["message"]["content"] for f in frames), "Hello world")
+        self.assertTrue(frames[-1]["done"])
+
+    async def test_unexpected_error_ends_with_error_frame(self):
+        with patch('async_proxy.ChatStreamProcessor.process_line', side_effect=RuntimeError("boom")):
+            response = await self.client.post('/api/chat', json={"model": "m", "messages": []})
+            frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertEqual(frames, [{"error": "boom"}])
+
+    async def test_catch_all_and_health(self):
+        response = await self.client.get('/api/tags')
+        self.assertEqual((await response.json())["models"][0]["name"], "m")
+        response = await self.client.get('/health')
+        self.assertEqual(response.status, 200)
+
+    async def test_tags_are_cached(self):
+        with patch.object(async_proxy, 'METADATA_CACHE_ENABLED', True):
+            first = await self.client.get('/api/tags')
+            etag = first.headers['ETag']
+            response = await self.client.get('/api/tags', headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+    async def test_invalid_path(self):
+        response = await self.client.post('/api/unknown', json={})
+        self.assertEqual(response.status, 404)
+
+
+class TestFakeOllamaSplits(unittest.IsolatedAsyncioTestCase):
+    """The benchmark's fake server, in every tag layout, through the proxy"""
+
+    async def test_answer_is_stripped(self):
+        for split in SPLITS:
+            with self.subTest(split=split):
+                upstream = TestServer(create_app(think_tokens=3, answer_tokens=3, split=split, timestamps=True))
+                await upstream.start_server()
+                self.addAsyncCleanup(upstream.close)
+                with patch.object(async_proxy, 'OLLAMA_SERVER', str(upstream.make_url('')).rstrip('/')):
+                    client = TestClient(TestServer(async_proxy.create_app()))
+                    await client.start_server()
+                    self.addAsyncCleanup(client.close)
+                    response = await client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+                    frames = [json.loads(line) for line in (await response.read()).splitlines()]
+                self.assertEqual("".join(f["message"]["content"] for f in frames), "word0 word1 word2")
+                self.assertIn("sent_ns", frames[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend_pool import BackendPool, model_name
+from benchmarks.fake_ollama import STATE, create_app
+from tests.helpers import StaticProber
+import async_proxy
+
+
+class TestBackendPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = BackendPool(["http://a", "http://b", "http://c"], prober_factory=StaticProber)
+        self.a, self.b, self.c = self.pool.backends
+
+    def test_least_outstanding(self):
+        leases = [self.pool.acquire("m") for _ in range(6)]
+        self.assertEqual([b.outstanding for b in self.pool.backends], [2, 2, 2])
+        for lease in leases[:2]:
+            lease.release()
+            lease.release()
+        self.assertEqual(sum(b.outstanding for b in self.pool.backends), 4)
+
+    def test_prefers_backend_with_model_loaded(self):
+        self.b.prober.state["loaded_models"] = ["qwen3:8b"]
+        self.assertIs(self.pool.acquire("qwen3:8b").backend, self.b)
+        self.assertIs(self.pool.acquire("qwen3:8b").backend, self.b)
+        self.assertNotEqual(self.pool.acquire("llama3").backend, self.b)
+
+    def test_loaded_backend_is_skipped_when_too_busy(self):
+        self.b.prober.state["loaded_models"] = ["m:latest"]
+        backends = [self.pool.acquire("m").backend for _ in range(8)]
+        self.assertEqual(backends[:5], [self.b] * 5)
+        self.assertNotEqual(backends[5], self.b)
+
+    def test_served_model_counts_as_loaded_until_next_probe(self):
+        lease = self.pool.acquire("m")
+        lease.record_response(0.1)
+        self.assertTrue(lease.backend.has_loaded("m:latest"))
+        lease.backend.prober.state = {"status": "healthy", "loaded_models": [], "checked_at": 2}
+        self.assertFalse(lease.backend.has_loaded("m:latest"))
+
+    def test_unhealthy_and_excluded_backends_are_avoided(self):
+        self.a.prober.state["status"] = "unhealthy"
+        chosen = {self.pool.acquire("m", exclude=[self.b]).backend for _ in range(4)}
+        self.assertEqual(chosen, {self.c})
+        # With nothing else left, an excluded backend is still used
+        self.assertIs(self.pool.acquire("m", exclude=[self.b, self.c]).backend, self.b)
+
+    def test_health_aggregates_backends(self):
+        self.a.prober.state["status"] = "unhealthy"
+        health = self.pool.health()
+        self.assertEqual(health["status"], "healthy")
+        self.assertEqual(len(health["backends"]), 3)
+
+    def test_routing_starts_the_probers(self):
+        with patch.object(StaticProber, 'ensure_running') as ensure_running:
+            self.pool.acquire("m")
+            self.assertEqual(ensure_running.call_count, 3)
+            self.pool.choose()
+            self.assertEqual(ensure_running.call_count, 6)
+
+    def test_model_name(self):
+        self.assertEqual(model_name("qwen3"), "qwen3:latest")
+        self.assertEqual(model_name("hf.co/org/model:Q4"), "hf.co/org/model:Q4")
+
+
+class TestAsyncRouting(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cold = TestServer(create_app("cold"))
+        self.warm = TestServer(create_app("warm", loaded=["qwen3:8b"]))
+        await self.cold.start_server()
+        await self.warm.start_server()
+        # Nothing listens on the first one
+        servers = ["http://127.0.0.1:9"] + [
+            str(server.make_url('')).rstrip('/') for server in (self.cold, self.warm)
+        ]
+        self.patchers = [
+            patch.object(async_proxy, 'OLLAMA_SERVERS', servers),
+            patch.object(async_proxy, 'RETRY_DELAY', 0),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+        # Wait for the first probe of every backend
+        await self.client.get('/health')
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.cold.close()
+        await self.warm.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def test_routes_to_backend_with_model_loaded(self):
+        for _ in range(3):
+            response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+            frames = [json.loads(line) for line in (await response.read()).splitlines()]
+            self.assertTrue(frames[-1]["done"])
+        self.assertEqual(self.warm.app[STATE]["requests"], 3)
+        self.assertEqual(self.cold.app[STATE]["requests"], 0)
+
+    async def test_unreachable_backend_is_not_used(self):
+        health = await (await self.client.get('/health')).json()
+        self.assertEqual([b["status"] for b in health["backends"]], ["unhealthy", "healthy", "healthy"])
+        response = await self.client.post('/api/generate', json={"model": "llama3", "prompt": "hi"})
+        self.assertEqual(response.status, 200)
+        await response.read()
+        self.assertEqual(self.warm.app[STATE]["requests"] + self.cold.app[STATE]["requests"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
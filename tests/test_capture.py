@@ -0,0 +1,118 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.replay_capture import ReplayUpstream
+from capture import TrafficCapture, compact_frame
+from ndjson_stream import iter_frames
+from request_pipeline import NormalizedRequest
+from tests.helpers import chat_line
+import unthink_proxy
+
+
+class TestCompactFrame(unittest.TestCase):
+    def test_plain_frames_keep_only_their_text(self):
+        self.assertEqual(compact_frame(chat_line("<think>"), 'chat'), "<think>")
+        generate = b'{"model":"m","created_at":"x","response":"hi","done":false}\n'
+        self.assertEqual(compact_frame(generate, 'generate'), "hi")
+
+    def test_other_frames_are_kept_whole(self):
+        final = compact_frame(chat_line("", done=True, eval_count=3), 'chat')
+        self.assertEqual(final["eval_count"], 3)
+        tool = compact_frame(chat_line("", tool_calls=[{"function": {"name": "f"}}]), 'chat')
+        self.assertIn("tool_calls", tool)
+        self.assertEqual(compact_frame(b'not json\n', 'chat'), {"raw": "not json\n"})
+
+    @patch('json_backend.loads', json.loads)
+    def test_framer_views_with_stdlib_json(self):
+        reads = [chat_line("<think>") + chat_line("", done=True, eval_count=3)]
+        frames = [compact_frame(line, 'chat') for line in iter_frames(reads)]
+        self.assertEqual(frames[0], "<think>")
+        self.assertEqual(frames[1]["eval_count"], 3)
+
+
+class TestTrafficCapture(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, "capture.jsonl")
+
+    def request(self, path='chat'):
+        return NormalizedRequest(path, {"model": "m", "messages": []}, b'{}')
+
+    def test_sampling(self):
+        self.assertIsNone(TrafficCapture(self.path, 1.0, 1000, enabled=False).start(self.request(), 0, 0))
+        self.assertIsNone(TrafficCapture(self.path, 0.0, 1000, enabled=True).start(self.request(), 0, 0))
+        self.assertIsNone(TrafficCapture(self.path, 1.0, 1000, enabled=True).start(self.request('show'), 0, 0))
+        self.assertIsNotNone(TrafficCapture(self.path, 1.0, 1000, enabled=True).start(self.request(), 0, 0))
+
+    def test_size_is_bounded(self):
+        capture = TrafficCapture(self.path, 1.0, 200, enabled=True)
+        self.assertTrue(capture.write({"n": 1}))
+        self.assertFalse(capture.write({"padding": "x" * 300}))
+        os.remove(self.path)
+        # Capturing resumes once the file was moved away
+        self.assertTrue(capture.write({"n": 2}))
+        with open(self.path) as f:
+            self.assertEqual([json.loads(line) for line in f], [{"n": 2}])
+
+
+class TestFlaskCapture(unittest.TestCase):
+    @patch('unthink_proxy.get_session')
+    def test_stream_is_recorded(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            chat_line("<think>"), chat_line("plan"), chat_line("</think>\n\nHello"), chat_line(" world"),
+            chat_line("", done=True, eval_count=4),
+        ]
+        mock_session.return_value.post.return_value = upstream
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "capture.jsonl")
+            with patch.object(unthink_proxy, 'CAPTURE', TrafficCapture(path, 1.0, 10 ** 6, enabled=True)):
+                response = unthink_proxy.app.test_client().post(
+                    '/api/chat', json={"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+                )
+                response.get_data()
+                response.close()
+            with open(path) as f:
+                record = json.loads(f.readline())
+        self.assertEqual(record["path"], "chat")
+        self.assertEqual(record["request"]["messages"][0]["content"], "hi")
+        self.assertEqual(record["outcome"], "completed")
+        self.assertEqual(record["output"], "Hello world")
+        self.assertEqual([item for _, item in record["frames"][:4]], ["<think>", "plan", "</think>\n\nHello", " world"])
+        self.assertTrue(record["frames"][-1][1]["done"])
+
+
+class TestReplayUpstream(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_captured_frames(self):
+        records = [
+            {"ts": 1, "path": "chat", "request": {"model": "m", "messages": [{"role": "user", "content": "a"}]},
+             "frames": [[0, "<think>"], [1, "</think>A"], [2, {"model": "m", "done": True}]]},
+            {"ts": 2, "path": "chat", "request": {"model": "m", "messages": [{"role": "user", "content": "b"}]},
+             "frames": [[0, "B"], [1, {"model": "m", "done": True}]]},
+        ]
+        client = TestClient(TestServer(ReplayUpstream(records, speed=100).app()))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+
+        response = await client.post('/api/chat', json=records[1]["request"])
+        frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertEqual(frames[0]["message"]["content"], "B")
+        # A body that changed on the way falls back to the next capture of the model
+        response = await client.post('/api/chat', json={"model": "m", "messages": []})
+        frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertEqual([f.get("message", {}).get("content") for f in frames], ["<think>", "</think>A", None])
+        response = await client.post('/api/chat', json={"model": "m", "messages": []})
+        self.assertEqual(response.status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
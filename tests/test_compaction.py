@@ -0,0 +1,152 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compaction import MESSAGE_OVERHEAD, TRIM_MARKER, compact_history, context_budget
+from request_pipeline import NormalizedRequest
+from tests.helpers import chat
+from token_estimate import CharEstimator, TokenCounter, register_estimator
+import token_estimate
+import unthink_proxy
+
+
+class WordEstimator:
+    """One token per word, so the expected numbers are easy to read"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text.split())
+
+
+def words(n, word="w"):
+    return " ".join([word] * n)
+
+
+class TestTokenCounter(unittest.TestCase):
+    def test_cached_per_model(self):
+        estimator = WordEstimator()
+        register_estimator("words-test", lambda model: estimator)
+        counter = TokenCounter("words-test", cache_size=2)
+        self.assertEqual(counter.count("m", "a b c"), 3)
+        self.assertEqual(counter.count("m:latest", "a b c"), 3)
+        self.assertEqual(estimator.calls, 1)
+        counter.count("m", "d")
+        counter.count("m", "e")
+        # The oldest count was evicted
+        counter.count("m", "a b c")
+        self.assertEqual(estimator.calls, 4)
+
+    def test_char_estimate(self):
+        self.assertEqual(CharEstimator(4).count("12345"), 2)
+        self.assertEqual(CharEstimator(4).count(""), 0)
+        with patch.dict(token_estimate.MODEL_CHARS_PER_TOKEN, {"m:latest": 2.0}):
+            self.assertEqual(token_estimate.default_estimator("m:latest").count("1234"), 2)
+
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        register_estimator("words", lambda model: WordEstimator())
+        self.counter = TokenCounter("words")
+
+    def compact(self, request, keep_recent=2):
+        return compact_history(request, counter=self.counter, keep_recent=keep_recent)
+
+    def test_budget(self):
+        with patch('compaction.CONTEXT_BUDGET', 0):
+            self.assertIsNone(context_budget(chat([])))
+            self.assertEqual(context_budget(chat([], num_ctx=4096)), 4096 - 1024)
+            self.assertEqual(context_budget(chat([], num_ctx=4096, num_predict=100)), 3996)
+        with patch('compaction.CONTEXT_BUDGET', 2000):
+            self.assertEqual(context_budget(chat([])), 2000)
+            self.assertEqual(context_budget(chat([], num_ctx=2048)), 1024)
+        with patch('compaction._MODEL_BUDGETS', {"m:latest": 500}):
+            self.assertEqual(context_budget(chat([])), 500)
+
+    def test_fits(self):
+        request = chat([{"role": "user", "content": words(10)}])
+        with patch('compaction.CONTEXT_BUDGET', 100):
+            result = self.compact(request)
+        self.assertFalse(result.changed)
+        self.assertEqual(result.tokens, 10 + MESSAGE_OVERHEAD)
+        self.assertFalse(request.modified)
+
+    def test_drops_oldest_turns(self):
+        messages = [
+            {"role": "system", "content": words(10)},
+            {"role": "user", "content": words(50, "old")},
+            {"role": "assistant", "content": words(50, "old")},
+            {"role": "user", "content": words(20, "mid")},
+            {"role": "assistant", "content": words(20, "mid")},
+            {"role": "user", "content": words(5, "new")},
+            {"role": "assistant", "content": words(5, "new")},
+            {"role": "user", "content": words(5, "now")},
+        ]
+        request = chat(messages)
+        with patch('compaction.CONTEXT_BUDGET', 100):
+            result = self.compact(request)
+        kept = request.data["messages"]
+        # The system prompt and the last turns stay, the oldest turn goes as a whole
+        self.assertEqual([m["content"].split()[0] for m in kept], ["w", "mid", "mid", "new", "new", "now"])
+        self.assertEqual(result.dropped_messages, 2)
+        self.assertEqual(result.dropped_tokens, 2 * (50 + MESSAGE_OVERHEAD))
+        self.assertLessEqual(result.tokens, 100)
+        self.assertTrue(request.modified)
+        headers = result.headers()
+        self.assertEqual(headers['X-Context-Dropped-Messages'], "2")
+        self.assertEqual(headers['X-Context-Tokens'], f"{result.tokens}/100")
+
+    def test_recent_window_starts_at_a_user_message(self):
+        messages = [
+            {"role": "user", "content": words(50, "q1")},
+            {"role": "assistant", "content": words(50, "a1")},
+            {"role": "tool", "content": words(50, "t1")},
+            {"role": "assistant", "content": words(5, "a1b")},
+        ]
+        request = chat(messages)
+        with patch('compaction.CONTEXT_BUDGET', 30):
+            result = self.compact(request, keep_recent=2)
+        # Nothing could be dropped without orphaning the recent replies, so
+        # the oldest kept messages were shortened instead
+        self.assertEqual(result.dropped_messages, 0)
+        self.assertGreater(result.trimmed_messages, 0)
+        kept = request.data["messages"]
+        self.assertEqual(len(kept), 4)
+        self.assertTrue(kept[0]["content"].startswith(TRIM_MARKER))
+        self.assertLessEqual(result.tokens, 30)
+
+    def test_generate_untouched(self):
+        request = NormalizedRequest('generate', {"model": "m", "prompt": words(500)}, b'')
+        with patch('compaction.CONTEXT_BUDGET', 10):
+            self.assertIsNone(self.compact(request))
+
+
+class TestFlaskCompaction(unittest.TestCase):
+    @patch('unthink_proxy.get_session')
+    def test_headers(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            json.dumps({"message": {"role": "assistant", "content": "ok"}, "done": True}).encode('utf-8') + b'\n'
+        ]
+        mock_session.return_value.post.return_value = upstream
+        messages = [
+            {"role": "user", "content": "x" * 4000},
+            {"role": "assistant", "content": "y" * 4000},
+            {"role": "user", "content": "latest question"},
+        ]
+        with patch.object(unthink_proxy, 'COMPACTION_ENABLED', True), patch('compaction.CONTEXT_BUDGET', 500), \
+                patch('compaction.COMPACTION_KEEP_RECENT', 1):
+            response = unthink_proxy.app.test_client().post('/api/chat', json={"model": "m", "messages": messages})
+        self.assertEqual(response.headers['X-Context-Dropped-Messages'], "2")
+        sent = json.loads(mock_session.return_value.post.call_args.kwargs['data'])
+        self.assertEqual(sent["messages"], [{"role": "user", "content": "latest question"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
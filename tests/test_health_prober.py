@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+import tempfile
+
+import requests
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import health_prober
+from health_prober import HealthProber, probe
+import unthink_proxy
+
+
+def upstream_response(status, data=None):
+    response = MagicMock()
+    response.status_code = status
+    response.json.return_value = data or {}
+    return response
+
+
+class TestProbe(unittest.TestCase):
+    @patch('health_prober.get_session')
+    def test_healthy_reports_loaded_models(self, mock_session):
+        mock_session.return_value.get.side_effect = [
+            upstream_response(200),
+            upstream_response(200, {"models": [{"name": "qwen3:8b"}]}),
+        ]
+        state = probe("http://ollama:11434")
+        self.assertEqual(state["status"], "healthy")
+        self.assertEqual(state["loaded_models"], ["qwen3:8b"])
+        self.assertIsNotNone(state["latency_ms"])
+
+    @patch('health_prober.get_session')
+    def test_unreachable(self, mock_session):
+        mock_session.return_value.get.side_effect = requests.exceptions.ConnectionError("refused")
+        self.assertEqual(probe("http://ollama:11434")["status"], "unhealthy")
+
+
+class TestHealthProber(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.state_dir.cleanup)
+
+    def prober(self):
+        prober = HealthProber("http://ollama:11434", interval=10, state_dir=self.state_dir.name)
+        self.addCleanup(prober.stop)
+        return prober
+
+    @patch('health_prober.probe')
+    def test_one_prober_shares_state(self, mock_probe):
+        mock_probe.return_value = {"status": "healthy", "latency_ms": 3.0, "loaded_models": []}
+        leader, follower = self.prober(), self.prober()
+        leader.tick()
+        follower.tick()
+        self.assertEqual(mock_probe.call_count, 1)
+        self.assertEqual(follower.state, leader.state)
+
+        # The follower takes over once the leader gives up its lock
+        leader.stop()
+        follower.tick()
+        self.assertEqual(mock_probe.call_count, 2)
+
+    @patch('health_prober.probe')
+    def test_consecutive_failures(self, mock_probe):
+        prober = self.prober()
+        mock_probe.return_value = {"status": "unhealthy", "latency_ms": None, "message": "down"}
+        prober.tick()
+        prober.tick()
+        self.assertEqual(prober.state["consecutive_failures"], 2)
+        mock_probe.return_value = {"status": "healthy", "latency_ms": 1.0, "loaded_models": []}
+        prober.tick()
+        self.assertEqual(prober.state["consecutive_failures"], 0)
+
+    @patch('health_prober.probe')
+    def test_stale_state_is_unknown(self, mock_probe):
+        mock_probe.return_value = {"status": "healthy", "latency_ms": 1.0, "loaded_models": []}
+        prober = self.prober()
+        prober.tick()
+        prober.ensure_running = lambda: None
+        self.assertEqual(prober.snapshot()["status"], "healthy")
+        with patch('health_prober.time.time', return_value=prober.state["checked_at"] + 3600):
+            self.assertEqual(prober.snapshot()["status"], "unknown")
+
+
+class TestHealthEndpoint(unittest.TestCase):
+    def test_health_answers_from_snapshot(self):
+        client = unthink_proxy.app.test_client()
+        state = {"status": "unhealthy", "consecutive_failures": 4}
+        with patch.object(unthink_proxy.BACKENDS, 'health', return_value=state):
+            response = client.get('/health')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data)["consecutive_failures"], 4)
+        self.assertEqual(health_prober.health_status({"status": "healthy"}), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
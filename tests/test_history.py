@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import math
+import sys
+import os
+
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from history import strip_history
+from request_pipeline import NormalizedRequest
+from tests.helpers import chat
+import unthink_proxy
+
+OPEN, CLOSE = "<think>", "</think>"
+
+
+class TestStripHistory(unittest.TestCase):
+    def test_removes_thinking_from_earlier_turns(self):
+        thinking = "<think>" + "reasoning " * 40 + "</think>\n\n"
+        request = chat([
+            {"role": "system", "content": "<think>not an answer</think>"},
+            {"role": "user", "content": "q1"},
+            {"role": "assistant", "content": thinking + "a1"},
+            {"role": "user", "content": "q2"},
+            {"role": "assistant", "content": "plain a2"},
+            {"role": "user", "content": "q3"},
+        ])
+        before = REGISTRY.get_sample_value(
+            'unthink_proxy_history_thinking_bytes_removed_total', {'model': 'm:latest'}
+        ) or 0
+        removed_bytes, removed_tokens = strip_history(request, OPEN, CLOSE)
+        messages = request.data["messages"]
+        self.assertEqual(messages[2]["content"], "a1")
+        self.assertEqual(messages[4]["content"], "plain a2")
+        # Only assistant turns are touched
+        self.assertEqual(messages[0]["content"], "<think>not an answer</think>")
+        self.assertEqual(removed_bytes, len(thinking))
+        self.assertEqual(removed_tokens, math.ceil(len(thinking + "a1") / 4) - math.ceil(len("a1") / 4))
+        self.assertTrue(request.modified)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'unthink_proxy_history_thinking_bytes_removed_total', {'model': 'm:latest'}
+        ), before + len(thinking))
+
+    def test_keeps_trailing_assistant_prefix(self):
+        request = chat([
+            {"role": "user", "content": "q"},
+            {"role": "assistant", "content": "<think>partial</think>\n\n"},
+        ])
+        self.assertEqual(strip_history(request, OPEN, CLOSE), (0, 0))
+        self.assertFalse(request.modified)
+
+    def test_generate_untouched(self):
+        request = NormalizedRequest('generate', {"model": "m", "prompt": "<think>x</think>"}, b'')
+        self.assertEqual(strip_history(request, OPEN, CLOSE), (0, 0))
+
+
+class TestFlaskHistory(unittest.TestCase):
+    @patch('unthink_proxy.get_session')
+    def test_forwarded_body(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            json.dumps({"message": {"role": "assistant", "content": "ok"}, "done": True}).encode('utf-8') + b'\n'
+        ]
+        mock_session.return_value.post.return_value = upstream
+        messages = [
+            {"role": "user", "content": "q1"},
+            {"role": "assistant", "content": "<think>long</think>a1"},
+            {"role": "user", "content": "q2"},
+        ]
+        client = unthink_proxy.app.test_client()
+        # Off by default: the history is forwarded as the client sent it
+        client.post('/api/chat', json={"model": "m", "messages": messages})
+        sent = json.loads(mock_session.return_value.post.call_args.kwargs['data'])
+        self.assertEqual(sent["messages"][1]["content"], "<think>long</think>a1")
+        with patch.object(unthink_proxy, 'HISTORY_STRIP_ENABLED', True):
+            client.post('/api/chat', json={"model": "m", "messages": messages})
+        sent = json.loads(mock_session.return_value.post.call_args.kwargs['data'])
+        self.assertEqual(sent["messages"][1]["content"], "a1")
+
+
+if __name__ == "__main__":
+    unittest.main()
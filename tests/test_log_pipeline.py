@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import patch
+import io
+import json
+import logging
+import sys
+import os
+
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log_pipeline
+from log_pipeline import JSONFormatter, LogPipeline, RateLimitFilter, TextFormatter
+
+
+def dropped(reason):
+    return REGISTRY.get_sample_value('unthink_proxy_log_records_dropped_total', {'reason': reason}) or 0
+
+
+class TestLogPipeline(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.output = logging.StreamHandler(self.stream)
+        self.output.setFormatter(JSONFormatter())
+        self.logger = logging.getLogger(f"test-log-pipeline-{self.id()}")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_records(self):
+        pipeline = LogPipeline([self.output], rate_limit=0).install(self.logger)
+        self.logger.info("[123-4] Request completed in %.2fs", 1.5)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("Unexpected error")
+        pipeline.stop()
+
+        first, second = self.records()
+        self.assertEqual(first["request_id"], "123-4")
+        self.assertEqual(first["message"], "Request completed in 1.50s")
+        self.assertEqual(first["level"], "INFO")
+        self.assertNotIn("request_id", second)
+        self.assertIn("ValueError: boom", second["exc"])
+
+    def test_rate_limit_per_call_site(self):
+        pipeline = LogPipeline([self.output], rate_limit=5).install(self.logger)
+        before = dropped('rate_limited')
+        for i in range(20):
+            self.logger.info(f"noisy {i}")
+        self.logger.info("quiet")
+        pipeline.stop()
+
+        messages = [record["message"] for record in self.records()]
+        # The bucket starts full, so the first records of a burst go through
+        self.assertEqual(messages, [f"noisy {i}" for i in range(5)] + ["quiet"])
+        self.assertEqual(dropped('rate_limited'), before + 15)
+
+    def test_suppressed_count(self):
+        limiter = RateLimitFilter(rate=1)
+        record = logging.LogRecord("x", logging.INFO, "f.py", 1, "m", None, None)
+        self.assertTrue(limiter.filter(record))
+        self.assertFalse(limiter.filter(record))
+        self.assertFalse(limiter.filter(record))
+        with patch('log_pipeline.time.monotonic', return_value=1e12):
+            self.assertTrue(limiter.filter(record))
+        self.assertEqual(record.suppressed, 2)
+        self.assertIn("(2 similar messages suppressed)", TextFormatter('%(message)s').format(record))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        pipeline = LogPipeline([self.output], queue_size=2, rate_limit=0)
+        # Not started: nothing drains the queue
+        self.logger.addHandler(pipeline.handler)
+        before = dropped('queue_full')
+        for i in range(5):
+            self.logger.info(f"record {i}")
+        self.assertEqual(dropped('queue_full'), before + 3)
+        pipeline.start()
+        pipeline.stop()
+        self.assertEqual([record["message"] for record in self.records()], ["record 0", "record 1"])
+
+    def test_debug_sampling(self):
+        with patch.object(log_pipeline, 'DEBUG_MODE', False):
+            self.assertFalse(log_pipeline.debug_sampled())
+        with patch.object(log_pipeline, 'DEBUG_MODE', True), patch.object(log_pipeline, 'DEBUG_SAMPLE_RATE', 1.0):
+            self.assertTrue(log_pipeline.debug_sampled())
+        with patch.object(log_pipeline, 'DEBUG_MODE', True), patch.object(log_pipeline, 'DEBUG_SAMPLE_RATE', 0.0):
+            self.assertFalse(log_pipeline.debug_sampled())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metadata_cache import METADATA_CACHE, MetadataCache
+import unthink_proxy
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetadataCache({"api/tags": 30, "api/version": 0})
+
+    def test_only_configured_paths_are_cached(self):
+        self.assertEqual(self.cache.ttl_for("/api/tags"), 30)
+        self.assertIsNone(self.cache.ttl_for("api/version"))
+        self.assertIsNone(self.cache.ttl_for("api/show"))
+        self.assertIsNone(MetadataCache({"api/ps": 5}).ttl_for("api/ps"))
+
+    def test_entry_expires(self):
+        self.cache.put("api/tags", b'{"models":[]}', [])
+        self.assertIsNotNone(self.cache.get("api/tags"))
+        with patch('metadata_cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(self.cache.get("api/tags"))
+
+    def test_conditional_response(self):
+        entry = self.cache.put("api/tags", b'{"models":[]}', [('Content-Type', 'application/json')])
+        status, headers, body = entry.respond()
+        self.assertEqual((status, body), (200, b'{"models":[]}'))
+        self.assertIn(('ETag', entry.etag), headers)
+
+        status, _, body = entry.respond(f'W/"other", {entry.etag}')
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(entry.respond('"other"')[0], 200)
+
+    def test_invalidate(self):
+        self.cache.put("api/tags", b'{}', [])
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get("api/tags"))
+
+
+class TestCatchAllCache(unittest.TestCase):
+    def setUp(self):
+        METADATA_CACHE.clear()
+        patcher = patch.object(unthink_proxy, 'METADATA_CACHE_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = unthink_proxy.app.test_client()
+
+    def tearDown(self):
+        METADATA_CACHE.clear()
+
+    def upstream(self, body):
+        resp = MagicMock()
+        resp.status_code = 200
+        resp.content = body
+        resp.iter_content.return_value = [body]
+        resp.raw.headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+        return resp
+
+    @patch('unthink_proxy.get_session')
+    def test_tags_are_served_from_cache(self, mock_session):
+        mock_session.return_value.request.return_value = self.upstream(b'{"models":[]}')
+
+        first = self.client.get('/api/tags')
+        second = self.client.get('/api/tags')
+        self.assertEqual(second.data, b'{"models":[]}')
+        self.assertEqual(mock_session.return_value.request.call_count, 1)
+
+        etag = first.headers['ETag']
+        self.assertEqual(second.headers['ETag'], etag)
+        conditional = self.client.get('/api/tags', headers={'If-None-Match': etag})
+        self.assertEqual(conditional.status_code, 304)
+
+    @patch('unthink_proxy.get_session')
+    def test_model_management_invalidates(self, mock_session):
+        mock_session.return_value.request.return_value = self.upstream(b'{"models":[]}')
+        self.client.get('/api/tags')
+
+        mock_session.return_value.request.return_value = self.upstream(b'{"status":"success"}')
+        response = self.client.post('/api/pull', json={"model": "m"})
+        self.assertEqual(response.data, b'{"status":"success"}')
+        self.assertEqual(mock_session.return_value.request.call_args.kwargs['method'], 'POST')
+
+        self.client.get('/api/tags')
+        self.assertEqual(mock_session.return_value.request.call_count, 3)
+
+    @patch('unthink_proxy.get_session')
+    def test_uncached_paths_are_streamed(self, mock_session):
+        mock_session.return_value.request.return_value = self.upstream(b'hello')
+        self.client.get('/')
+        self.client.get('/')
+        self.assertEqual(mock_session.return_value.request.call_count, 2)
+        self.assertTrue(mock_session.return_value.request.call_args.kwargs['stream'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import subprocess
+import sys
+import os
+import tempfile
+import textwrap
+
+# Add parent directory to path to import the main module
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from metrics import endpoint_label
+
+
+def run(code, multiproc_dir):
+    """Run ``code`` in a fresh interpreter using the multiprocess metrics directory"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=multiproc_dir, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, '-c', textwrap.dedent(code)], env=env, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+
+class TestEndpointLabel(unittest.TestCase):
+    def test_known_endpoints_keep_their_path(self):
+        self.assertEqual(endpoint_label('/api/chat'), '/api/chat')
+        self.assertEqual(endpoint_label('/health'), '/health')
+
+    def test_other_paths_use_the_route_template(self):
+        self.assertEqual(endpoint_label('/api/chat/../../etc'), '/api/<path>')
+        self.assertEqual(endpoint_label('/api/random-1234'), '/api/<path>')
+        self.assertEqual(endpoint_label('/favicon.ico'), '/<path>')
+
+
+class TestMultiprocess(unittest.TestCase):
+    def test_workers_are_aggregated(self):
+        with tempfile.TemporaryDirectory() as multiproc_dir:
+            worker = '''
+                from metrics import ACTIVE_REQUESTS, REQUEST_COUNT, REQUEST_LATENCY
+                REQUEST_COUNT.labels(method='POST', endpoint='/api/chat', status=200).inc(3)
+                REQUEST_LATENCY.labels(method='POST', endpoint='/api/chat').observe(0.5)
+                ACTIVE_REQUESTS.inc()
+            '''
+            run(worker, multiproc_dir)
+            run(worker, multiproc_dir)
+            output = run('''
+                from metrics import get_metrics
+                print(get_metrics().decode())
+            ''', multiproc_dir)
+        self.assertIn(
+            'unthink_proxy_requests_total{endpoint="/api/chat",method="POST",status="200"} 6.0', output
+        )
+        self.assertIn(
+            'unthink_proxy_request_duration_seconds_count{endpoint="/api/chat",method="POST"} 2.0', output
+        )
+
+    def test_dead_workers_drop_live_gauges(self):
+        with tempfile.TemporaryDirectory() as multiproc_dir:
+            output = run('''
+                import os
+                from prometheus_client import multiprocess
+                from metrics import ACTIVE_REQUESTS, REQUEST_COUNT, get_metrics
+                ACTIVE_REQUESTS.inc(2)
+                REQUEST_COUNT.labels(method='GET', endpoint='/health', status=200).inc()
+                print(get_metrics().decode())
+                print('---')
+                multiprocess.mark_process_dead(os.getpid())
+                print(get_metrics().decode())
+            ''', multiproc_dir)
+        before, after = output.split('---\n')
+        self.assertIn('unthink_proxy_active_requests 2.0', before)
+        self.assertNotIn('unthink_proxy_active_requests 2.0', after)
+        # Counters of exited workers still count
+        self.assertIn('unthink_proxy_requests_total{endpoint="/health",method="GET",status="200"} 1.0', after)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+
+import requests
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import STATE, create_app
+from model_capabilities import CapabilityRegistry, detect_switch, suppress_thinking
+from request_pipeline import NormalizedRequest
+import async_proxy
+import unthink_proxy
+
+
+def suppressed(model, method):
+    return REGISTRY.get_sample_value(
+        'unthink_proxy_thinking_suppression_total', {'model': model, 'method': method}
+    ) or 0
+
+
+class TestDetection(unittest.TestCase):
+    def test_detect_switch(self):
+        self.assertEqual(detect_switch({"capabilities": ["completion", "thinking"]}), 'think_param')
+        self.assertEqual(detect_switch({"capabilities": ["completion"], "details": {"family": "qwen3"}}),
+                         'system_prompt')
+        self.assertEqual(detect_switch({"details": {"family": "llama", "families": ["llama"]}}), 'none')
+        self.assertEqual(detect_switch(None), 'none')
+
+    def test_registry_caches_and_falls_back(self):
+        registry = CapabilityRegistry(ttl=60, retry_after=60, overrides={"manual": "none"})
+        fetch = MagicMock(return_value={"capabilities": ["thinking"]})
+        self.assertEqual(registry.switch_for("qwen3", fetch), 'think_param')
+        self.assertEqual(registry.switch_for("qwen3:latest", fetch), 'think_param')
+        fetch.assert_called_once_with("qwen3")
+        # Manual entries are never fetched
+        self.assertEqual(registry.switch_for("manual", fetch), 'none')
+        self.assertEqual(fetch.call_count, 1)
+
+        failing = MagicMock(side_effect=requests.exceptions.ConnectionError("refused"))
+        self.assertEqual(registry.switch_for("other", failing), 'none')
+        self.assertEqual(registry.switch_for("other", failing), 'none')
+        failing.assert_called_once()
+
+        registry.invalidate()
+        registry.switch_for("qwen3", fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+
+class TestSuppression(unittest.TestCase):
+    def test_think_param(self):
+        request = NormalizedRequest('chat', {"model": "m", "messages": []}, b'')
+        before = suppressed("m:latest", "think_param")
+        self.assertEqual(suppress_thinking(request, 'think_param'), 'think_param')
+        self.assertIs(request.data["think"], False)
+        self.assertTrue(request.modified)
+        self.assertEqual(suppressed("m:latest", "think_param"), before + 1)
+
+    def test_client_choice_wins(self):
+        request = NormalizedRequest('chat', {"model": "m", "messages": [], "think": True}, b'')
+        self.assertEqual(suppress_thinking(request, 'think_param'), 'none')
+        self.assertIs(request.data["think"], True)
+        self.assertFalse(request.modified)
+
+    def test_system_prompt(self):
+        request = NormalizedRequest('chat', {"model": "m", "messages": [
+            {"role": "system", "content": "Be brief."}, {"role": "user", "content": "hi"}
+        ]}, b'')
+        suppress_thinking(request, 'system_prompt', prompt="/no_think")
+        self.assertEqual(request.data["messages"][0]["content"], "Be brief.\n/no_think")
+
+        request = NormalizedRequest('chat', {"model": "m", "messages": [{"role": "user", "content": "hi"}]}, b'')
+        suppress_thinking(request, 'system_prompt', prompt="/no_think")
+        self.assertEqual(request.data["messages"][0], {"role": "system", "content": "/no_think"})
+
+        request = NormalizedRequest('generate', {"model": "m", "prompt": "hi"}, b'')
+        suppress_thinking(request, 'system_prompt', prompt="/no_think")
+        self.assertEqual(request.data["system"], "/no_think")
+
+
+class TestFlaskSuppression(unittest.TestCase):
+    @patch('unthink_proxy.get_session')
+    def test_rewrites_request(self, mock_session):
+        show = MagicMock()
+        show.json.return_value = {"capabilities": ["completion", "thinking"]}
+        stream = MagicMock()
+        stream.iter_content.return_value = [
+            json.dumps({"message": {"role": "assistant", "content": "hi"}, "done": True}).encode('utf-8') + b'\n'
+        ]
+        mock_session.return_value.post.side_effect = [show, stream]
+        with patch.object(unthink_proxy, 'THINKING_SUPPRESSION_ENABLED', True), \
+                patch.object(unthink_proxy, 'CAPABILITIES', CapabilityRegistry(overrides={})):
+            response = unthink_proxy.app.test_client().post('/api/chat', json={"model": "m", "messages": []})
+        self.assertEqual(json.loads(response.data)["message"]["content"], "hi")
+        show_call, chat_call = mock_session.return_value.post.call_args_list
+        self.assertTrue(show_call.args[0].endswith('/api/show'))
+        self.assertIs(json.loads(chat_call.kwargs['data'])["think"], False)
+
+
+class TestAsyncSuppression(unittest.IsolatedAsyncioTestCase):
+    async def start(self, **fake):
+        self.upstream = TestServer(create_app(think_tokens=8, answer_tokens=2, **fake))
+        await self.upstream.start_server()
+        self.patchers = [
+            patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/')),
+            patch.object(async_proxy, 'THINKING_SUPPRESSION_ENABLED', True),
+            patch.object(async_proxy, 'CAPABILITIES', CapabilityRegistry(overrides={})),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def chat(self):
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+        return "".join(json.loads(line)["message"]["content"] for line in (await response.read()).splitlines())
+
+    async def test_think_param(self):
+        await self.start(capabilities=("completion", "thinking"))
+        before = suppressed("qwen3:8b", "think_param")
+        self.assertEqual(await self.chat(), " word0 word1")
+        self.assertEqual(await self.chat(), " word0 word1")
+        # Detected once, then served from the registry
+        self.assertEqual(self.upstream.app[STATE]["shows"], 1)
+        self.assertEqual(suppressed("qwen3:8b", "think_param"), before + 2)
+
+    async def test_stripper_fallback(self):
+        await self.start(family="llama")
+        before = suppressed("qwen3:8b", "none")
+        self.assertEqual(await self.chat(), "word0 word1")
+        self.assertEqual(suppressed("qwen3:8b", "none"), before + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
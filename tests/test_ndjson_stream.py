@@ -0,0 +1,107 @@
+import unittest
+import json
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ndjson_stream import ChatStreamProcessor, NDJSONFramer, iter_frames
+
+
+ANSWER_TEXT = "<think>Let me weigh a < b and \"quotes\"\\ here</think>\n\nThe answer: 1 < 2, é ✓."
+
+
+def go_style_frame(content, done=False):
+    """Encode a chat frame the way Ollama does, escaping HTML characters"""
+    frame = {"model": "m", "created_at": "t", "message": {"role": "assistant", "content": content}, "done": done}
+    line = json.dumps(frame, separators=(',', ':'))
+    return line.replace('<', '\\u003c').replace('>', '\\u003e').encode('utf-8')
+
+
+def run(frames, fast_path):
+    processor = ChatStreamProcessor("<think>", "</think>", fast_path=fast_path)
+    output = [processor.process_line(frame) for frame in frames]
+    return [json.loads(line) for line in b''.join(output).splitlines()], processor
+
+
+def content(frames):
+    return "".join(frame["message"]["content"] for frame in frames)
+
+
+class TestChatStreamProcessor(unittest.TestCase):
+    def test_fast_path_matches_full_decode(self):
+        for size in range(1, 12):
+            pieces = [ANSWER_TEXT[i:i + size] for i in range(0, len(ANSWER_TEXT), size)]
+            frames = [go_style_frame(piece) for piece in pieces] + [go_style_frame("", done=True)]
+            with self.subTest(size=size):
+                slow, _ = run(frames, fast_path=False)
+                fast, processor = run(frames, fast_path=True)
+                self.assertEqual(content(fast), content(slow))
+                self.assertEqual(content(fast), "The answer: 1 < 2, é ✓.")
+                self.assertTrue(fast[-1]["done"])
+                self.assertGreater(processor.passthrough_count + processor.patched_count, 0)
+
+    def test_close_tag_of_prefilled_block_is_dropped(self):
+        frames = [go_style_frame(piece) for piece in ["plan", "</think>", "\n\n", "Answer"]]
+        for fast_path in (False, True):
+            with self.subTest(fast_path=fast_path):
+                output, _ = run(frames + [go_style_frame("", done=True)], fast_path)
+                self.assertEqual(content(output), "planAnswer")
+
+    def test_plain_frames_are_forwarded_byte_for_byte(self):
+        processor = ChatStreamProcessor("<think>", "</think>")
+        frame = go_style_frame("plain text")
+        self.assertEqual(processor.process_line(frame), frame + b'\n')
+        self.assertEqual(processor.passthrough_count, 1)
+
+    def test_only_content_is_patched(self):
+        processor = ChatStreamProcessor("<think>", "</think>")
+        frame = go_style_frame("Hi <think>x")
+        output = processor.process_line(frame)
+        self.assertEqual(processor.patched_count, 1)
+        self.assertTrue(output.startswith(b'{"model":"m","created_at":"t","message":{"role":"assistant","content":"Hi "}'))
+
+    def test_tool_call_frames_are_kept(self):
+        processor = ChatStreamProcessor("<think>", "</think>")
+        processor.process_line(go_style_frame("<think>plan"))
+        frame = json.dumps({
+            "message": {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": "f"}}]},
+            "done": False
+        }).encode('utf-8')
+        self.assertEqual(processor.process_line(frame), frame + b'\n')
+
+    def test_pending_text_is_flushed_into_done_frame(self):
+        frames = [go_style_frame("1 <"), go_style_frame("", done=True)]
+        output, _ = run(frames, fast_path=True)
+        self.assertEqual(content(output), "1 <")
+
+
+    def test_terminated_lines_pass_through_without_copy(self):
+        processor = ChatStreamProcessor("<think>", "</think>")
+        line = go_style_frame("plain") + b'\n'
+        self.assertIs(processor.process_line(line), line)
+        self.assertEqual(processor.process_line(memoryview(line)), line)
+
+
+class TestNDJSONFramer(unittest.TestCase):
+    PAYLOAD = b'{"a":1}\n{"b":"two"}\n\n{"c":[3]}\n{"tail":true}'
+
+    def test_every_split_offset(self):
+        expected = [b'{"a":1}\n', b'{"b":"two"}\n', b'\n', b'{"c":[3]}\n', b'{"tail":true}']
+        for offset in range(len(self.PAYLOAD) + 1):
+            with self.subTest(offset=offset):
+                reads = [self.PAYLOAD[:offset], self.PAYLOAD[offset:]]
+                self.assertEqual([bytes(line) for line in iter_frames(reads)], expected)
+
+    def test_byte_by_byte(self):
+        reads = [self.PAYLOAD[i:i + 1] for i in range(len(self.PAYLOAD))]
+        self.assertEqual(b''.join(bytes(line) for line in iter_frames(reads)), self.PAYLOAD)
+
+    def test_complete_lines_are_views_of_the_read(self):
+        data = b'{"a":1}\n{"b":2}\n'
+        lines = list(NDJSONFramer().feed(data))
+        self.assertTrue(all(isinstance(line, memoryview) and line.obj is data for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
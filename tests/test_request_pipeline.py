@@ -0,0 +1,49 @@
+import unittest
+import json
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from request_pipeline import RequestError, normalize_request
+
+
+class TestNormalizeRequest(unittest.TestCase):
+    def test_untouched_request_forwards_original_bytes(self):
+        raw = b'{"model": "m", "messages": [{"role": "user", "content": "hi"}]}'
+        request = normalize_request('chat', raw)
+        self.assertFalse(request.modified)
+        self.assertIs(request.body(), raw)
+        self.assertEqual(request.model, "m")
+        self.assertTrue(request.stream)
+
+    def test_single_quotes_are_repaired(self):
+        request = normalize_request('chat', b"{'model': 'm', 'stream': false}")
+        self.assertTrue(request.modified)
+        self.assertEqual(json.loads(request.body()), {"model": "m", "stream": False})
+        self.assertFalse(request.stream)
+
+    def test_litellm_generate_becomes_chat(self):
+        raw = json.dumps({"model": "m", "prompt": "hi", "options": {"temperature": 0}}).encode('utf-8')
+        request = normalize_request('generate', raw, is_litellm=True)
+        self.assertEqual(request.path, 'chat')
+        body = json.loads(request.body())
+        self.assertEqual(body["messages"], [{"role": "user", "content": "hi"}])
+        self.assertEqual(body["temperature"], 0)
+
+    def test_generate_from_other_clients_is_untouched(self):
+        raw = b'{"model": "m", "prompt": "hi"}'
+        request = normalize_request('generate', raw)
+        self.assertEqual(request.path, 'generate')
+        self.assertIs(request.body(), raw)
+
+    def test_invalid_bodies(self):
+        for raw in (b'', b'{not json', b'[1, 2]'):
+            with self.subTest(raw=raw):
+                with self.assertRaises(RequestError) as ctx:
+                    normalize_request('chat', raw)
+                self.assertEqual(ctx.exception.status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import asyncio
+import json
+import sys
+import os
+
+import aiohttp
+import requests
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend_pool import BackendPool
+from resilience import CircuitBreaker, RetryBudget, RetryPolicy, error_status, is_retryable
+from tests.helpers import StaticProber
+import unthink_proxy
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+class TestClassification(unittest.TestCase):
+    def test_requests_errors(self):
+        self.assertTrue(is_retryable(requests.exceptions.ConnectionError()))
+        self.assertTrue(is_retryable(requests.exceptions.ConnectTimeout()))
+        self.assertFalse(is_retryable(requests.exceptions.ReadTimeout()))
+        self.assertTrue(is_retryable(http_error(503)))
+        self.assertFalse(is_retryable(http_error(500)))
+        self.assertFalse(is_retryable(http_error(404)))
+
+    def test_aiohttp_errors(self):
+        self.assertTrue(is_retryable(aiohttp.ServerDisconnectedError()))
+        self.assertFalse(is_retryable(asyncio.TimeoutError()))
+        self.assertFalse(is_retryable(aiohttp.SocketTimeoutError()))
+        self.assertTrue(is_retryable(aiohttp.ClientResponseError(None, (), status=502)))
+
+    def test_error_status(self):
+        self.assertEqual(error_status(http_error(404)), 404)
+        self.assertEqual(error_status(http_error(500)), 503)
+        self.assertEqual(error_status(requests.exceptions.ReadTimeout()), 503)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_budget_limits_retries(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_backoff(self):
+        policy = RetryPolicy(3, base_delay=1, max_delay=3, budget=RetryBudget(capacity=10))
+        error = requests.exceptions.ConnectionError()
+        for attempt in (1, 2):
+            delay = policy.next_delay(error, attempt)
+            self.assertTrue(0 <= delay <= min(3, 2 ** (attempt - 1)))
+        self.assertIsNone(policy.next_delay(error, 3))
+        self.assertIsNone(policy.next_delay(requests.exceptions.ReadTimeout(), 1))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_half_open_closed(self):
+        breaker = CircuitBreaker("http://a", failure_threshold=2, reset_timeout=30)
+        breaker.failure()
+        self.assertTrue(breaker.available())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.available())
+
+        with patch('resilience.time.monotonic', return_value=breaker.opened_at + 31):
+            self.assertTrue(breaker.available())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            breaker.attempt()
+            # Only one trial request at a time
+            self.assertFalse(breaker.available())
+            breaker.failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        with patch('resilience.time.monotonic', return_value=breaker.opened_at + 31):
+            self.assertTrue(breaker.available())
+            breaker.attempt()
+            breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestProxyRetries(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+        self.pool = BackendPool(["http://a", "http://b"], prober_factory=StaticProber)
+        patchers = [
+            patch.object(unthink_proxy, 'BACKENDS', self.pool),
+            patch.object(unthink_proxy, 'RETRY_POLICY', RetryPolicy(3, 0.01)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        session_patcher = patch('unthink_proxy.get_session')
+        self.post = session_patcher.start().return_value.post
+        self.addCleanup(session_patcher.stop)
+        sleep_patcher = patch('unthink_proxy.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def chat(self):
+        return self.client.post('/api/chat', json={"model": "m", "messages": []})
+
+    def test_read_timeout_is_not_retried(self):
+        self.post.side_effect = requests.exceptions.ReadTimeout("slow")
+        self.assertEqual(self.chat().status_code, 503)
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_connection_error_fails_over_then_fails_fast(self):
+        self.post.side_effect = requests.exceptions.ConnectionError("refused")
+        response = self.chat()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        # Both backends are tried, then the backoff is left to the client
+        urls = [call.args[0] for call in self.post.call_args_list]
+        self.assertEqual(len(set(urls)), 2)
+        self.assertEqual(self.post.call_count, 2)
+        self.sleep.assert_not_called()
+
+    def test_client_errors_keep_their_status(self):
+        response = MagicMock()
+        response.raise_for_status.side_effect = http_error(404)
+        self.post.return_value = response
+        self.assertEqual(self.chat().status_code, 404)
+        # The error response is closed, not left holding a pooled connection
+        response.close.assert_called_once_with()
+
+    def test_show_model_closes_error_response(self):
+        response = MagicMock()
+        response.raise_for_status.side_effect = http_error(404)
+        self.post.return_value = response
+        with self.assertRaises(requests.exceptions.HTTPError):
+            unthink_proxy.show_model("m")
+        response.__exit__.assert_called_once()
+
+    def test_open_circuits_fail_fast(self):
+        for backend in self.pool.backends:
+            for _ in range(backend.breaker.failure_threshold):
+                backend.breaker.failure()
+        response = self.chat()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertIn("error", json.loads(response.data))
+        self.post.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
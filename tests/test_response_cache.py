@@ -0,0 +1,126 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import json
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import unthink_proxy
+from request_pipeline import normalize_request
+from response_cache import CachedResponse, ResponseCache, is_cacheable, request_key
+
+
+def chat_request(**fields):
+    data = {"model": "m", "messages": [{"role": "user", "content": "hi"}], **fields}
+    return normalize_request('chat', json.dumps(data).encode('utf-8'))
+
+
+def entry(content="answer", path='chat'):
+    final = {"model": "m", "created_at": "t", "message": {"role": "assistant", "content": ""},
+             "done": True, "eval_count": 3}
+    return CachedResponse(path, content, final)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_only_deterministic_requests_are_cacheable(self):
+        self.assertTrue(is_cacheable(chat_request(options={"temperature": 0})))
+        self.assertTrue(is_cacheable(chat_request(options={"seed": 42, "temperature": 0.8})))
+        self.assertFalse(is_cacheable(chat_request(options={"temperature": 0.7})))
+        self.assertFalse(is_cacheable(chat_request()))
+        # Ollama samples at its default temperature when it is not in options
+        self.assertFalse(is_cacheable(chat_request(temperature=0)))
+        self.assertFalse(is_cacheable(chat_request(temperature=0, options={"top_k": 1})))
+
+    def test_key_ignores_field_order_and_stream(self):
+        first = normalize_request('chat', b'{"model":"m","options":{"seed":1,"top_k":5},"stream":true}')
+        second = normalize_request('chat', b'{"options":{"top_k":5,"seed":1},"model":"m","stream":false}')
+        self.assertEqual(request_key(first), request_key(second))
+        self.assertNotEqual(request_key(first), request_key(chat_request(options={"seed": 1})))
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        size = entry().size
+        cache = ResponseCache(max_bytes=size * 2, ttl=60)
+        cache.put('a', entry())
+        cache.put('b', entry())
+        cache.get('a')
+        cache.put('c', entry())
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_expired_entries_are_dropped(self):
+        cache = ResponseCache(max_bytes=1 << 20, ttl=0)
+        cache.put('a', entry())
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_replay_forms(self):
+        stream = [json.loads(line) for line in entry().replay(stream=True)]
+        self.assertEqual(stream[0]["message"]["content"], "answer")
+        self.assertFalse(stream[0]["done"])
+        self.assertEqual(stream[1]["message"]["content"], "")
+        self.assertEqual(stream[1]["eval_count"], 3)
+        single = [json.loads(line) for line in entry().replay(stream=False)]
+        self.assertEqual(len(single), 1)
+        self.assertEqual(single[0]["message"]["content"], "answer")
+        self.assertTrue(single[0]["done"])
+        generate = json.loads(entry(path='generate').replay(stream=False)[0])
+        self.assertEqual(generate["response"], "answer")
+
+
+class TestProxyCache(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+        unthink_proxy.RESPONSE_CACHE.clear()
+
+    @patch('unthink_proxy.RESPONSE_CACHE_ENABLED', True)
+    @patch('unthink_proxy.get_session')
+    def test_second_identical_request_is_served_from_cache(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            b'{"model":"m","message":{"role":"assistant","content":"<think>plan</think>Hi"},"done":false}\n',
+            b'{"model":"m","message":{"role":"assistant","content":""},"done":true,"eval_count":2}\n',
+        ]
+        mock_session.return_value.post.return_value = upstream
+        body = {"model": "m", "messages": [], "options": {"temperature": 0}}
+
+        first = self.client.post('/api/chat', json=body)
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        first.get_data()
+
+        second = self.client.post('/api/chat', json={**body, "stream": False})
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(second.data)["message"]["content"], "Hi")
+        self.assertEqual(mock_session.return_value.post.call_count, 1)
+
+    @patch('unthink_proxy.RESPONSE_CACHE_ENABLED', True)
+    @patch('unthink_proxy.get_session')
+    def test_tool_call_responses_are_not_cached(self, mock_session):
+        tool_call = {"function": {"name": "get_weather", "arguments": {"city": "Paris"}}}
+        frames = [
+            b'{"model":"m","message":{"role":"assistant","content":"<think>plan</think>"},"done":false}\n',
+            json.dumps({"model": "m", "message": {"role": "assistant", "content": "", "tool_calls": [tool_call]},
+                        "done": False}).encode('utf-8') + b'\n',
+            b'{"model":"m","message":{"role":"assistant","content":""},"done":true,"eval_count":2}\n',
+        ]
+        upstream = MagicMock()
+        upstream.iter_content.side_effect = lambda *args, **kwargs: iter(frames)
+        mock_session.return_value.post.return_value = upstream
+        body = {"model": "m", "messages": [], "options": {"temperature": 0}}
+
+        for _ in range(2):
+            response = self.client.post('/api/chat', json=body)
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            replies = [json.loads(line) for line in response.get_data().splitlines()]
+            self.assertEqual(
+                [reply["message"].get("tool_calls") for reply in replies if "tool_calls" in reply["message"]],
+                [[tool_call]]
+            )
+        self.assertEqual(mock_session.return_value.post.call_count, 2)
+        self.assertEqual(len(unthink_proxy.RESPONSE_CACHE), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
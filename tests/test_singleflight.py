@@ -0,0 +1,192 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import json
+import sys
+import os
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import async_proxy
+from request_pipeline import NormalizedRequest
+from singleflight import AsyncFlight, Flight, SingleFlightGroup, flight_key
+from think_stripper import TagProfile
+from thinking_budget import ThinkingBudget
+
+
+def gated_frames(count, gate):
+    """Producer that waits for the test before emitting each frame"""
+    for i in range(count):
+        gate.acquire()
+        yield f"frame{i}\n".encode('utf-8')
+
+
+class TestFlight(unittest.TestCase):
+    def setUp(self):
+        self.group = SingleFlightGroup(Flight)
+
+    def test_late_subscriber_catches_up(self):
+        flight, leader = self.group.join('k')
+        self.assertTrue(leader)
+        gate = threading.Semaphore(0)
+        producer = threading.Thread(target=flight.run, args=(gated_frames(4, gate),))
+        producer.start()
+
+        first = flight.subscribe()
+        gate.release()
+        self.assertEqual(next(first), b"frame0\n")
+
+        follower, leader = self.group.join('k')
+        self.assertIs(follower, flight)
+        self.assertFalse(leader)
+        second = follower.subscribe()
+        self.assertEqual(next(second), b"frame0\n")
+
+        for _ in range(3):
+            gate.release()
+        producer.join(5)
+        self.assertEqual(list(first), [b"frame1\n", b"frame2\n", b"frame3\n"])
+        self.assertEqual(list(second), [b"frame1\n", b"frame2\n", b"frame3\n"])
+        self.assertEqual(len(self.group), 0)
+
+    def test_early_disconnect_does_not_affect_others(self):
+        flight, _ = self.group.join('k')
+        gate = threading.Semaphore(0)
+        producer = threading.Thread(target=flight.run, args=(gated_frames(3, gate),))
+        producer.start()
+        quitter = flight.subscribe()
+        stayer = flight.subscribe()
+        gate.release()
+        self.assertEqual(next(quitter), b"frame0\n")
+        self.assertEqual(next(stayer), b"frame0\n")
+        quitter.close()
+
+        gate.release()
+        gate.release()
+        producer.join(5)
+        self.assertEqual(list(stayer), [b"frame1\n", b"frame2\n"])
+        self.assertFalse(flight.abandoned)
+
+    def test_producer_stops_when_everyone_leaves(self):
+        flight, _ = self.group.join('k')
+        gate = threading.Semaphore(0)
+        frames = gated_frames(100, gate)
+        producer = threading.Thread(target=flight.run, args=(frames,))
+        producer.start()
+        subscriber = flight.subscribe()
+        gate.release()
+        next(subscriber)
+        subscriber.close()
+        self.assertTrue(flight.abandoned)
+
+        gate.release()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertLess(len(flight.frames), 100)
+        # A new identical request starts a fresh flight
+        self.assertTrue(self.group.join('k')[1])
+
+    def test_response_closed_before_iteration_abandons(self):
+        flight, _ = self.group.join('k')
+        gate = threading.Semaphore(0)
+        producer = threading.Thread(target=flight.run, args=(gated_frames(100, gate),))
+        producer.start()
+        # The WSGI server closes the body without ever iterating it
+        flight.subscribe().close()
+        self.assertTrue(flight.abandoned)
+        gate.release()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+
+
+class TestFlightKey(unittest.TestCase):
+    def request(self, **extra):
+        data = {"model": "m", "messages": [{"role": "user", "content": "hi"}], **extra}
+        return NormalizedRequest('chat', data, b'')
+
+    def test_key_covers_output_handling(self):
+        base = flight_key(self.request())
+        self.assertEqual(base, flight_key(self.request(keep_alive="5m")))
+        self.assertEqual(base, flight_key(self.request(), ThinkingBudget(0, 0)))
+        self.assertNotEqual(base, flight_key(self.request(think=False)))
+        self.assertNotEqual(base, flight_key(self.request(stream=False)))
+        self.assertNotEqual(base, flight_key(self.request(), ThinkingBudget(100, 0)))
+        self.assertNotEqual(
+            flight_key(self.request(), ThinkingBudget(100, 0, 'reissue')),
+            flight_key(self.request(), ThinkingBudget(100, 0, 'error'))
+        )
+        self.assertNotEqual(base, flight_key(self.request(), profile=TagProfile([("<r>", "</r>")], "r")))
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.upstream_calls = 0
+        self.release = asyncio.Event()
+
+        async def fake_chat(request):
+            self.upstream_calls += 1
+            response = web.StreamResponse()
+            await response.prepare(request)
+            for content in ["<think>x</think>", "Hello", " world"]:
+                frame = {"message": {"role": "assistant", "content": content}, "done": False}
+                await response.write(json.dumps(frame).encode('utf-8') + b'\n')
+                await self.release.wait()
+            await response.write(b'{"message":{"role":"assistant","content":""},"done":true}\n')
+            await response.write_eof()
+            return response
+
+        upstream = web.Application()
+        upstream.router.add_post('/api/chat', fake_chat)
+        self.upstream = TestServer(upstream)
+        await self.upstream.start_server()
+        self.patchers = [
+            patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/')),
+            patch.object(async_proxy, 'SINGLE_FLIGHT_ENABLED', True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def test_identical_requests_share_one_generation(self):
+        body = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+
+        async def fetch():
+            response = await self.client.post('/api/chat', json=body)
+            return [json.loads(line) for line in (await response.read()).splitlines()]
+
+        first = asyncio.ensure_future(fetch())
+        while self.upstream_calls == 0:
+            await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(fetch())
+        await asyncio.sleep(0.05)
+        self.release.set()
+
+        for frames in await asyncio.gather(first, second):
+            self.assertEqual("".join(f["message"]["content"] for f in frames), "Hello world")
+            self.assertTrue(frames[-1]["done"])
+        self.assertEqual(self.upstream_calls, 1)
+
+    async def test_async_flight_catch_up(self):
+        group = SingleFlightGroup(AsyncFlight)
+        flight, _ = group.join('k')
+        flight.publish(b"a")
+        subscriber = flight.subscribe()
+        self.assertEqual(await subscriber.__anext__(), b"a")
+        flight.publish(b"b")
+        flight.finish()
+        self.assertEqual([frame async for frame in subscriber], [b"b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
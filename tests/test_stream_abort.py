@@ -0,0 +1,129 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import asyncio
+import functools
+import json
+import socket
+import sys
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import STATE, create_app
+from stream_abort import DisconnectWatch, OutputLengths, record_abort, socket_closed
+from tests.helpers import ndjson_lines
+from timeouts import PhaseTimeouts
+import async_proxy
+import unthink_proxy
+
+
+def aborted(reason):
+    return REGISTRY.get_sample_value('unthink_proxy_streams_aborted_total', {'reason': reason}) or 0
+
+
+class TestDisconnectDetection(unittest.TestCase):
+    def test_socket_closed(self):
+        ours, theirs = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.assertFalse(socket_closed(ours))
+        theirs.sendall(b'pipelined')
+        self.assertFalse(socket_closed(ours))
+        theirs.close()
+        # Unread data is still there, so the peer's close is not visible yet
+        self.assertFalse(socket_closed(ours))
+        ours.recv(100)
+        self.assertTrue(socket_closed(ours))
+
+    def test_watch_is_rate_limited(self):
+        checks = []
+        watch = DisconnectWatch(lambda: checks.append(1) or True, interval=3600)
+        self.assertFalse(watch.client_gone())
+        self.assertEqual(checks, [])
+        self.assertTrue(DisconnectWatch(lambda: True, interval=0).client_gone())
+
+
+class TestSavings(unittest.TestCase):
+    def test_estimate_from_completed_streams(self):
+        lengths = OutputLengths()
+        self.assertEqual(record_abort('client_disconnect', 'm', 10, 1.0, lengths=lengths), 0.0)
+        lengths.observe('m', json.dumps({"done": True, "eval_count": 100, "eval_duration": 2 * 10 ** 9}))
+        self.assertEqual(lengths.estimate('m'), (100, 0.02))
+        # 10 tokens in 1s: 90 left at 0.1s each
+        self.assertAlmostEqual(record_abort('client_disconnect', 'm', 10, 1.0, lengths=lengths), 9.0)
+        # Nothing streamed yet: fall back to the learned time per token
+        self.assertAlmostEqual(record_abort('deadline', 'm', 0, 5.0, num_predict=50, lengths=lengths), 1.0)
+
+
+class TestFlaskAbort(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+
+    def upstream(self):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = ndjson_lines(
+            {"message": {"role": "assistant", "content": "<think>"}, "done": False},
+            *[{"message": {"role": "assistant", "content": f" step{i}"}, "done": False} for i in range(5)],
+            {"message": {"role": "assistant", "content": "</think>answer"}, "done": False},
+            {"message": {"role": "assistant", "content": ""}, "done": True},
+        )
+        return upstream
+
+    @patch('unthink_proxy.get_session')
+    def test_disconnect_while_thinking_closes_upstream(self, mock_session):
+        upstream = self.upstream()
+        mock_session.return_value.post.return_value = upstream
+        before = aborted('client_disconnect')
+        with patch.object(unthink_proxy.DisconnectWatch, 'client_gone', return_value=True):
+            response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+            self.assertEqual(response.data, b'')
+        upstream.close.assert_called()
+        self.assertEqual(aborted('client_disconnect'), before + 1)
+
+    @patch('unthink_proxy.get_session')
+    def test_deadline(self, mock_session):
+        mock_session.return_value.post.return_value = self.upstream()
+        before = aborted('timeout')
+        with patch.object(unthink_proxy, 'timeouts_for', return_value=PhaseTimeouts(60, 60, 0, 60, 1e-9)):
+            response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+            frames = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(frames[-1]["timeout"], "total")
+        self.assertEqual(aborted('timeout'), before + 1)
+
+
+class TestAsyncAbort(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.upstream = TestServer(create_app(think_tokens=500, token_delay=0.005))
+        await self.upstream.start_server()
+        self.patchers = [
+            patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/')),
+            patch.object(async_proxy, 'DisconnectWatch', functools.partial(DisconnectWatch, interval=0)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def test_disconnect_cancels_upstream_generation(self):
+        state = self.upstream.app[STATE]
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+        self.assertEqual(response.status, 200)
+        response.close()
+        for _ in range(200):
+            if state["cancelled"]:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(state["cancelled"], 1)
+        self.assertEqual(state["active"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import json
+import time
+import sys
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+from flask import Flask, Response
+from prometheus_client import REGISTRY
+from unittest.mock import patch
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import create_app
+from metrics import MetricsMiddleware
+from model_capabilities import CapabilityRegistry
+from stream_metrics import ModelLabels, StreamMetrics
+from think_stripper import ThinkStripper
+import async_proxy
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestStreamMetrics(unittest.TestCase):
+    def test_tokens_from_final_frame(self):
+        model = 'stats-unit:latest'
+        stats = StreamMetrics('stats-unit', time.monotonic())
+        for output in (b'', b'', b'', b'{"done":false}\n', b'{"done":false}\n'):
+            stats.line(output)
+        final = json.dumps({"done": True, "eval_count": 5, "eval_duration": 10 ** 8}, separators=(",", ":")).encode('utf-8')
+        stats.line(final)
+        stats.finish(final, thinking_chars=42)
+        self.assertEqual(sample('unthink_proxy_thinking_tokens_removed_total', model=model), 3)
+        self.assertEqual(sample('unthink_proxy_answer_tokens_total', model=model), 2)
+        self.assertEqual(sample('unthink_proxy_thinking_chars_removed_total', model=model), 42)
+        self.assertEqual(sample('unthink_proxy_generation_tokens_per_second_sum', model=model), 50)
+        self.assertEqual(sample('unthink_proxy_time_to_first_chunk_seconds_count', model=model), 1)
+        self.assertEqual(sample('unthink_proxy_time_to_first_token_seconds_count', model=model), 1)
+        self.assertEqual(sample('unthink_proxy_chunk_gap_seconds_count', model=model), 5)
+
+    def test_reissue_counts_answer_of_last_generation(self):
+        model = 'stats-reissue:latest'
+        stats = StreamMetrics(model, time.monotonic())
+        # Six thinking frames, then the budget cut the generation off
+        for _ in range(6):
+            stats.line(b'')
+        stats.reissued()
+        for output in (b'', b'{"done":false}\n', b'{"done":false}\n'):
+            stats.line(output)
+        final = b'{"done":true,"eval_count":3}'
+        stats.finish(final)
+        self.assertEqual(sample('unthink_proxy_thinking_tokens_removed_total', model=model), 7)
+        self.assertEqual(sample('unthink_proxy_answer_tokens_total', model=model), 2)
+
+    def test_only_frames_inside_a_block_are_thinking(self):
+        stats = StreamMetrics('stats-frames', time.monotonic())
+        stripper = ThinkStripper('<think>', '</think>')
+        # A blank frame, the block over four frames, then dropped whitespace
+        for content in ("", "<think>", "plan", "</think>", "\n\n", "Hi"):
+            stats.line(stripper.feed(content).encode('utf-8'), stripper)
+        self.assertEqual(stats.thinking_frames, 3)
+
+    def test_model_labels_are_bounded(self):
+        capabilities = CapabilityRegistry(overrides={"listed": "none"})
+        labels = ModelLabels(["known:8b"], limit=2, capabilities=capabilities)
+        self.assertEqual([labels.label(model) for model in ("a", "b", "c", "a")], ["a:latest", "b:latest", "other", "a:latest"])
+        self.assertEqual(labels.label("known:8b"), "known:8b")
+        self.assertEqual(labels.label("listed"), "listed:latest")
+        capabilities._learn("found:7b", {"capabilities": ["thinking"]})
+        self.assertEqual(labels.label("found:7b"), "found:7b")
+
+    def test_aborted_stream_has_no_token_counts(self):
+        model = 'stats-aborted:latest'
+        stats = StreamMetrics(model, time.monotonic())
+        stats.line(b'')
+        stats.finish()
+        self.assertEqual(sample('unthink_proxy_stream_duration_seconds_count', model=model), 1)
+        self.assertEqual(sample('unthink_proxy_time_to_first_token_seconds_count', model=model), 0)
+        self.assertEqual(sample('unthink_proxy_answer_tokens_total', model=model), 0)
+
+
+class TestMiddleware(unittest.TestCase):
+    def test_latency_covers_streamed_body(self):
+        app = Flask(__name__)
+
+        @app.route('/slow-stream')
+        def slow_stream():
+            def body():
+                yield b'a'
+                time.sleep(0.2)
+                yield b'b'
+            return Response(body())
+
+        app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+        # Unknown paths are labelled with a route template
+        labels = dict(method='GET', endpoint='/<path>')
+        before = sample('unthink_proxy_request_duration_seconds_sum', **labels)
+        count = sample('unthink_proxy_requests_total', status='200', **labels)
+        response = app.test_client().get('/slow-stream')
+        self.assertEqual(response.data, b'ab')
+        response.close()
+        self.assertGreaterEqual(sample('unthink_proxy_request_duration_seconds_sum', **labels) - before, 0.2)
+        self.assertEqual(sample('unthink_proxy_requests_total', status='200', **labels), count + 1)
+
+
+class TestAsyncStreamMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_chat_stream(self):
+        upstream = TestServer(create_app(models=("stats-int:8b",), think_tokens=6, answer_tokens=4,
+                                         token_delay=0.01))
+        await upstream.start_server()
+        self.addAsyncCleanup(upstream.close)
+        with patch.object(async_proxy, 'OLLAMA_SERVER', str(upstream.make_url('')).rstrip('/')):
+            client = TestClient(TestServer(async_proxy.create_app()))
+            await client.start_server()
+            self.addAsyncCleanup(client.close)
+            response = await client.post('/api/chat', json={"model": "stats-int:8b", "messages": []})
+            await response.read()
+        model = 'stats-int:8b'
+        # <think>, six steps and </think>
+        self.assertEqual(sample('unthink_proxy_thinking_tokens_removed_total', model=model), 8)
+        self.assertEqual(sample('unthink_proxy_answer_tokens_total', model=model), 4)
+        first_chunk = sample('unthink_proxy_time_to_first_chunk_seconds_sum', model=model)
+        first_token = sample('unthink_proxy_time_to_first_token_seconds_sum', model=model)
+        self.assertGreater(first_token, first_chunk)
+        self.assertGreaterEqual(first_token, 0.08)
+        self.assertEqual(sample('unthink_proxy_generation_tokens_per_second_count', model=model), 1)
+        self.assertEqual(sample('unthink_proxy_stream_duration_seconds_count', model=model), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
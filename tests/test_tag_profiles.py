@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from history import strip_history
+from request_pipeline import NormalizedRequest
+from tag_profiles import TagProfiles
+from tests.helpers import chat_line
+import unthink_proxy
+
+PROFILES = {
+    "r1": [["<think>", "</think>"], ["<|begin_of_thought|>", "<|end_of_thought|>"]],
+    "reasoning": [["<reasoning>", "</reasoning>"]],
+}
+MODELS = {
+    "deepseek-r1*": "r1",
+    "custom": "reasoning",
+    "custom*": "r1",
+}
+
+
+class TestTagProfiles(unittest.TestCase):
+    def setUp(self):
+        self.profiles = TagProfiles(PROFILES, MODELS)
+
+    def test_resolution(self):
+        self.assertEqual(self.profiles.profile_for("deepseek-r1:8b").name, "r1")
+        # Exact names win over wildcards and are compared with their tag
+        self.assertEqual(self.profiles.profile_for("custom").name, "reasoning")
+        self.assertEqual(self.profiles.profile_for("custom:latest").name, "reasoning")
+        self.assertEqual(self.profiles.profile_for("custom:7b").name, "r1")
+        self.assertIsNone(self.profiles.profile_for("qwen3:8b"))
+        self.assertIsNone(TagProfiles({}, {}).profile_for("deepseek-r1:8b"))
+
+    def test_cache_is_bounded(self):
+        profiles = TagProfiles(PROFILES, MODELS, cache_size=2)
+        for model in ("a", "b", "c", "deepseek-r1:8b"):
+            profiles.profile_for(model)
+        self.assertEqual(len(profiles._resolved), 2)
+
+    def test_unknown_profile_rejected(self):
+        with self.assertRaises(ValueError):
+            TagProfiles(PROFILES, {"m": "missing"})
+
+    def test_history_uses_profile(self):
+        request = NormalizedRequest('chat', {"model": "m", "messages": [
+            {"role": "assistant", "content": "<|begin_of_thought|>plan<|end_of_thought|>a1"},
+            {"role": "user", "content": "q"},
+        ]}, b'')
+        strip_history(request, profile=self.profiles.profile_for("deepseek-r1:8b"))
+        self.assertEqual(request.data["messages"][0]["content"], "a1")
+
+
+class TestFlaskTagProfiles(unittest.TestCase):
+    @patch('unthink_proxy.get_session')
+    def test_profile_selected_by_model(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            chat_line("<reasoning>"), chat_line("plan"), chat_line("</reasoning>"),
+            chat_line("\n\nAnswer <think>kept</think>"), chat_line("", done=True),
+        ]
+        mock_session.return_value.post.return_value = upstream
+        with patch.object(unthink_proxy, 'TAG_PROFILES', TagProfiles(PROFILES, MODELS)):
+            response = unthink_proxy.app.test_client().post(
+                '/api/chat', json={"model": "custom", "messages": [{"role": "user", "content": "q"}]}
+            )
+        content = "".join(
+            json.loads(line)["message"]["content"] for line in response.get_data().splitlines() if line
+        )
+        self.assertEqual(content, "Answer <think>kept</think>")
+
+
+if __name__ == "__main__":
+    unittest.main()
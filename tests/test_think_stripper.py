@@ -0,0 +1,180 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from think_stripper import TagProfile, TagScanner, ThinkStripper
+
+
+OPEN = "<think>"
+CLOSE = "</think>"
+
+# Reference transcript: several blocks, near-miss tags and a dangling "<"
+TRANSCRIPT = (
+    "Intro <thin> text <think>first\nplan</think>\n\nAnswer with a < sign"
+    "<think>second <think> nested-looking</thi></think> and </thinker> end <"
+)
+EXPECTED = "Intro <thin> text Answer with a < sign and </thinker> end <"
+
+
+def run(chunks, **kwargs):
+    stripper = ThinkStripper(OPEN, CLOSE, **kwargs)
+    out = "".join(stripper.feed(chunk) for chunk in chunks)
+    return out + stripper.flush(), stripper
+
+
+class TestThinkStripper(unittest.TestCase):
+    def test_whole_transcript(self):
+        result, stripper = run([TRANSCRIPT])
+        self.assertEqual(result, EXPECTED)
+        self.assertEqual(stripper.blocks_removed, 2)
+        self.assertTrue(stripper.thinking_finished)
+        self.assertFalse(stripper.thinking_started)
+
+    def test_every_single_split(self):
+        for offset in range(len(TRANSCRIPT) + 1):
+            with self.subTest(offset=offset):
+                result, _ = run([TRANSCRIPT[:offset], TRANSCRIPT[offset:]])
+                self.assertEqual(result, EXPECTED)
+
+    def test_every_double_split(self):
+        size = len(TRANSCRIPT)
+        for first in range(size + 1):
+            for second in range(first, size + 1):
+                chunks = [TRANSCRIPT[:first], TRANSCRIPT[first:second], TRANSCRIPT[second:]]
+                result, _ = run(chunks)
+                if result != EXPECTED:
+                    self.fail(f"split at {first}/{second}: {result!r}")
+
+    def test_character_by_character(self):
+        result, stripper = run(list(TRANSCRIPT))
+        self.assertEqual(result, EXPECTED)
+        self.assertEqual(stripper.blocks_removed, 2)
+
+    def test_chars_removed_independent_of_split(self):
+        _, whole = run([TRANSCRIPT])
+        _, chars = run(list(TRANSCRIPT))
+        self.assertEqual(whole.chars_removed, chars.chars_removed)
+
+    def test_holds_back_only_partial_tag(self):
+        stripper = ThinkStripper(OPEN, CLOSE)
+        self.assertEqual(stripper.feed("Hello <thi"), "Hello ")
+        self.assertEqual(stripper.pending, "<thi")
+        self.assertEqual(stripper.feed("s is not a tag"), "<this is not a tag")
+        self.assertEqual(stripper.pending, "")
+
+    def test_tag_split_across_chunks(self):
+        result, stripper = run(["<th", "ink>", "reasoning", "</th", "ink>", "\n\n", "Answer"])
+        self.assertEqual(result, "Answer")
+        self.assertEqual(stripper.blocks_removed, 1)
+
+    def test_unterminated_thinking_is_dropped(self):
+        result, stripper = run(["Hi <think>never ", "closed </thi"])
+        self.assertEqual(result, "Hi ")
+        self.assertTrue(stripper.thinking_started)
+
+    def test_keep_whitespace_when_disabled(self):
+        result, _ = run(["<think>x</think>\n\nAnswer"], strip_leading_whitespace=False)
+        self.assertEqual(result, "\n\nAnswer")
+
+    def test_close_tag_without_open_tag(self):
+        # Templates that prefill the open tag: the output starts inside the block
+        result, stripper = run(["reasoning</think>\n\nanswer"])
+        self.assertEqual(result, "answer")
+        self.assertTrue(stripper.thinking_finished)
+        self.assertEqual(stripper.blocks_removed, 1)
+        # Text streamed before the close tag is already out; the tag still goes
+        result, _ = run(["reason", "ing</th", "ink>\n\nanswer"])
+        self.assertEqual(result, "reasoninganswer")
+
+    def test_close_tag_after_a_block_is_kept(self):
+        result, _ = run(["<think>x</think>a</think>b"])
+        self.assertEqual(result, "a</think>b")
+
+    def test_resume_keeps_whitespace_of_a_running_answer(self):
+        stripper = ThinkStripper(OPEN, CLOSE)
+        stripper.resume(False, True)
+        self.assertEqual(stripper.feed(" world"), " world")
+
+    def test_empty_tags_rejected(self):
+        with self.assertRaises(ValueError):
+            ThinkStripper("", CLOSE)
+
+
+PROFILE = TagProfile([
+    ("<think>", "</think>"),
+    ("<reasoning>", "</reasoning>"),
+    ("<|begin_of_thought|>", "<|end_of_thought|>"),
+    ("<|begin_of_thought|>", "<|end_of_solution_plan|>"),
+], "test")
+
+MULTI_TRANSCRIPT = (
+    "A <reason> <think>one</reasoning></think>\n\nB <|begin_of_thought|>two <think>"
+    "<|end_of_solution_plan|> C <reasoning>three</think></reasoning> D <|begin_of"
+)
+MULTI_EXPECTED = "A <reason> B  C  D <|begin_of"
+
+
+def run_profile(chunks):
+    stripper = ThinkStripper(profile=PROFILE)
+    out = "".join(stripper.feed(chunk) for chunk in chunks)
+    return out + stripper.flush(), stripper
+
+
+class TestTagScanner(unittest.TestCase):
+    def test_first_tag_to_end(self):
+        scanner = TagScanner(["<reasoning>", "<think>", "think>"])
+        self.assertEqual(scanner.find("ab <think> <reasoning>"), (3, "<think>", 0))
+        self.assertEqual(scanner.find("ab <reasoning> <think>", 4), (15, "<think>", 0))
+        # Overlapping candidates are followed through the failure links
+        self.assertEqual(scanner.find("<re<think>"), (3, "<think>", 0))
+
+    def test_held_back_suffix(self):
+        scanner = TagScanner(["<reasoning>", "<think>"])
+        self.assertEqual(scanner.find("text <reas"), (-1, None, 5))
+        self.assertEqual(scanner.find("text <rea<th"), (-1, None, 3))
+        self.assertEqual(scanner.find("no tags here"), (-1, None, 0))
+
+    def test_single_tag_matches_automaton(self):
+        text = "x <thin <think> y </th"
+        single = TagScanner(["<think>"])
+        multi = TagScanner(["<think>", "\x00never"])
+        for pos in range(len(text)):
+            with self.subTest(pos=pos):
+                self.assertEqual(single.find(text, pos), multi.find(text, pos))
+
+
+class TestProfileStripper(unittest.TestCase):
+    def test_whole_transcript(self):
+        result, stripper = run_profile([MULTI_TRANSCRIPT])
+        self.assertEqual(result, MULTI_EXPECTED)
+        self.assertEqual(stripper.blocks_removed, 3)
+
+    def test_every_single_split(self):
+        for offset in range(len(MULTI_TRANSCRIPT) + 1):
+            with self.subTest(offset=offset):
+                result, _ = run_profile([MULTI_TRANSCRIPT[:offset], MULTI_TRANSCRIPT[offset:]])
+                self.assertEqual(result, MULTI_EXPECTED)
+
+    def test_character_by_character(self):
+        result, stripper = run_profile(list(MULTI_TRANSCRIPT))
+        self.assertEqual(result, MULTI_EXPECTED)
+        self.assertEqual(stripper.blocks_removed, 3)
+
+    def test_tags_follow_open_block(self):
+        stripper = ThinkStripper(profile=PROFILE)
+        self.assertEqual((stripper.open_tag, stripper.close_tag), ("<think>", "</think>"))
+        stripper.feed("<|begin_of_thought|>plan")
+        self.assertEqual(stripper.close_tag, "<|end_of_thought|>")
+        stripper.feed("<|end_of_solution_plan|>")
+        self.assertEqual(stripper.close_tag, "<|end_of_solution_plan|>")
+
+    def test_single_pair_profile_matches_tags(self):
+        result, _ = run([TRANSCRIPT])
+        stripper = ThinkStripper(profile=TagProfile([(OPEN, CLOSE)]))
+        self.assertEqual(stripper.feed(TRANSCRIPT) + stripper.flush(), result)
+
+
+if __name__ == "__main__":
+    unittest.main()
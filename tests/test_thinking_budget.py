@@ -0,0 +1,184 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import json
+import sys
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import STATE, create_app
+from ndjson_stream import ChatStreamProcessor, iter_frames
+from thinking_budget import (
+    BudgetTracker, ThinkingBudget, ThinkingBudgetExceeded, ThinkingLengths, budget_for,
+    parse_budget_header, reissue_body
+)
+from request_pipeline import NormalizedRequest
+from tests.helpers import chat_line
+import async_proxy
+import unthink_proxy
+
+OPEN, CLOSE = "<think>", "</think>"
+
+
+def hits(model, action):
+    return REGISTRY.get_sample_value(
+        'unthink_proxy_thinking_budget_hits_total', {'model': model, 'action': action}
+    ) or 0
+
+
+class TestBudgetConfig(unittest.TestCase):
+    def test_header(self):
+        self.assertEqual(parse_budget_header("1500"), (1500, 0))
+        self.assertEqual(parse_budget_header("20s"), (0, 20.0))
+        for bad in ("lots", "-1", "-5s"):
+            with self.assertRaises(ValueError):
+                parse_budget_header(bad)
+
+    def test_budget_for(self):
+        with patch('thinking_budget._MODEL_BUDGETS', {"qwen3:latest": ThinkingBudget(100, 0, 'error')}):
+            budget = budget_for("qwen3")
+            self.assertEqual((budget.tokens, budget.seconds, budget.action), (100, None, 'error'))
+            # A header replaces both limits of the model's budget
+            budget = budget_for("qwen3", {"X-Thinking-Budget": "30s", "X-Thinking-Budget-Action": "reissue"})
+            self.assertEqual((budget.tokens, budget.seconds, budget.action), (None, 30.0, 'reissue'))
+            self.assertFalse(budget_for("qwen3", {"X-Thinking-Budget": "0"}).active)
+            with self.assertRaises(ValueError):
+                budget_for("qwen3", {"X-Thinking-Budget-Action": "ignore"})
+
+    def test_reissue_body(self):
+        data = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+        body = json.loads(reissue_body(data, "<think> a\n</think>\n\n"))
+        self.assertEqual(body["messages"][-1], {"role": "assistant", "content": "<think> a\n</think>\n\n"})
+        # The original request is left alone
+        self.assertEqual(len(data["messages"]), 1)
+        data["messages"].append({"role": "assistant", "content": "Sure."})
+        body = json.loads(reissue_body(data, "<think></think>"))
+        self.assertEqual(len(body["messages"]), 2)
+        self.assertEqual(body["messages"][-1]["content"], "Sure.<think></think>")
+
+
+class TestBudgetTracker(unittest.TestCase):
+    def run_stream(self, tracker, contents):
+        processor = ChatStreamProcessor(OPEN, CLOSE)
+        for i, content in enumerate(contents):
+            line = chat_line(content)
+            processor.process_line(line)
+            if tracker.exceeded(line, processor.stripper):
+                return processor, i
+        return processor, None
+
+    def test_token_budget(self):
+        lengths = ThinkingLengths()
+        tracker = BudgetTracker(ThinkingBudget(3, 0, 'reissue'), "m", lengths)
+        processor, cut_at = self.run_stream(tracker, ["<think>", " a", " b", " c", " d", "</think>", "x"])
+        self.assertEqual(cut_at, 3)
+        request = NormalizedRequest('chat', {"model": "m", "messages": [{"role": "user", "content": "q"}]}, b'')
+        body = json.loads(tracker.cut_off(request, processor.stripper))
+        self.assertEqual(body["messages"][-1]["content"], "<think> a b c\n</think>\n\n")
+        self.assertFalse(processor.stripper.thinking_started)
+        # The continuation is treated as the answer
+        output = json.loads(processor.process_line(chat_line("\n\nanswer")))
+        self.assertEqual(output["message"]["content"], "answer")
+
+    def test_error_action_and_learning(self):
+        lengths = ThinkingLengths()
+        tracker = BudgetTracker(ThinkingBudget(10, 0, 'error'), "m", lengths)
+        _, cut_at = self.run_stream(tracker, ["<think>", " a", " b", "</think>", "x"])
+        self.assertIsNone(cut_at)
+        self.assertAlmostEqual(lengths.estimate("m:latest"), 3)
+
+        tracker = BudgetTracker(ThinkingBudget(2, 0, 'error'), "m", lengths)
+        processor, cut_at = self.run_stream(tracker, ["<think>", " a", " b", " c"])
+        self.assertEqual(cut_at, 2)
+        with self.assertRaises(ThinkingBudgetExceeded) as raised:
+            tracker.cut_off(None, processor.stripper)
+        self.assertEqual(json.loads(raised.exception.frame())["thinking_budget"], "tokens")
+
+
+    @patch('json_backend.loads', json.loads)
+    def test_framer_views_with_stdlib_json(self):
+        # One read holding several lines is split into memoryviews
+        reads = [b''.join(chat_line(content) for content in ["<think>", " a", " b", " c", " d"])]
+        tracker = BudgetTracker(ThinkingBudget(3, 0, 'reissue'), "m", ThinkingLengths())
+        processor = ChatStreamProcessor(OPEN, CLOSE)
+        for line in iter_frames(reads):
+            self.assertIsInstance(line, memoryview)
+            processor.process_line(line)
+            if tracker.exceeded(line, processor.stripper):
+                break
+        request = NormalizedRequest('chat', {"model": "m", "messages": [{"role": "user", "content": "q"}]}, b'')
+        body = json.loads(tracker.cut_off(request, processor.stripper))
+        self.assertEqual(body["messages"][-1]["content"], "<think> a b c\n</think>\n\n")
+
+
+class TestFlaskBudget(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+
+    @patch('unthink_proxy.get_session')
+    def test_reissue(self, mock_session):
+        first = MagicMock()
+        first.iter_content.return_value = [chat_line(text) for text in ("<think>", " a", " b", " c", " d")]
+        second = MagicMock()
+        second.iter_content.return_value = [chat_line("\n\nanswer"), chat_line("", done=True)]
+        mock_session.return_value.post.side_effect = [first, second]
+        before = hits("m:latest", "reissue")
+        response = self.client.post('/api/chat', json={"model": "m", "messages": [{"role": "user", "content": "q"}]},
+                                    headers={"X-Thinking-Budget": "2"})
+        frames = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([f["message"]["content"] for f in frames], ["answer", ""])
+        first.close.assert_called()
+        resent = json.loads(mock_session.return_value.post.call_args_list[1].kwargs['data'])
+        self.assertEqual(resent["messages"][-1], {"role": "assistant", "content": "<think> a b\n</think>\n\n"})
+        self.assertEqual(hits("m:latest", "reissue"), before + 1)
+
+    def test_invalid_header(self):
+        response = self.client.post('/api/chat', json={"model": "m", "messages": []},
+                                    headers={"X-Thinking-Budget": "soon"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestAsyncBudget(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.upstream = TestServer(create_app(think_tokens=50, answer_tokens=3))
+        await self.upstream.start_server()
+        self.patcher = patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/'))
+        self.patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        self.patcher.stop()
+
+    async def chat(self, **headers):
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []}, headers=headers)
+        return [json.loads(line) for line in (await response.read()).splitlines()]
+
+    async def test_reissue(self):
+        before = hits("qwen3:8b", "reissue")
+        frames = await self.chat(**{"X-Thinking-Budget": "5"})
+        answer = "".join(f["message"]["content"] for f in frames)
+        self.assertEqual(answer, "word0 word1 word2")
+        self.assertTrue(frames[-1]["done"])
+        self.assertEqual(self.upstream.app[STATE]["requests"], 2)
+        self.assertEqual(hits("qwen3:8b", "reissue"), before + 1)
+
+    async def test_error(self):
+        frames = await self.chat(**{"X-Thinking-Budget": "5", "X-Thinking-Budget-Action": "error"})
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["thinking_budget"], "tokens")
+        self.assertEqual(self.upstream.app[STATE]["requests"], 1)
+
+    async def test_within_budget(self):
+        frames = await self.chat(**{"X-Thinking-Budget": "100"})
+        self.assertEqual("".join(f["message"]["content"] for f in frames), "word0 word1 word2")
+        self.assertEqual(self.upstream.app[STATE]["requests"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
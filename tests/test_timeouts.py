@@ -0,0 +1,167 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import asyncio
+import json
+import time
+import sys
+import os
+
+import requests
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import REGISTRY
+from urllib3.exceptions import ReadTimeoutError
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_ollama import STATE, create_app
+from timeouts import (
+    PhaseTimeoutError, PhaseTimeouts, StreamClock, is_read_timeout, request_phase
+)
+import async_proxy
+import unthink_proxy
+
+
+def timeouts(phase):
+    return REGISTRY.get_sample_value('unthink_proxy_stream_timeouts_total', {'phase': phase}) or 0
+
+
+class TestPhaseTimeouts(unittest.TestCase):
+    def test_overrides(self):
+        base = PhaseTimeouts(5, 60, 0, 30, 0)
+        self.assertIsNone(base.first_token)
+        self.assertIsNone(base.total)
+        merged = base.with_overrides({"first_token": 120, "total": "600", "chunk_gap": 0, "unknown": 1})
+        self.assertEqual(merged.connect, 5)
+        self.assertEqual(merged.first_token, 120)
+        self.assertEqual(merged.total, 600)
+        # 0 turns a limit off
+        self.assertIsNone(merged.chunk_gap)
+
+    def test_clock(self):
+        self.assertFalse(StreamClock(PhaseTimeouts(5, 60, 0, 30, 0), time.monotonic()).active)
+        clock = StreamClock(PhaseTimeouts(5, 60, 10, 30, 100), time.monotonic() - 50)
+        # The first-token deadline only matters until something was answered
+        clock.check(answered=True)
+        with self.assertRaises(PhaseTimeoutError) as raised:
+            clock.check(answered=False)
+        self.assertEqual(raised.exception.phase, 'first_token')
+        frame = json.loads(raised.exception.frame())
+        self.assertEqual(frame["timeout"], "first_token")
+        self.assertIn("10s", frame["error"])
+        with self.assertRaises(PhaseTimeoutError) as raised:
+            StreamClock(PhaseTimeouts(5, 60, 10, 30, 100), time.monotonic() - 500).check(answered=True)
+        self.assertEqual(raised.exception.phase, 'total')
+
+    def test_error_classification(self):
+        self.assertEqual(request_phase(requests.exceptions.ConnectTimeout()), 'connect')
+        self.assertEqual(request_phase(requests.exceptions.ReadTimeout()), 'first_byte')
+        self.assertEqual(request_phase(asyncio.TimeoutError()), 'first_byte')
+        self.assertIsNone(request_phase(requests.exceptions.ConnectionError()))
+        # requests reports a read timeout in the body as a ConnectionError
+        self.assertTrue(is_read_timeout(requests.exceptions.ConnectionError(
+            ReadTimeoutError(None, None, "Read timed out.")
+        )))
+        self.assertFalse(is_read_timeout(requests.exceptions.ConnectionError("refused")))
+
+
+class TestFlaskTimeouts(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+
+    @patch('unthink_proxy.get_session')
+    def test_first_token_deadline_while_thinking(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = [
+            json.dumps({"message": {"role": "assistant", "content": text}, "done": False}).encode('utf-8') + b'\n'
+            for text in ("<think>", " step", " step", "</think>answer")
+        ]
+        mock_session.return_value.post.return_value = upstream
+        before = timeouts('first_token')
+        with patch.object(unthink_proxy, 'timeouts_for', return_value=PhaseTimeouts(5, 60, 1e-9, 30, 0)):
+            response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+            frames = [json.loads(line) for line in response.data.splitlines()]
+        # Nothing but the error frame: the answer never started in time
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["timeout"], "first_token")
+        self.assertEqual(timeouts('first_token'), before + 1)
+        upstream.close.assert_called()
+
+    @patch('unthink_proxy.get_session')
+    def test_chunk_gap(self, mock_session):
+        def stalled_body(chunk_size):
+            yield json.dumps({"message": {"role": "assistant", "content": "hi"}, "done": False}).encode('utf-8') + b'\n'
+            raise requests.exceptions.ConnectionError(ReadTimeoutError(None, None, "Read timed out."))
+
+        upstream = MagicMock()
+        upstream.iter_content.side_effect = stalled_body
+        mock_session.return_value.post.return_value = upstream
+        before = timeouts('chunk_gap')
+        response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+        frames = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(frames[0]["message"]["content"], "hi")
+        self.assertEqual(frames[-1]["timeout"], "chunk_gap")
+        self.assertEqual(timeouts('chunk_gap'), before + 1)
+
+    @patch('unthink_proxy.time.sleep')
+    @patch('unthink_proxy.get_session')
+    def test_phases_passed_to_requests(self, mock_session, mock_sleep):
+        mock_session.return_value.post.side_effect = requests.exceptions.ConnectTimeout("connect timed out")
+        before = timeouts('connect')
+        with patch.object(unthink_proxy, 'timeouts_for', return_value=PhaseTimeouts(2, 90, 0, 30, 0)):
+            response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(mock_session.return_value.post.call_args.kwargs['timeout'], (2, 90))
+        self.assertGreater(timeouts('connect'), before)
+
+
+class TestAsyncTimeouts(unittest.IsolatedAsyncioTestCase):
+    async def start(self, phase_timeouts, **fake):
+        self.upstream = TestServer(create_app(**fake))
+        await self.upstream.start_server()
+        self.patchers = [
+            patch.object(async_proxy, 'OLLAMA_SERVER', str(self.upstream.make_url('')).rstrip('/')),
+            patch.object(async_proxy, 'timeouts_for', return_value=phase_timeouts),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.client = TestClient(TestServer(async_proxy.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.upstream.close()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    async def test_chunk_gap(self):
+        await self.start(PhaseTimeouts(5, 5, 0, 0.05, 0), think_tokens=2, answer_tokens=2, token_delay=0.5)
+        before = timeouts('chunk_gap')
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+        frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertEqual(frames[-1]["timeout"], "chunk_gap")
+        self.assertEqual(timeouts('chunk_gap'), before + 1)
+        # The upstream generation was cancelled
+        state = self.upstream.app[STATE]
+        for _ in range(100):
+            if state["cancelled"]:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(state["cancelled"], 1)
+
+    async def test_first_byte(self):
+        await self.start(PhaseTimeouts(5, 0.05, 0, 5, 0), load_delay=0.5)
+        before = timeouts('first_byte')
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+        self.assertEqual(response.status, 503)
+        self.assertEqual(timeouts('first_byte'), before + 1)
+
+    async def test_slow_stream_within_limits(self):
+        await self.start(PhaseTimeouts(5, 5, 5, 0.5, 10), think_tokens=2, answer_tokens=2, token_delay=0.01)
+        response = await self.client.post('/api/chat', json={"model": "qwen3:8b", "messages": []})
+        frames = [json.loads(line) for line in (await response.read()).splitlines()]
+        self.assertTrue(frames[-1]["done"])
+        self.assertNotIn("error", frames[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@ import os
 
 # Add parent directory to path to import the main module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.helpers import ndjson_lines
 import unthink_proxy
 
 
@@ -50,6 +51,77 @@ class TestProcessThinkingContent(unittest.TestCase):
         self.assertTrue(thinking_started)
         self.assertFalse(thinking_finished)
 
+    def test_close_tag_without_open_tag(self):
+        result, thinking_started, thinking_finished = unthink_proxy.process_thinking_content(
+            "reasoning</think>answer", False, False
+        )
+        self.assertEqual(result, "answer")
+        self.assertFalse(thinking_started)
+        self.assertTrue(thinking_finished)
+
+    def test_answer_after_thinking_keeps_whitespace(self):
+        result, _, _ = unthink_proxy.process_thinking_content(" world", False, True)
+        self.assertEqual(result, " world")
+
+    def test_several_blocks(self):
+        result, thinking_started, thinking_finished = unthink_proxy.process_thinking_content(
+            "a</think>b<think>c</think>d<think>e", True, False
+        )
+        self.assertEqual(result, "bd")
+        self.assertTrue(thinking_started)
+        self.assertTrue(thinking_finished)
+
+
+class TestProxyStreaming(unittest.TestCase):
+    def setUp(self):
+        self.client = unthink_proxy.app.test_client()
+
+    @patch('unthink_proxy.get_session')
+    def test_tags_split_across_chunks(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = ndjson_lines(
+            {"message": {"role": "assistant", "content": "<th"}, "done": False},
+            {"message": {"role": "assistant", "content": "ink>plan"}, "done": False},
+            {"message": {"role": "assistant", "content": "</thi"}, "done": False},
+            {"message": {"role": "assistant", "content": "nk>\n\nHello"}, "done": False},
+            {"message": {"role": "assistant", "content": " world"}, "done": False},
+            {"message": {"role": "assistant", "content": ""}, "done": True},
+        )
+        mock_session.return_value.post.return_value = upstream
+
+        response = self.client.post('/api/chat', json={"model": "m", "messages": []})
+        frames = [json.loads(line) for line in response.data.splitlines()]
+
+        content = "".join(frame["message"]["content"] for frame in frames)
+        self.assertEqual(content, "Hello world")
+        self.assertTrue(frames[-1]["done"])
+
+    @patch('unthink_proxy.get_session')
+    def test_non_stream_response_is_stripped(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = ndjson_lines(
+            {"message": {"role": "assistant", "content": "<think>plan</think>\n\nAnswer"}, "done": True},
+        )
+        mock_session.return_value.post.return_value = upstream
+
+        response = self.client.post('/api/chat', json={"model": "m", "messages": [], "stream": False})
+        frame = json.loads(response.data)
+        self.assertEqual(frame["message"]["content"], "Answer")
+
+    @patch('unthink_proxy.get_session')
+    def test_request_body_is_forwarded_unchanged(self, mock_session):
+        upstream = MagicMock()
+        upstream.iter_content.return_value = ndjson_lines({"message": {"content": "ok"}, "done": True})
+        mock_session.return_value.post.return_value = upstream
+        raw = b'{"model": "m",  "messages": []}'
+
+        self.client.post('/api/chat', data=raw, content_type='application/json')
+        self.assertEqual(mock_session.return_value.post.call_args.kwargs['data'], raw)
+
+    def test_invalid_json_is_rejected(self):
+        response = self.client.post('/api/chat', data=b'{broken', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import REGISTRY
+
+# Add parent directory to path to import the main module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import upstream
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"models": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+class TestUpstreamSession(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/api/tags"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_connections_are_reused(self):
+        session = upstream.create_session()
+        hits = sample('unthink_proxy_upstream_pool_connections_total', {'result': 'hit'})
+        misses = sample('unthink_proxy_upstream_pool_connections_total', {'result': 'miss'})
+        for _ in range(3):
+            self.assertEqual(session.get(self.url, timeout=5).status_code, 200)
+        self.assertEqual(sample('unthink_proxy_upstream_pool_connections_total', {'result': 'miss'}) - misses, 1)
+        self.assertEqual(sample('unthink_proxy_upstream_pool_connections_total', {'result': 'hit'}) - hits, 2)
+
+    def test_idle_connections_are_evicted(self):
+        session = upstream.create_session()
+        session.get(self.url, timeout=5)
+        evictions = sample('unthink_proxy_upstream_pool_evictions_total')
+        with patch.object(upstream, 'UPSTREAM_IDLE_TIMEOUT', 0):
+            self.assertEqual(session.get(self.url, timeout=5).status_code, 200)
+        self.assertEqual(sample('unthink_proxy_upstream_pool_evictions_total') - evictions, 1)
+
+    def test_session_is_recreated_in_new_process(self):
+        session = upstream.get_session()
+        self.assertIs(upstream.get_session(), session)
+        with patch.object(upstream, '_session_pid', -1):
+            self.assertIsNot(upstream.get_session(), session)
+
+
+if __name__ == "__main__":
+    unittest.main()
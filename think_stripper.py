@@ -0,0 +1,262 @@
+"""Incremental removal of thinking blocks from streamed model output."""
+import functools
+import re
+from collections import deque
+
+
+class TagScanner:
+    """Aho-Corasick automaton that finds the first of any number of tags
+
+    One pass over the text finds whichever tag ends first, so the cost per
+    character does not grow with the number of tags.  Characters that cannot
+    start a tag are skipped by a compiled character class; the automaton is
+    only stepped through in Python from a candidate on.  A single tag needs no
+    automaton and is searched with ``str.find``.
+    """
+
+    def __init__(self, tags):
+        self.tags = tuple(dict.fromkeys(tags))
+        if not self.tags or not all(self.tags):
+            raise ValueError("tags must be non-empty")
+        self._prefixes = _proper_prefixes(self.tags[0]) if len(self.tags) == 1 else None
+        # One state per distinct tag prefix: transitions, failure link, the
+        # longest tag ending in the state and the length of its prefix
+        self._goto = [{}]
+        self._fail = [0]
+        self._match = [None]
+        self._depth = [0]
+        for tag in self.tags:
+            state = 0
+            for char in tag:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(None)
+                    self._depth.append(self._depth[state] + 1)
+                state = nxt
+            self._match[state] = tag
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                if self._match[nxt] is None:
+                    self._match[nxt] = self._match[self._fail[nxt]]
+                queue.append(nxt)
+        self._starts = re.compile("[" + "".join(re.escape(char) for char in sorted(self._goto[0])) + "]")
+
+    def find(self, text, pos=0):
+        """Return ``(start, tag, held)`` for the first tag that ends in ``text[pos:]``
+
+        Without a match ``start`` is -1, ``tag`` None and ``held`` the length
+        of the longest suffix of the text that could still grow into a tag.
+        """
+        if self._prefixes is not None:
+            tag = self.tags[0]
+            idx = text.find(tag, pos)
+            if idx == -1:
+                return -1, None, _held_back(text, pos, self._prefixes)
+            return idx, tag, 0
+
+        goto, fail, match = self._goto, self._fail, self._match
+        state = 0
+        end = len(text)
+        while pos < end:
+            if not state:
+                candidate = self._starts.search(text, pos)
+                if candidate is None:
+                    return -1, None, 0
+                pos = candidate.start()
+            char = text[pos]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            pos += 1
+            tag = match[state]
+            if tag is not None:
+                return pos - len(tag), tag, 0
+        return -1, None, self._depth[state]
+
+
+class TagProfile:
+    """Open/close tag pairs of one model family, compiled once
+
+    An open tag may be listed with several close tags; a block is ended by
+    any close tag paired with the tag that opened it.  Until the first block,
+    close tags are looked for as well: templates that prefill the open tag
+    make the model start right inside a thinking block.
+    """
+
+    def __init__(self, pairs, name="default"):
+        self.name = name
+        self.pairs = tuple((open_tag, close_tag) for open_tag, close_tag in pairs)
+        if not self.pairs or not all(open_tag and close_tag for open_tag, close_tag in self.pairs):
+            raise ValueError("open_tag and close_tag must be non-empty")
+        closes = {}
+        for open_tag, close_tag in self.pairs:
+            closes.setdefault(open_tag, []).append(close_tag)
+        self.opens = TagScanner(closes)
+        self.closes = {open_tag: TagScanner(tags) for open_tag, tags in closes.items()}
+        self.leading = TagScanner(list(closes) + [close_tag for _, close_tag in self.pairs])
+
+    @property
+    def open_tags(self):
+        return self.opens.tags
+
+
+@functools.lru_cache(maxsize=64)
+def _pair_profile(open_tag, close_tag):
+    return TagProfile([(open_tag, close_tag)])
+
+
+class ThinkStripper:
+    """Streaming scanner that drops everything between an open and a close tag.
+
+    Text is fed chunk by chunk.  Tags may be split across any number of
+    chunks: only the tail of a chunk that could still grow into a tag is held
+    back (at most ``len(tag) - 1`` characters), everything else is emitted or
+    dropped immediately.  Each call is linear in the size of the chunk.
+
+    With a ``profile`` every tag pair of the profile is recognised, in the
+    same single pass; ``open_tag`` and ``close_tag`` then follow the block
+    that was opened last.
+    """
+
+    def __init__(self, open_tag=None, close_tag=None, strip_leading_whitespace=True, profile=None):
+        if profile is None:
+            if not open_tag or not close_tag:
+                raise ValueError("open_tag and close_tag must be non-empty")
+            profile = _pair_profile(open_tag, close_tag)
+        self.profile = profile
+        self.open_tag, self.close_tag = profile.pairs[0]
+        self.strip_leading_whitespace = strip_leading_whitespace
+        # Public state, mirrors the flags of process_thinking_content()
+        self.thinking_started = False
+        self.thinking_finished = False
+        self.blocks_removed = 0
+        self.chars_removed = 0
+        self._pending = ""
+        self._answer_started = False
+        self._closes = profile.closes[self.open_tag]
+
+    @property
+    def pending(self):
+        """Text held back because it may be the start of a tag"""
+        return self._pending
+
+    @property
+    def answer_started(self):
+        """Whether answer text has been emitted after a closed thinking block"""
+        return self._answer_started
+
+    def resume(self, thinking_started, thinking_finished):
+        """Continue from the flags of earlier content, e.g. of a previous frame
+
+        If a block was finished before, its answer is already under way and
+        keeps its leading whitespace.
+        """
+        self.thinking_started = thinking_started
+        self.thinking_finished = thinking_finished
+        self._answer_started = thinking_finished
+
+    def feed(self, text):
+        """Consume the next chunk and return the text that can be emitted"""
+        if not text:
+            return ""
+        if self._pending:
+            text = self._pending + text
+            self._pending = ""
+
+        out = []
+        pos = 0
+        end = len(text)
+        while pos < end:
+            if self.thinking_started:
+                idx, tag, keep = self._closes.find(text, pos)
+                if idx == -1:
+                    self.chars_removed += end - keep - pos
+                    self._pending = text[end - keep:]
+                    break
+                self.chars_removed += idx - pos
+                pos = idx + len(tag)
+                self.close_tag = tag
+                self.thinking_started = False
+                self.thinking_finished = True
+                self.blocks_removed += 1
+            else:
+                before_first_block = not self.thinking_finished
+                scanner = self.profile.leading if before_first_block else self.profile.opens
+                idx, tag, keep = scanner.find(text, pos)
+                if idx == -1:
+                    out.append(self._answer(text[pos:end - keep]))
+                    self._pending = text[end - keep:]
+                    break
+                if before_first_block and tag not in self.profile.closes:
+                    # A close tag without an open tag: the open tag was part
+                    # of the prompt, so everything up to here was thinking
+                    self.chars_removed += idx - pos
+                    pos = idx + len(tag)
+                    self.close_tag = tag
+                    self.thinking_finished = True
+                    self.blocks_removed += 1
+                    continue
+                out.append(self._answer(text[pos:idx]))
+                pos = idx + len(tag)
+                self.open_tag = tag
+                self._closes = self.profile.closes[tag]
+                self.close_tag = self._closes.tags[0]
+                self.thinking_started = True
+
+        return "".join(out)
+
+    def close_block(self):
+        """End the current thinking block as if its close tag had arrived"""
+        if not self.thinking_started:
+            return
+        self.chars_removed += len(self._pending)
+        self._pending = ""
+        self.thinking_started = False
+        self.thinking_finished = True
+        self.blocks_removed += 1
+
+    def flush(self):
+        """Finish the stream and return whatever was still held back"""
+        pending = self._pending
+        self._pending = ""
+        if self.thinking_started:
+            # Unterminated thinking block: drop it
+            self.chars_removed += len(pending)
+            return ""
+        return self._answer(pending)
+
+    def _answer(self, text):
+        # Drop the whitespace models put between the close tag and the answer
+        if (
+            self.strip_leading_whitespace and
+            self.thinking_finished and
+            not self._answer_started
+        ):
+            text = text.lstrip()
+            if text:
+                self._answer_started = True
+        return text
+
+
+def _proper_prefixes(tag):
+    """Proper prefixes of ``tag``, longest first"""
+    return [tag[:size] for size in range(len(tag) - 1, 0, -1)]
+
+
+def _held_back(text, start, prefixes):
+    """Length of the longest suffix of ``text[start:]`` that could begin a tag"""
+    available = len(text) - start
+    for prefix in prefixes:
+        if len(prefix) <= available and text.endswith(prefix):
+            return len(prefix)
+    return 0
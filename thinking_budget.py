@@ -0,0 +1,205 @@
+"""Cutting off thinking blocks that run past a token or time budget."""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+import json_backend
+from backend_pool import model_name
+from metrics import THINKING_BUDGET_HITS, THINKING_BUDGET_TOKENS_SAVED
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+# Thinking tokens (upstream frames) allowed before the cutoff (0 = no limit)
+THINKING_BUDGET_TOKENS = int(os.getenv("THINKING_BUDGET_TOKENS") or 0)
+# Seconds of thinking allowed before the cutoff (0 = no limit)
+THINKING_BUDGET_SECONDS = float(os.getenv("THINKING_BUDGET_SECONDS") or 0)
+# reissue: ask again with the thinking closed so the model answers; error: end the stream
+THINKING_BUDGET_ACTION = os.getenv("THINKING_BUDGET_ACTION") or "reissue"
+# Per-model overrides, e.g. {"qwen3:32b": {"tokens": 2000, "seconds": 60, "action": "error"}}
+THINKING_BUDGET_MODELS = json.loads(os.getenv("THINKING_BUDGET_MODELS") or "{}")
+
+ACTIONS = ('reissue', 'error')
+# Per-request override: "1500" tokens, "20s" seconds, "0" no budget
+BUDGET_HEADER = 'X-Thinking-Budget'
+ACTION_HEADER = 'X-Thinking-Budget-Action'
+
+
+class ThinkingBudget:
+    """Limits of one thinking block; 0 means no limit and is stored as None"""
+
+    def __init__(self, tokens=0, seconds=0, action=THINKING_BUDGET_ACTION):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown thinking budget action: {action}")
+        self.tokens = int(tokens or 0) or None
+        self.seconds = float(seconds or 0) or None
+        self.action = action
+
+    @property
+    def active(self):
+        return self.tokens is not None or self.seconds is not None
+
+    def with_overrides(self, overrides):
+        return ThinkingBudget(
+            overrides.get('tokens', self.tokens),
+            overrides.get('seconds', self.seconds),
+            overrides.get('action', self.action),
+        )
+
+
+DEFAULT_BUDGET = ThinkingBudget(THINKING_BUDGET_TOKENS, THINKING_BUDGET_SECONDS, THINKING_BUDGET_ACTION)
+_MODEL_BUDGETS = {
+    model_name(model): DEFAULT_BUDGET.with_overrides(overrides)
+    for model, overrides in THINKING_BUDGET_MODELS.items()
+}
+
+
+def parse_budget_header(value):
+    """(tokens, seconds) from an X-Thinking-Budget value; raises ValueError"""
+    value = value.strip().lower()
+    if value.endswith('s'):
+        seconds = float(value[:-1])
+        if seconds < 0:
+            raise ValueError(value)
+        return 0, seconds
+    tokens = int(value)
+    if tokens < 0:
+        raise ValueError(value)
+    return tokens, 0
+
+
+def budget_for(model, headers=None):
+    """The budget of a request: the model's, replaced by the request headers if they set one
+
+    Raises ValueError for a malformed header.
+    """
+    budget = _MODEL_BUDGETS.get(model_name(model), DEFAULT_BUDGET)
+    if headers is None:
+        return budget
+    overrides = {}
+    value = headers.get(BUDGET_HEADER)
+    if value:
+        overrides['tokens'], overrides['seconds'] = parse_budget_header(value)
+    action = headers.get(ACTION_HEADER)
+    if action:
+        overrides['action'] = action.strip().lower()
+    return budget.with_overrides(overrides) if overrides else budget
+
+
+class ThinkingBudgetExceeded(Exception):
+    """A thinking block ran past its budget and the request is answered with an error"""
+
+    def __init__(self, kind, limit):
+        unit = 's' if kind == 'seconds' else ' tokens'
+        super().__init__(f"Thinking budget of {limit:g}{unit} exceeded")
+        self.kind = kind
+        self.limit = limit
+
+    def frame(self):
+        """NDJSON error frame that ends the response stream"""
+        return json.dumps({"error": str(self), "thinking_budget": self.kind}).encode('utf-8') + b'\n'
+
+
+class ThinkingLengths:
+    """Per-model moving average of thinking tokens, from blocks that ended within budget"""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, tokens):
+        with self._lock:
+            average = self._tokens.get(model, tokens)
+            self._tokens[model] = 0.8 * average + 0.2 * tokens
+
+    def estimate(self, model):
+        return self._tokens.get(model)
+
+
+THINKING_LENGTHS = ThinkingLengths()
+
+
+class BudgetTracker:
+    """Counts the thinking of one /api/chat stream against its budget
+
+    Call exceeded() after every upstream frame has gone through the
+    stripper.  Once it returns True, cut_off() either raises
+    ThinkingBudgetExceeded or returns the body of the request to send
+    instead: the original one with the model's output so far, closed with
+    the close tag of the open block, as the start of the assistant message.  Ollama then
+    continues that message, i.e. answers right away.
+    """
+
+    def __init__(self, budget, model, lengths=THINKING_LENGTHS):
+        self.budget = budget
+        self.model = model_name(model)
+        self.lengths = lengths
+        self.tokens = 0
+        self.thinking_since = None
+        self.cut = False
+        self._learned = False
+        # The raw output so far, only needed to re-issue the request
+        self._content = [] if budget.action == 'reissue' else None
+
+    def exceeded(self, line, stripper):
+        if self.cut:
+            return False
+        if self._content is not None and not stripper.thinking_finished:
+            self._collect(line)
+        if not stripper.thinking_started:
+            if stripper.thinking_finished and not self._learned:
+                self._learned = True
+                self.lengths.observe(self.model, self.tokens)
+            return False
+        if self.thinking_since is None:
+            self.thinking_since = time.monotonic()
+        self.tokens += 1
+        if self.budget.tokens is not None and self.tokens > self.budget.tokens:
+            return True
+        return (
+            self.budget.seconds is not None and
+            time.monotonic() - self.thinking_since > self.budget.seconds
+        )
+
+    def cut_off(self, upstream_request, stripper):
+        """Record the cutoff; the body to re-issue, or raises ThinkingBudgetExceeded"""
+        self.cut = True
+        THINKING_BUDGET_HITS.labels(model=self.model, action=self.budget.action).inc()
+        expected = self.lengths.estimate(self.model)
+        if expected is not None and expected > self.tokens:
+            THINKING_BUDGET_TOKENS_SAVED.labels(model=self.model).inc(expected - self.tokens)
+        stripper.close_block()
+        if self.budget.action == 'error':
+            if self.budget.tokens is not None and self.tokens > self.budget.tokens:
+                raise ThinkingBudgetExceeded('tokens', self.budget.tokens)
+            raise ThinkingBudgetExceeded('seconds', self.budget.seconds)
+        return reissue_body(upstream_request.data, "".join(self._content) + f"\n{stripper.close_tag}\n\n")
+
+    def _collect(self, line):
+        try:
+            # NDJSONFramer hands out memoryviews, which only orjson decodes
+            frame = json_backend.loads(bytes(line))
+        except (json_backend.JSONDecodeError, UnicodeDecodeError):
+            return
+        message = frame.get('message') if isinstance(frame, dict) else None
+        content = message.get('content') if isinstance(message, dict) else None
+        if isinstance(content, str):
+            self._content.append(content)
+
+
+def reissue_body(data, prefix):
+    """Request body that continues the assistant message starting with ``prefix``"""
+    data = copy.copy(data)
+    messages = list(data.get('messages') or [])
+    if messages and isinstance(messages[-1], dict) and messages[-1].get('role') == 'assistant':
+        # The client already started the answer: keep its text in front
+        last = dict(messages[-1])
+        last['content'] = (last.get('content') or '') + prefix
+        messages[-1] = last
+    else:
+        messages.append({"role": "assistant", "content": prefix})
+    data['messages'] = messages
+    return json_backend.dumps(data)
@@ -0,0 +1,129 @@
+"""Separate deadlines for each phase of an upstream generation."""
+import asyncio
+import json
+import os
+import time
+
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+from backend_pool import model_name
+from metrics import STREAM_TIMEOUTS
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the async server
+    aiohttp = None
+
+# Configuration
+# REQUEST_TIMEOUT stays the default for the phases it used to cover
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT") or 60)
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT") or REQUEST_TIMEOUT)
+# Until Ollama sends the response headers, i.e. model load and prompt evaluation
+FIRST_BYTE_TIMEOUT = float(os.getenv("FIRST_BYTE_TIMEOUT") or REQUEST_TIMEOUT)
+# Until the first answer token after the thinking block (0 = no limit)
+FIRST_TOKEN_TIMEOUT = float(os.getenv("FIRST_TOKEN_TIMEOUT") or 0)
+# Longest silence between two upstream reads once the stream started
+CHUNK_GAP_TIMEOUT = float(os.getenv("CHUNK_GAP_TIMEOUT") or REQUEST_TIMEOUT)
+# Whole request (0 = no limit)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE") or 0)
+# Per-model overrides, e.g. {"qwen3:32b": {"first_token": 600, "total": 1800}}
+MODEL_TIMEOUTS = json.loads(os.getenv("MODEL_TIMEOUTS") or "{}")
+
+PHASES = ('connect', 'first_byte', 'first_token', 'chunk_gap', 'total')
+
+
+class PhaseTimeouts:
+    """Deadlines in seconds per phase; 0 means no limit and is stored as None"""
+
+    def __init__(self, connect, first_byte, first_token, chunk_gap, total):
+        self.connect = connect or None
+        self.first_byte = first_byte or None
+        self.first_token = first_token or None
+        self.chunk_gap = chunk_gap or None
+        self.total = total or None
+
+    def with_overrides(self, overrides):
+        values = {phase: getattr(self, phase) for phase in PHASES}
+        values.update({phase: float(value or 0) for phase, value in overrides.items() if phase in PHASES})
+        return PhaseTimeouts(**values)
+
+
+DEFAULT_TIMEOUTS = PhaseTimeouts(
+    CONNECT_TIMEOUT, FIRST_BYTE_TIMEOUT, FIRST_TOKEN_TIMEOUT, CHUNK_GAP_TIMEOUT, REQUEST_DEADLINE
+)
+_MODEL_TIMEOUTS = {
+    model_name(model): DEFAULT_TIMEOUTS.with_overrides(overrides)
+    for model, overrides in MODEL_TIMEOUTS.items()
+}
+
+
+def timeouts_for(model):
+    return _MODEL_TIMEOUTS.get(model_name(model), DEFAULT_TIMEOUTS)
+
+
+class PhaseTimeoutError(Exception):
+    """A phase of the request ran past its deadline"""
+
+    def __init__(self, phase, limit):
+        super().__init__(f"Upstream {phase.replace('_', ' ')} timeout of {limit:g}s exceeded")
+        self.phase = phase
+        self.limit = limit
+
+    def frame(self):
+        """NDJSON error frame that ends the response stream"""
+        return json.dumps({"error": str(self), "timeout": self.phase}).encode('utf-8') + b'\n'
+
+
+def record_timeout(phase):
+    STREAM_TIMEOUTS.labels(phase=phase).inc()
+
+
+def request_phase(exc):
+    """The phase an error raised while waiting for the response headers timed out in"""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return 'connect'
+    if isinstance(exc, requests.exceptions.Timeout):
+        return 'first_byte'
+    if aiohttp is not None:
+        if isinstance(exc, aiohttp.ConnectionTimeoutError):
+            return 'connect'
+        if isinstance(exc, asyncio.TimeoutError):
+            return 'first_byte'
+    return None
+
+
+class StreamClock:
+    """Checks the first-token and total deadlines while a stream is running
+
+    ``started`` is the time.monotonic() at which the request was sent.
+    """
+
+    def __init__(self, timeouts, started):
+        self.timeouts = timeouts
+        self.first_token_deadline = started + timeouts.first_token if timeouts.first_token else None
+        self.total_deadline = started + timeouts.total if timeouts.total else None
+        self.active = self.first_token_deadline is not None or self.total_deadline is not None
+
+    def check(self, answered):
+        """Raise PhaseTimeoutError if a deadline has passed"""
+        now = time.monotonic()
+        if self.total_deadline is not None and now > self.total_deadline:
+            raise PhaseTimeoutError('total', self.timeouts.total)
+        if not answered and self.first_token_deadline is not None and now > self.first_token_deadline:
+            raise PhaseTimeoutError('first_token', self.timeouts.first_token)
+
+
+def set_read_timeout(response, seconds):
+    """Change the socket read timeout of a streaming requests response"""
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        sock.settimeout(seconds)
+
+
+def is_read_timeout(exc):
+    """Whether an error raised while reading a requests response body is a read timeout"""
+    if isinstance(exc, requests.exceptions.Timeout):
+        return True
+    return isinstance(exc, requests.exceptions.ConnectionError) and bool(exc.args) and \
+        isinstance(exc.args[0], ReadTimeoutError)
@@ -0,0 +1,118 @@
+"""Per-model token count estimates for prompt text, with a cache of recent counts."""
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from backend_pool import model_name
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # tokenizers is only needed for MODEL_TOKENIZERS
+    Tokenizer = None
+
+logger = logging.getLogger("unthink-proxy")
+
+# Configuration
+# Name of the registered estimator factory to use
+TOKEN_ESTIMATOR = os.getenv("TOKEN_ESTIMATOR") or "default"
+# Characters per token of the character-based estimate, globally and per model
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN") or 4)
+MODEL_CHARS_PER_TOKEN = {
+    model_name(model): float(ratio) for model, ratio in json.loads(os.getenv("MODEL_CHARS_PER_TOKEN") or "{}").items()
+}
+# tokenizer.json files (Hugging Face format) for exact counts, e.g. {"qwen3:8b": "/models/qwen3/tokenizer.json"}
+MODEL_TOKENIZERS = {
+    model_name(model): path for model, path in json.loads(os.getenv("MODEL_TOKENIZERS") or "{}").items()
+}
+# Counts remembered per worker; conversation history is counted again on every turn
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE") or 10000)
+
+
+class CharEstimator:
+    """Counts tokens as characters divided by a fixed ratio"""
+
+    def __init__(self, chars_per_token=CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+
+class TokenizerEstimator:
+    """Counts tokens with the model's own tokenizer (needs the tokenizers package)"""
+
+    def __init__(self, path):
+        self.tokenizer = Tokenizer.from_file(path)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids) if text else 0
+
+
+def chars_estimator(model):
+    return CharEstimator(MODEL_CHARS_PER_TOKEN.get(model, CHARS_PER_TOKEN))
+
+
+def default_estimator(model):
+    """The model's tokenizer if one is configured and loadable, else the character estimate"""
+    path = MODEL_TOKENIZERS.get(model)
+    if path and Tokenizer is not None:
+        try:
+            return TokenizerEstimator(path)
+        except Exception as e:
+            logger.warning(f"Could not load the tokenizer of {model}: {str(e)}")
+    return chars_estimator(model)
+
+
+# Factories taking a model name and returning an object with count(text)
+ESTIMATORS = {
+    "default": default_estimator,
+    "chars": chars_estimator,
+}
+
+
+def register_estimator(name, factory):
+    """Make a custom estimator available as TOKEN_ESTIMATOR=<name>"""
+    ESTIMATORS[name] = factory
+
+
+class TokenCounter:
+    """Token counts per model, with one estimator per model and an LRU cache of counts"""
+
+    def __init__(self, estimator=TOKEN_ESTIMATOR, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.estimator_name = estimator
+        self.cache_size = cache_size
+        self._estimators = {}
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimator(self, model):
+        model = model_name(model)
+        estimator = self._estimators.get(model)
+        if estimator is None:
+            estimator = ESTIMATORS[self.estimator_name](model)
+            with self._lock:
+                estimator = self._estimators.setdefault(model, estimator)
+        return estimator
+
+    def count(self, model, text):
+        if not text:
+            return 0
+        # The text itself is not kept alive by the cache
+        key = (model_name(model), len(text), hash(text))
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+        count = self.estimator(model).count(text)
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+
+TOKEN_COUNTER = TokenCounter()
@@ -4,11 +4,41 @@ import requests
 import json
 import os
 import logging
+import math
 import time
 from logging.handlers import RotatingFileHandler
 import signal
 import sys
+import threading
 from metrics import MetricsMiddleware, THINKING_CONTENT_REMOVED, OLLAMA_REQUEST_ERRORS, get_metrics
+from admission import ADMISSION, AdmissionRejected
+from backend_pool import OLLAMA_SERVERS, BackendPool
+from compaction import COMPACTION_ENABLED, compact_history
+from capture import CAPTURE
+from health_prober import health_status
+from history import HISTORY_STRIP_ENABLED, strip_history
+from log_pipeline import debug_sampled, setup_logging
+from metadata_cache import METADATA_CACHE, METADATA_CACHE_ENABLED, MODEL_MANAGEMENT_PATHS
+from model_capabilities import (
+    CAPABILITIES, CAPABILITY_PROBE_TIMEOUT, THINKING_SUPPRESSION_ENABLED, suppress_thinking
+)
+from ndjson_stream import UPSTREAM_READ_SIZE, ChatStreamProcessor, iter_frames
+from request_pipeline import RequestError, normalize_request
+from resilience import CircuitOpenError, RetryPolicy, error_status
+from response_cache import (
+    RESPONSE_CACHE, RESPONSE_CACHE_ENABLED, CacheRecorder, is_cacheable, request_key
+)
+from singleflight import FLIGHTS, SINGLE_FLIGHT_ENABLED, flight_key
+from stream_abort import OUTPUT_LENGTHS, DisconnectWatch, client_socket, record_abort
+from stream_metrics import StreamMetrics
+from tag_profiles import TAG_PROFILES
+from think_stripper import ThinkStripper
+from thinking_budget import BudgetTracker, ThinkingBudgetExceeded, budget_for
+from timeouts import (
+    REQUEST_TIMEOUT, PhaseTimeoutError, StreamClock, is_read_timeout, record_timeout, request_phase,
+    set_read_timeout, timeouts_for
+)
+from upstream import get_session
 
 # Configure logging
 log_dir = os.getenv("LOG_DIR", "logs")
@@ -19,25 +49,20 @@ log_level = os.getenv("LOG_LEVEL", "INFO").upper()
 logger = logging.getLogger("unthink-proxy")
 logger.setLevel(getattr(logging, log_level))
 
-# Console handler
+# 日志经队列由后台线程写出，请求线程不会阻塞在磁盘I/O上
 console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
-
-# File handler
 file_handler = RotatingFileHandler(
     os.path.join(log_dir, "unthink-proxy.log"),
     maxBytes=10485760,  # 10MB
     backupCount=5
 )
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
+log_pipeline = setup_logging(logger, [console_handler, file_handler])
 
 app = Flask(__name__)
 resources = {
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
         "allow_headers": "*"
     }
 }
@@ -79,10 +104,13 @@ OLLAMA_SERVER = os.getenv("OLLAMA_SERVER") or "http://ollama:11434"
 PROXY_PORT = int(os.getenv("PROXY_PORT") or 11434)
 OPEN_THINK_TAG = os.getenv("OPEN_THINK_TAG") or "<" + "think>"
 CLOSE_THINK_TAG = os.getenv("CLOSE_THINK_TAG") or "<" + "/think>"
-REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT") or 60)
 MAX_RETRIES = int(os.getenv("MAX_RETRIES") or 3)
 RETRY_DELAY = int(os.getenv("RETRY_DELAY") or 1)
-DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
+
+RETRY_POLICY = RetryPolicy(MAX_RETRIES, RETRY_DELAY)
+
+# 上游Ollama服务器池（每个服务器由后台线程探测健康状态，各worker共享结果）
+BACKENDS = BackendPool(OLLAMA_SERVERS or [OLLAMA_SERVER])
 
 
 def process_thinking_content(
@@ -90,49 +118,44 @@ def process_thinking_content(
     thinking_started,
     thinking_finished
 ):
-    """Process content based on thinking tags state"""
+    """Process one complete piece of content based on thinking tags state
+
+    Stateless wrapper around ThinkStripper for callers that track the two
+    flags themselves; streams should use ChatStreamProcessor instead.
+    """
     if not message_content:
         return "", thinking_started, thinking_finished
 
-    # Handle closing tag
-    if CLOSE_THINK_TAG in message_content:
-        thinking_started = False
-        thinking_finished = True
-        # If there's content after CLOSE_THINK_TAG, keep it
-        content_after = message_content.split(CLOSE_THINK_TAG)[-1]
-        # Increment metric for removed thinking content
-        THINKING_CONTENT_REMOVED.inc()
-        return content_after, thinking_started, thinking_finished
-
-    # Handle opening tag
-    if OPEN_THINK_TAG in message_content:
-        thinking_started = True
-        # If there's content before OPEN_THINK_TAG, keep it
-        content_before = message_content.split(OPEN_THINK_TAG)[0]
-        return content_before, thinking_started, thinking_finished
-
-    # If we're in thinking mode, return empty
-    if thinking_started:
-        return "", thinking_started, thinking_finished
+    stripper = ThinkStripper(OPEN_THINK_TAG, CLOSE_THINK_TAG)
+    stripper.resume(thinking_started, thinking_finished)
+    content = stripper.feed(message_content) + stripper.flush()
+    # Increment metric for removed thinking content
+    THINKING_CONTENT_REMOVED.inc(stripper.blocks_removed)
+    return content, stripper.thinking_started, stripper.thinking_finished
 
-    return message_content, thinking_started, thinking_finished
+
+def stream_headers(request_id, cache=None, compaction=None):
+    """Response headers for proxied API responses"""
+    headers = {
+        'X-Accel-Buffering': 'no',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+        'Content-Type': 'application/json',
+        'X-Request-ID': request_id
+    }
+    if cache:
+        headers['X-Cache'] = cache
+    if compaction is not None:
+        headers.update(compaction.headers())
+    return headers
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring"""
-    try:
-        # Check if Ollama server is reachable
-        response = requests.get(f"{OLLAMA_SERVER}/api/tags", timeout=5)
-        if response.status_code == 200:
-            return Response(json.dumps({"status": "healthy"}), status=200, mimetype='application/json')
-        else:
-            return Response(json.dumps({"status": "degraded", "message": "Ollama server returned non-200 status"}), 
-                           status=503, mimetype='application/json')
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return Response(json.dumps({"status": "unhealthy", "message": str(e)}), 
-                       status=503, mimetype='application/json')
+    # 由后台探测线程定期检查Ollama，这里只返回最近一次的结果
+    state = BACKENDS.health()
+    return Response(json.dumps(state), status=health_status(state), mimetype='application/json')
 
 
 @app.route('/metrics', methods=['GET'])
@@ -141,155 +164,131 @@ def metrics():
     return Response(get_metrics(), mimetype='text/plain')
 
 
+def show_model(model):
+    """/api/show of a model, for the capability registry"""
+    response = get_session().post(
+        f"{BACKENDS.choose().url}/api/show",
+        json={"model": model},
+        timeout=CAPABILITY_PROBE_TIMEOUT
+    )
+    with response:
+        response.raise_for_status()
+        return response.json()
+
+
 @app.route('/api/<path:path>', methods=['POST'])
 def proxy_api(path):
     """Proxy API requests to Ollama server"""
     start_time = time.time()
+    started = time.monotonic()
     request_id = f"{int(start_time)}-{os.getpid()}"
+    # 只对抽样到的请求记录请求头、请求体和原始内容
+    debug = debug_sampled()
     
     # 记录请求头信息，帮助调试
-    if DEBUG_MODE:
+    if debug:
         logger.debug(f"[{request_id}] Request headers: {dict(request.headers)}")
         logger.debug(f"[{request_id}] Request path: {path}")
-        logger.debug(f"[{request_id}] Request method: {request.method}")
-        logger.debug(f"[{request_id}] Request data: {request.get_data()}")
+        logger.debug(f"[{request_id}] Received Content-Type: {request.headers.get('Content-Type', '')}")
     
+    if path in MODEL_MANAGEMENT_PATHS:
+        # 模型管理请求原样转发，并使元数据缓存失效
+        return catch_all(f"api/{path}")
+
+    if path not in ['generate', 'chat', 'show']:
+        logger.warning(f"[{request_id}] Invalid path requested: {path}")
+        return Response('Not Found', status=404)
+
     # 检查是否是LiteLLM请求
     user_agent = request.headers.get('User-Agent', '')
     is_litellm = 'litellm' in user_agent.lower()
-    if is_litellm and DEBUG_MODE:
+    if is_litellm and debug:
         logger.debug(f"[{request_id}] 检测到LiteLLM请求")
     
-    # 检查Content-Type，但更宽容地处理
-    content_type = request.headers.get('Content-Type', '')
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Received Content-Type: {content_type}")
-    
-    # 尝试解析请求数据，无论Content-Type是什么
+    # 只解析一次请求数据，无论Content-Type是什么
     try:
-        # 首先尝试使用request.json
-        try:
-            request_data = request.json
-        except Exception as e:
-            # 如果request.json解析失败，尝试手动解析
-            logger.warning(f"[{request_id}] Failed to parse request.json: {str(e)}")
-            data = request.get_data()
-            if data:
-                try:
-                    request_data = json.loads(data)
-                except json.JSONDecodeError as e:
-                    # 对于LiteLLM请求，尝试特殊处理
-                    if is_litellm:
-                        logger.info(f"[{request_id}] 检测到LiteLLM请求，尝试特殊处理")
-                        # 将请求体作为字符串读取
-                        data_str = data.decode('utf-8')
-                        # 尝试修复常见的JSON格式问题
-                        try:
-                            # 尝试将单引号替换为双引号
-                            fixed_data = data_str.replace("'", "\"")
-                            request_data = json.loads(fixed_data)
-                            logger.info(f"[{request_id}] Successfully fixed and parsed JSON")
-                        except Exception:
-                            return Response(
-                                json.dumps({"error": f"Invalid JSON format: {str(e)}"}),
-                                status=400,
-                                mimetype='application/json'
-                            )
-                    else:
-                        logger.error(f"[{request_id}] Failed to parse request data: {str(e)}")
-                        # 尝试修复常见的JSON格式问题
-                        try:
-                            # 尝试将单引号替换为双引号
-                            fixed_data = data.decode('utf-8').replace("'", "\"")
-                            request_data = json.loads(fixed_data)
-                            logger.info(f"[{request_id}] Successfully fixed and parsed JSON")
-                        except Exception:
-                            return Response(
-                                json.dumps({"error": f"Invalid JSON format: {str(e)}"}),
-                                status=400,
-                                mimetype='application/json'
-                            )
-            else:
-                logger.error(f"[{request_id}] Empty request body")
-                return Response(
-                    json.dumps({"error": "Empty request body"}),
-                    status=400,
-                    mimetype='application/json'
-                )
-    except json.JSONDecodeError as e:
-        logger.error(f"[{request_id}] Invalid JSON format: {str(e)}")
+        upstream_request = normalize_request(path, request.get_data(), is_litellm, request_id)
+    except RequestError as e:
         return Response(
-            json.dumps({"error": f"Invalid JSON format: {str(e)}"}),
+            json.dumps({"error": str(e)}),
+            status=e.status,
+            mimetype='application/json'
+        )
+    path = upstream_request.path
+    try:
+        budget = budget_for(upstream_request.model, request.headers)
+    except ValueError as e:
+        return Response(
+            json.dumps({"error": f"Invalid thinking budget: {str(e)}"}),
             status=400,
             mimetype='application/json'
         )
+
+    # 按模型选择思考标签配置（未配置时使用OPEN_THINK_TAG/CLOSE_THINK_TAG）
+    tag_profile = TAG_PROFILES.profile_for(upstream_request.model)
+
+    # 历史消息中的思考内容只会增加提示词处理时间
+    if HISTORY_STRIP_ENABLED:
+        strip_history(upstream_request, OPEN_THINK_TAG, CLOSE_THINK_TAG, request_id, profile=tag_profile)
+
+    # 历史过长时丢弃最早的对话轮次，避免Ollama静默截断
+    compaction = None
+    if COMPACTION_ENABLED:
+        compaction = compact_history(upstream_request, request_id)
+
+    # 模型支持时直接在上游关闭思考，否则仍由流式剥离处理
+    if THINKING_SUPPRESSION_ENABLED and path in ('chat', 'generate'):
+        suppress_thinking(upstream_request, CAPABILITIES.switch_for(upstream_request.model, show_model))
     
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Request - Method: {request.method}")
-        logger.debug(f"[{request_id}] Request - Path: {path}")
-        logger.debug(f"[{request_id}] Request - Headers: {dict(request.headers)}")
-        try:
-            logger.debug(f"[{request_id}] Request - JSON: {request.json}")
-        except Exception as e:
-            logger.debug(f"[{request_id}] Error parsing JSON: {str(e)}")
+    # 记录解析后的请求数据
+    if debug:
+        logger.debug(f"[{request_id}] Parsed request data: {upstream_request.data}")
     
-    if path not in ['generate', 'chat', 'show']:
-        logger.warning(f"[{request_id}] Invalid path requested: {path}")
-        return Response('Not Found', status=404)
-
-    # 获取请求数据
-    try:
-        request_data = request.json
-    except Exception:
-        # 如果request.json解析失败，尝试手动解析
-        try:
-            request_data = json.loads(request.get_data())
-        except json.JSONDecodeError as e:
-            logger.error(f"[{request_id}] Failed to parse JSON: {str(e)}")
+    # 确定性请求可以直接从缓存返回
+    cache_recorder = None
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED and is_cacheable(upstream_request):
+        cache_key = request_key(upstream_request)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info(f"[{request_id}] Serving cached response")
             return Response(
-                json.dumps({"error": "Invalid JSON format"}),
-                status=400,
-                mimetype='application/json'
+                cached.replay(upstream_request.stream),
+                mimetype='application/json',
+                headers=stream_headers(request_id, cache='HIT', compaction=compaction)
             )
+        cache_recorder = CacheRecorder(RESPONSE_CACHE, cache_key, path)
     
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Parsed request data: {request_data}")
-    
-    # 记录解析后的请求数据
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Parsed request data: {request_data}")
-    
-    # 处理LiteLLM特殊请求格式
-    user_agent = request.headers.get('User-Agent', '')
-    is_litellm = 'litellm' in user_agent.lower()
+    # 相同的请求合并到同一个上游生成
+    flight = None
+    if SINGLE_FLIGHT_ENABLED and path in ('chat', 'generate'):
+        flight, leader = FLIGHTS.join(flight_key(upstream_request, budget, tag_profile))
+        if not leader:
+            logger.info(f"[{request_id}] Joining in-flight generation")
+            return Response(
+                flight.subscribe(),
+                mimetype='application/json',
+                headers=stream_headers(request_id, compaction=compaction)
+            )
     
-    # 如果是LiteLLM请求，检查是否需要转换格式
-    if is_litellm and path == 'generate' and 'prompt' in request_data:
-        logger.info(f"[{request_id}] 转换LiteLLM generate请求格式为chat格式")
-        # 将generate格式转换为chat格式
+    # 按模型限制并发：超出时排队等待，队列满或等待超时则快速拒绝
+    slot = None
+    limiter = ADMISSION.limiter(upstream_request.model) if path in ('chat', 'generate') else None
+    if limiter is not None:
         try:
-            chat_data = {
-                "model": request_data.get("model", ""),
-                "messages": [
-                    {"role": "user", "content": request_data.get("prompt", "")}
-                ],
-                "stream": request_data.get("stream", False)
-            }
-            
-            # 如果有options，转换相关参数
-            if "options" in request_data:
-                options = request_data["options"]
-                if "temperature" in options:
-                    chat_data["temperature"] = options["temperature"]
-                if "num_predict" in options:
-                    chat_data["max_tokens"] = options["num_predict"]
-            
-            request_data = chat_data
-            path = "chat"  # 改为使用chat API
-            logger.info(f"[{request_id}] 已转换为chat格式: {request_data}")
-        except Exception as e:
-            logger.error(f"[{request_id}] 转换LiteLLM请求格式失败: {str(e)}")
-    
+            slot = limiter.acquire()
+        except AdmissionRejected as e:
+            logger.warning(f"[{request_id}] Request rejected: {str(e)}")
+            if flight is not None:
+                flight.publish(json.dumps({"error": str(e)}).encode('utf-8') + b'\n')
+                flight.finish()
+            return Response(
+                json.dumps({"error": str(e)}),
+                status=e.status,
+                mimetype='application/json',
+                headers={'Retry-After': str(e.retry_after)}
+            )
+
     # 构建请求头
     headers = {
         "Content-Type": "application/json",
@@ -297,115 +296,213 @@ def proxy_api(path):
     }
     
     # 记录将要发送的请求
-    if DEBUG_MODE:
-        logger.debug(f"[{request_id}] Sending request to: {OLLAMA_SERVER}/api/{path}")
-        logger.debug(f"[{request_id}] With headers: {headers}")
-        logger.debug(f"[{request_id}] With data: {request_data}")
+    if debug:
+        logger.debug(f"[{request_id}] Sending request to: /api/{path} of {len(BACKENDS.backends)} backend(s)")
+        logger.debug(f"[{request_id}] Forwarding original body: {not upstream_request.modified}")
     
-    # Retry logic for resilience
-    for attempt in range(MAX_RETRIES):
+    body = upstream_request.body()
+
+    def fail(message, status, retry_after=None):
+        if slot is not None:
+            slot.release()
+        if flight is not None:
+            flight.publish(json.dumps({"error": message}).encode('utf-8') + b'\n')
+            flight.finish()
+        return Response(
+            json.dumps({"error": message}),
+            status=status,
+            mimetype='application/json',
+            headers={'Retry-After': str(retry_after)} if retry_after else None
+        )
+
+    # 重试策略：只重试连接类错误，指数退避加随机抖动，并受全局重试预算限制；
+    # 有其他可用后端时立即换一个后端重试
+    RETRY_POLICY.start()
+    phase_timeouts = timeouts_for(upstream_request.model)
+    clock = StreamClock(phase_timeouts, time.monotonic())
+    tried = []
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            response = requests.post(
-                f"{OLLAMA_SERVER}/api/{path}",
-                json=request_data,
+            lease = BACKENDS.acquire(upstream_request.model, exclude=tried)
+        except CircuitOpenError as e:
+            logger.error(f"[{request_id}] {str(e)}")
+            return fail(str(e), 503, e.retry_after)
+        response = None
+        try:
+            sent_at = time.time()
+            response = get_session().post(
+                f"{lease.url}/api/{path}",
+                data=body,
                 headers=headers,
                 stream=True,
-                timeout=REQUEST_TIMEOUT
+                timeout=(phase_timeouts.connect, phase_timeouts.first_byte)
             )
             response.raise_for_status()  # Raise exception for non-200 status codes
+            lease.record_response(time.time() - sent_at)
+            if phase_timeouts.chunk_gap != phase_timeouts.first_byte:
+                set_read_timeout(response, phase_timeouts.chunk_gap)
             break
         except requests.exceptions.RequestException as e:
+            if response is not None:
+                # 错误状态码的响应也占用着连接池中的连接
+                response.close()
+            phase = request_phase(e)
+            if phase is not None:
+                record_timeout(phase)
+            lease.release()
+            lease.record_failure(e)
+            tried.append(lease.backend)
             error_type = type(e).__name__
             OLLAMA_REQUEST_ERRORS.labels(error_type=error_type).inc()
-            logger.error(f"[{request_id}] Request attempt {attempt+1} failed: {str(e)}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-            else:
-                logger.error(f"[{request_id}] All retry attempts failed")
-                return Response(json.dumps({"error": str(e)}), status=503, mimetype='application/json')
+            logger.error(f"[{request_id}] Request attempt {attempt} failed: {str(e)}")
+            delay = RETRY_POLICY.next_delay(e, attempt)
+            if delay is None:
+                logger.error(f"[{request_id}] Giving up after {attempt} attempt(s)")
+                return fail(str(e), error_status(e))
+            if len(set(tried)) >= len(BACKENDS.backends):
+                # Every backend has failed already: do not hold a worker thread
+                # asleep for the backoff, let the client retry after it instead
+                logger.error(f"[{request_id}] All backends failed after {attempt} attempt(s)")
+                return fail(str(e), 503, max(1, math.ceil(delay)))
+
+    def reissue(data):
+        # 在同一个后端上重新请求，提示词的KV缓存仍然可用
+        retried = get_session().post(
+            f"{lease.url}/api/{path}",
+            data=data,
+            headers=headers,
+            stream=True,
+            timeout=(phase_timeouts.connect, phase_timeouts.first_byte)
+        )
+        try:
+            retried.raise_for_status()
+        except requests.exceptions.HTTPError:
+            retried.close()
+            raise
+        if phase_timeouts.chunk_gap != phase_timeouts.first_byte:
+            set_read_timeout(retried, phase_timeouts.chunk_gap)
+        return retried
+
+    def release_upstream():
+        # Closing the upstream response before the end makes Ollama stop generating
+        response.close()
+        lease.release()
+        if slot is not None:
+            slot.release()
+
+    # 思考阶段不向客户端写数据，服务器无法自行发现客户端断开，需要主动检查
+    watch = DisconnectWatch.for_socket(client_socket(request.environ)) if flight is None else None
+    capture = CAPTURE.start(upstream_request, start_time, sent_at)
 
     def generate():
-        thinking_started = False
-        thinking_finished = False
-        stripped_whitespace = False
-        chunk_count = 0
+        nonlocal response
+        processor = ChatStreamProcessor(OPEN_THINK_TAG, CLOSE_THINK_TAG, request_id, debug, profile=tag_profile)
+        stats = StreamMetrics(upstream_request.model, started)
+        tracker = None
+        if budget.active and path == 'chat' and upstream_request.stream:
+            tracker = BudgetTracker(budget, upstream_request.model)
+        aborted = None
+        completed = False
+        last_output = None
         
         try:
-            for chunk in response.iter_lines():
-                chunk_count += 1
-                
-                if chunk:
-                    try:
-                        # Parse the JSON response
-                        data = json.loads(chunk.decode('utf-8'))
-
-                        # Check if this is a message with content
-                        if (
-                            'message' in data and
-                            'content' in data['message'] and
-                            data['message']['content'] != ''
-                        ):
-                            content = data['message']['content']
-                            # Raw response from LLM
-                            if DEBUG_MODE:
-                                logger.debug(f"[{request_id}] Raw content: {content}")
-                            
-                            (
-                                cleaned_content,
-                                thinking_started,
-                                thinking_finished
-                            ) = process_thinking_content(
-                                content,
-                                thinking_started,
-                                thinking_finished
-                            )
-                            
-                            if thinking_finished and not stripped_whitespace:
-                                cleaned_content = cleaned_content.strip()
-                                if (
-                                    cleaned_content and
-                                    not cleaned_content.isspace()
-                                ):
-                                    stripped_whitespace = True
-                            
-                            if cleaned_content == '':
-                                continue
-
-                            # Update the content in the data
-                            data['message']['content'] = cleaned_content
-                            yield json.dumps(data).encode('utf-8') + b'\n'
-                        else:
-                            # Forward non-content messages (like 'done' messages)
-                            yield chunk + b'\n'
-
-                    except json.JSONDecodeError as e:
-                        logger.error(f"[{request_id}] JSON decode error: {str(e)}")
-                        yield chunk + b'\n'
-                        
+            while True:
+                for line in iter_frames(response.iter_content(chunk_size=UPSTREAM_READ_SIZE)):
+                    output = processor.process_line(line)
+                    stats.line(output, processor.stripper)
+                    if capture is not None:
+                        capture.frame(line, output)
+                    if output:
+                        output = bytes(output)
+                        last_output = output
+                        if cache_recorder is not None:
+                            cache_recorder.observe(output)
+                        yield output
+                    elif watch is not None and watch.client_gone():
+                        logger.info(f"[{request_id}] Client disconnected, aborting generation")
+                        aborted = 'client_disconnect'
+                        break
+                    if tracker is not None and tracker.exceeded(line, processor.stripper):
+                        break
+                    if clock.active:
+                        # 首个回答token和总时长的截止时间
+                        clock.check(last_output is not None)
+                else:
+                    completed = True
+                    if cache_recorder is not None:
+                        cache_recorder.finish()
+                    if last_output and b'"done":true' in last_output:
+                        OUTPUT_LENGTHS.observe(upstream_request.model, last_output)
+                    break
+                if aborted:
+                    break
+                # 思考超出预算：停止上游生成，闭合思考内容后重新请求，让模型直接回答
+                data = tracker.cut_off(upstream_request, processor.stripper)
+                stats.reissued()
+                logger.info(f"[{request_id}] Thinking budget exceeded after {tracker.tokens} tokens, re-issuing")
+                response.close()
+                response = reissue(data)
+
+        except GeneratorExit:
+            # The client (or every subscriber of the flight) went away
+            aborted = aborted or 'client_disconnect'
+            raise
         except Exception as e:
-            logger.error(f"[{request_id}] Error in generate function: {str(e)}")
-            # Return an error message that client can understand
-            error_data = {"error": str(e)}
-            yield json.dumps(error_data).encode('utf-8') + b'\n'
+            if is_read_timeout(e):
+                # 上游在两次数据之间停顿太久
+                e = PhaseTimeoutError('chunk_gap', phase_timeouts.chunk_gap)
+            if isinstance(e, PhaseTimeoutError):
+                logger.warning(f"[{request_id}] {str(e)}, aborting generation")
+                record_timeout(e.phase)
+                aborted = 'timeout'
+                yield e.frame()
+            elif isinstance(e, ThinkingBudgetExceeded):
+                logger.info(f"[{request_id}] {str(e)}, aborting generation")
+                aborted = 'thinking_budget'
+                yield e.frame()
+            else:
+                logger.error(f"[{request_id}] Error in generate function: {str(e)}")
+                # Return an error message that client can understand
+                error_data = {"error": str(e)}
+                yield json.dumps(error_data).encode('utf-8') + b'\n'
         finally:
+            # Hand the connection back to the pool
+            release_upstream()
+            if aborted:
+                record_abort(aborted, upstream_request.model, processor.chunk_count,
+                             time.time() - sent_at, upstream_request.num_predict)
+            stats.finish(last_output if completed else None, processor.stripper.chars_removed)
+            if capture is not None:
+                capture.finish(aborted or ('completed' if completed else 'error'))
+            THINKING_CONTENT_REMOVED.inc(processor.blocks_removed)
             duration = time.time() - start_time
-            logger.info(f"[{request_id}] Request completed in {duration:.2f}s, processed {chunk_count} chunks")
-
-    return Response(
-        generate(),
+            logger.info(f"[{request_id}] Request completed in {duration:.2f}s, processed {processor.chunk_count} chunks")
+
+    if flight is not None:
+        # 由后台线程驱动上游生成，本请求和后来的相同请求都作为订阅者
+        threading.Thread(target=flight.run, args=(generate(),), daemon=True).start()
+        # 订阅者创建时即计数；响应关闭时（即使从未迭代）会调用其close()退出
+        body_iter = flight.subscribe()
+    else:
+        body_iter = generate()
+
+    proxied = Response(
+        body_iter,
         mimetype='application/json',
-        headers={
-            'X-Accel-Buffering': 'no',
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/json',
-            'X-Request-ID': request_id
-        }
+        headers=stream_headers(
+            request_id, cache='MISS' if cache_recorder is not None else None, compaction=compaction
+        )
     )
+    if flight is None:
+        # The generator never runs its cleanup if the client leaves before the first chunk
+        proxied.call_on_close(release_upstream)
+    return proxied
 
 
 @app.route('/', defaults={'path': ''})
-@app.route('/<path:path>', methods=['GET', 'OPTIONS'])
+@app.route('/<path:path>', methods=['GET', 'OPTIONS', 'DELETE'])
 def catch_all(path):
     """Catch-all route to proxy all other requests to Ollama server"""
     request_id = f"{int(time.time())}-{os.getpid()}"
@@ -413,13 +510,30 @@ def catch_all(path):
     if request.method == 'OPTIONS':
         return Response('', 204)
 
+    # 元数据接口（如/api/tags）在TTL内直接从缓存返回
+    cache_ttl = None
+    if METADATA_CACHE_ENABLED and request.method == 'GET':
+        cache_ttl = METADATA_CACHE.ttl_for(path)
+    if cache_ttl:
+        entry = METADATA_CACHE.get(path)
+        if entry is not None:
+            status, headers, body = entry.respond(request.headers.get('If-None-Match'))
+            return Response(body, status, headers)
+
+    # 拉取、删除模型等操作会改变模型列表
+    changes_models = path.strip('/') in [f"api/{name}" for name in MODEL_MANAGEMENT_PATHS]
+    if changes_models:
+        METADATA_CACHE.invalidate()
+        CAPABILITIES.invalidate()
+
     try:
-        resp = requests.request(
+        resp = get_session().request(
             method=request.method,
-            url=f"{OLLAMA_SERVER}/{path}",
+            url=f"{BACKENDS.choose().url}/{path}",
             data=request.get_data(),
             cookies=request.cookies,
             allow_redirects=False,
+            stream=True,
             timeout=REQUEST_TIMEOUT,
             headers={
                 key: value for key, value in request.headers if key != 'Host'
@@ -435,7 +549,21 @@ def catch_all(path):
         headers = [(name, value) for (name, value) in resp.raw.headers.items()
                 if name.lower() not in excluded_headers]
         
-        return Response(resp.content, resp.status_code, headers)
+        if cache_ttl and resp.status_code == 200:
+            entry = METADATA_CACHE.put(path, resp.content, headers)
+            status, headers, body = entry.respond(request.headers.get('If-None-Match'))
+            return Response(body, status, headers)
+
+        def stream_body():
+            try:
+                yield from resp.iter_content(chunk_size=UPSTREAM_READ_SIZE)
+            finally:
+                resp.close()
+                if changes_models:
+                    METADATA_CACHE.invalidate()
+                    CAPABILITIES.invalidate()
+
+        return Response(stream_body(), resp.status_code, headers)
     
     except requests.exceptions.RequestException as e:
         logger.error(f"[{request_id}] Error in catch_all route: {str(e)}")
@@ -454,7 +582,7 @@ if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_handler)
     
     logger.info(f"Starting proxy server on port {PROXY_PORT}")
-    logger.info(f"Forwarding requests to {OLLAMA_SERVER}")
+    logger.info(f"Forwarding requests to {', '.join(b.url for b in BACKENDS.backends)}")
     logger.info(f"Log level set to {log_level}")
     
     # Use production-ready WSGI server if available
@@ -0,0 +1,110 @@
+"""Pooled keep-alive HTTP transport to the Ollama server."""
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import UPSTREAM_POOL_CONNECTIONS, UPSTREAM_POOL_EVICTIONS, UPSTREAM_POOL_WAIT
+
+# Configuration
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE") or 32)
+UPSTREAM_POOL_BLOCK = os.getenv("UPSTREAM_POOL_BLOCK", "false").lower() == "true"
+UPSTREAM_IDLE_TIMEOUT = float(os.getenv("UPSTREAM_IDLE_TIMEOUT") or 60)
+UPSTREAM_KEEPALIVE = os.getenv("UPSTREAM_KEEPALIVE", "true").lower() == "true"
+
+
+class _InstrumentedPoolMixin:
+    """Records pool hits/misses and wait time, and evicts idle connections"""
+
+    def _get_conn(self, timeout=None):
+        start = time.monotonic()
+        conn = super()._get_conn(timeout)
+        UPSTREAM_POOL_WAIT.observe(time.monotonic() - start)
+
+        released_at = getattr(conn, '_unthink_released_at', None)
+        if (
+            conn.sock is not None and
+            released_at is not None and
+            time.monotonic() - released_at > UPSTREAM_IDLE_TIMEOUT
+        ):
+            # The server may already have dropped it; reconnect instead
+            conn.close()
+            UPSTREAM_POOL_EVICTIONS.inc()
+
+        result = 'hit' if conn.sock is not None else 'miss'
+        UPSTREAM_POOL_CONNECTIONS.labels(result=result).inc()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._unthink_released_at = time.monotonic()
+        super()._put_conn(conn)
+
+
+class InstrumentedHTTPConnectionPool(_InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class InstrumentedHTTPSConnectionPool(_InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools use the instrumented connection pool classes"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': InstrumentedHTTPConnectionPool,
+            'https': InstrumentedHTTPSConnectionPool,
+        }
+
+
+def create_session():
+    """Build a requests session backed by a shared keep-alive connection pool"""
+    session = requests.Session()
+    adapter = PooledAdapter(
+        pool_connections=4,
+        pool_maxsize=UPSTREAM_POOL_SIZE,
+        pool_block=UPSTREAM_POOL_BLOCK
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # The session is shared by all clients: never keep cookies between requests
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    if not UPSTREAM_KEEPALIVE:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return this process's upstream session, creating it after a fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                # Sockets inherited from the parent must not be shared
+                _session = create_session()
+                _session_pid = pid
+    return _session
+
+
+def _reset_after_fork():
+    global _session, _session_pid, _session_lock
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)